@@ -0,0 +1,525 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+asyncio versions of the tracker and analytics classes, requires Python 3.5
+or newer.
+"""
+
+import asyncio
+import collections
+from io import BytesIO
+import re
+import ssl
+import time
+from http.client import RemoteDisconnected
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlparse
+import weakref
+
+from .analytics import PiwikAnalytics
+from .exceptions import ConfigurationError
+from .tracking import PiwikTracker
+from .tracking import PiwikTrackerEcommerce
+from .transport import HTTPConnectionPool
+from .transport import Response
+
+
+#: Finds what would end a header line or the request line early
+_ILLEGAL_CHARACTERS = re.compile(r'[\r\n]')
+
+
+class AsyncConnectionPool(object):
+    """
+    Keeps asyncio stream connections to the Piwik server open between
+    requests
+
+    Works like piwikapi.transport.HTTPConnectionPool, and additionally
+    limits the number of concurrent requests per scheme, host and port to
+    ``limit_per_endpoint``. A pool must only be used from one event loop.
+    """
+    REDIRECT_CODES = HTTPConnectionPool.REDIRECT_CODES
+
+    MAX_REDIRECTS = HTTPConnectionPool.MAX_REDIRECTS
+
+    IDEMPOTENT_METHODS = HTTPConnectionPool.IDEMPOTENT_METHODS
+
+    def __init__(self, max_size=10, idle_timeout=30, timeout=10,
+                 limit_per_endpoint=10):
+        """
+        :param max_size: Maximum number of idle connections per host
+        :type max_size: int
+        :param idle_timeout: Seconds after which idle connections are closed
+        :type idle_timeout: float
+        :param timeout: Timeout in seconds for one request
+        :type timeout: float or None
+        :param limit_per_endpoint: Maximum number of concurrent requests per
+            host
+        :type limit_per_endpoint: int
+        :rtype: None
+        """
+        if max_size < 1:
+            raise ConfigurationError('max_size must be at least 1')
+        if limit_per_endpoint < 1:
+            raise ConfigurationError('limit_per_endpoint must be at least 1')
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.limit_per_endpoint = limit_per_endpoint
+        self.__pool = {}
+        self.__semaphores = {}
+        self.__ssl_context = None
+
+    _get_key = HTTPConnectionPool._get_key
+
+    _can_resend = HTTPConnectionPool._can_resend
+
+    def _get_semaphore(self, key):
+        """
+        :param key: Pool key
+        :type key: tuple of (scheme, host, port)
+        :rtype: asyncio.Semaphore
+        """
+        semaphore = self.__semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit_per_endpoint)
+            self.__semaphores[key] = semaphore
+        return semaphore
+
+    async def _new_connection(self, key):
+        """
+        :param key: Pool key
+        :type key: tuple of (scheme, host, port)
+        :rtype: tuple of (StreamReader, StreamWriter)
+        """
+        scheme, host, port = key
+        if scheme == 'https':
+            if self.__ssl_context is None:
+                self.__ssl_context = ssl.create_default_context()
+            return await asyncio.open_connection(
+                host, port, ssl=self.__ssl_context, server_hostname=host)
+        return await asyncio.open_connection(host, port)
+
+    def _get_connection(self, key):
+        """
+        Check out an idle connection, returns None if there is none
+
+        :param key: Pool key
+        :type key: tuple of (scheme, host, port)
+        :rtype: tuple of (StreamReader, StreamWriter) or None
+        """
+        now = time.time()
+        idle = self.__pool.get(key)
+        while idle:
+            connection, returned = idle.pop()
+            if now - returned > self.idle_timeout:
+                connection[1].close()
+                while idle:
+                    idle.pop()[0][1].close()
+            elif not connection[0].at_eof():
+                return connection
+            else:
+                connection[1].close()
+        return None
+
+    def _put_connection(self, key, connection):
+        """
+        Return a connection to the pool
+
+        :param key: Pool key
+        :type key: tuple of (scheme, host, port)
+        :param connection: Connection
+        :type connection: tuple of (StreamReader, StreamWriter)
+        :rtype: None
+        """
+        idle = self.__pool.setdefault(key, collections.deque())
+        if len(idle) < self.max_size:
+            idle.append((connection, time.time()))
+        else:
+            connection[1].close()
+
+    def idle_connections(self):
+        """
+        Returns the number of idle connections in the pool
+
+        :rtype: int
+        """
+        return sum(len(idle) for idle in self.__pool.values())
+
+    def close(self):
+        """
+        Close all idle connections
+
+        :rtype: None
+        """
+        self.__close_idle()
+
+    def __close_idle(self):
+        """
+        Close all idle connections, returns their writers
+
+        :rtype: list of StreamWriter
+        """
+        pools = list(self.__pool.values())
+        self.__pool = {}
+        writers = []
+        for idle in pools:
+            for connection, returned in idle:
+                connection[1].close()
+                writers.append(connection[1])
+        return writers
+
+    async def aclose(self):
+        """
+        Close all idle connections and wait until they are closed, call it
+        before closing the event loop
+
+        :rtype: None
+        """
+        for writer in self.__close_idle():
+            # StreamWriter.wait_closed() is new in Python 3.7
+            if hasattr(writer, 'wait_closed'):
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
+
+    async def _read_response(self, reader, method):
+        """
+        Read a response from the stream
+
+        :rtype: tuple of (status, reason, headers, body, will_close)
+        """
+        status_line = await reader.readline()
+        if not status_line:
+            raise RemoteDisconnected("Connection closed by server")
+        parts = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        version = parts[0]
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ''
+        headers = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers.append((name.strip(), value.strip()))
+        fields = dict((name.lower(), value) for name, value in headers)
+        connection = fields.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            will_close = connection != 'keep-alive'
+        else:
+            will_close = connection == 'close'
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            body = b''
+        elif fields.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Skip the trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n',
+                                                            b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in fields:
+            body = await reader.readexactly(int(fields['content-length']))
+        else:
+            body = await reader.read()
+            will_close = True
+        return status, reason, headers, body, will_close
+
+    async def _exchange(self, connection, method, key, path, body, headers):
+        """
+        Write the request to the connection and read the response
+        """
+        reader, writer = connection
+        scheme, host, port = key
+        if port in (80, 443):
+            host_header = host
+        else:
+            host_header = '%s:%d' % (host, port)
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % host_header]
+        for header, value in headers.items():
+            lines.append('%s: %s' % (header, value))
+        if body is not None:
+            lines.append('Content-Length: %d' % len(body))
+        lines.append('\r\n')
+        writer.write('\r\n'.join(lines).encode('latin-1'))
+        if body is not None:
+            writer.write(body)
+        await writer.drain()
+        return await self._read_response(reader, method)
+
+    async def _send(self, connection, method, key, path, body, headers):
+        """
+        Open a connection unless one is given and make the request on it,
+        the connection is closed if that fails
+
+        :param connection: Idle connection, None for a new one
+        :type connection: tuple of (StreamReader, StreamWriter) or None
+        :rtype: tuple of (connection, result of _read_response())
+        """
+        if connection is None:
+            connection = await self._new_connection(key)
+        try:
+            result = await self._exchange(connection, method, key, path,
+                                          body, headers)
+        except BaseException:
+            connection[1].close()
+            raise
+        return connection, result
+
+    async def _urlopen(self, method, url, body, headers):
+        """
+        Make one request, without following redirects
+
+        The timeout covers connecting as well as the exchange.
+
+        :rtype: Response
+        """
+        key = self._get_key(url)
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        async with self._get_semaphore(key):
+            connection = self._get_connection(key)
+            try:
+                connection, result = await asyncio.wait_for(
+                    self._send(connection, method, key, path, body,
+                               headers),
+                    self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                if connection is None or not self._can_resend(method, e):
+                    raise
+                # The server closed the idle connection, try a new one
+                connection, result = await asyncio.wait_for(
+                    self._send(None, method, key, path, body, headers),
+                    self.timeout)
+        status, reason, response_headers, data, will_close = result
+        if will_close:
+            connection[1].close()
+        else:
+            self._put_connection(key, connection)
+        return Response(url, status, reason, response_headers, data)
+
+    async def request(self, method, url, body=None, headers=None):
+        """
+        Make a request, see HTTPConnectionPool.request()
+
+        :raises: HTTPError for 4xx and 5xx responses, ValueError if a
+            header or the URL contains CR or LF
+        :rtype: Response
+        """
+        headers = dict(headers or {})
+        # Like http.client, don't let a value add headers to the request
+        for header, value in headers.items():
+            if _ILLEGAL_CHARACTERS.search(header) or \
+                    _ILLEGAL_CHARACTERS.search(str(value)):
+                raise ValueError('Invalid header %r: %r' % (header, value))
+        if _ILLEGAL_CHARACTERS.search(url):
+            raise ValueError('Invalid URL %r' % url)
+        for i in range(self.MAX_REDIRECTS + 1):
+            response = await self._urlopen(method, url, body, headers)
+            location = response.getheader('Location')
+            if response.status not in self.REDIRECT_CODES or not location:
+                break
+            url = urljoin(url, location)
+            if response.status == 303 or (response.status in (301, 302) and
+                                           method == 'POST'):
+                method = 'GET'
+                body = None
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason,
+                            dict(response.headers), BytesIO(response.body))
+        return response
+
+
+_default_pools = weakref.WeakKeyDictionary()
+
+
+def get_default_async_pool():
+    """
+    Returns the connection pool shared by all async trackers and analytics
+    objects running in the current event loop
+
+    :rtype: AsyncConnectionPool
+    """
+    loop = asyncio.get_event_loop()
+    pool = _default_pools.get(loop)
+    if pool is None:
+        pool = AsyncConnectionPool()
+        _default_pools[loop] = pool
+    return pool
+
+
+class AsyncTrackerMixin(object):
+    """
+    Turns the do_track_*() methods of a tracker into coroutines
+
+    The query strings are built exactly like the blocking tracker does,
+    only the request is sent through an AsyncConnectionPool.
+    """
+    def _get_transport(self):
+        """
+        :rtype: AsyncConnectionPool
+        """
+        if self.transport is None:
+            return get_default_async_pool()
+        return self.transport
+
+    def _send_request(self, url):
+        """
+        Returns a coroutine that makes the tracking API request and returns
+        the request body
+
+        :param url: Query string
+        :type url: str
+        :rtype: coroutine
+        """
+        # The timer must be taken before another call starts a new one
+        timer = self._phase_timer
+        if timer is None:
+            return self.__send_request(url)
+        self._phase_timer = None
+        timer.mark('encode')
+        return self.__send_timed_request(url, timer)
+
+    async def __send_timed_request(self, url, timer):
+        """
+        See _send_request()
+
+        :param timer: Timer of the call
+        :type timer: piwikapi.profiling.PhaseTimer
+        :rtype: str, bool, BulkTrackingResult or TrackingResponse
+        """
+        try:
+            return await self.__send_request(url)
+        finally:
+            if self.dispatcher is not None or self.bulk_tracker is not None:
+                timer.mark('enqueue')
+            else:
+                timer.mark('request')
+            timer.finish()
+
+    async def __send_request(self, url):
+        """
+        Make the tracking API request, return the request body
+
+        :param url: Query string
+        :type url: str
+        :raises: ConfigurationError if the API URL was not set
+        :rtype: str, bool, BulkTrackingResult or TrackingResponse
+        """
+        if self.metrics is not None:
+            self.metrics.increment('tracking.bytes_encoded', len(url))
+        if self.dispatcher is not None:
+            query_string = self._get_dispatch_query_string(url)
+            # Only a dispatcher that drops hits when full adds them without
+            # waiting, a spool writes them to disk
+            if getattr(self.dispatcher, 'overflow', 'block') == 'block':
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(
+                    None, self.dispatcher.add, query_string)
+            return self.dispatcher.add(query_string)
+        if self.bulk_tracker is not None:
+            # A full batch is sent right away, don't block the loop
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                None, self.bulk_tracker.add, self._get_bulk_query_string(url))
+        url = self._get_tracking_url(url)
+        started = time.time()
+        try:
+            response = await self._get_transport().request(
+                'GET', url, headers=self._get_request_headers())
+        except Exception as e:
+            self._record_error(e)
+            raise
+        return self._get_response(response, url, started)
+
+    async def _get_local_response(self, result=False):
+        """
+        :rtype: bool
+        """
+        return result
+
+
+class AsyncPiwikTracker(AsyncTrackerMixin, PiwikTracker):
+    """
+    The Piwik tracker class for asyncio
+
+    Use it like PiwikTracker, but await the do_track_*() methods::
+
+        await tracker.do_track_page_view('Page title')
+
+    set_transport() takes an AsyncConnectionPool.
+    """
+    pass
+
+
+class AsyncPiwikTrackerEcommerce(AsyncTrackerMixin, PiwikTrackerEcommerce):
+    """
+    The Piwik tracker class for ecommerce for asyncio
+
+    The held cart update of a CartCoalescer is sent from the executor before
+    an order, the coalescer's locks would block the loop.
+    """
+    def do_track_ecommerce_order(self, *args, **kwargs):
+        """
+        See PiwikTrackerEcommerce.do_track_ecommerce_order()
+
+        :rtype: coroutine
+        """
+        if self.cart_coalescer is None:
+            return super().do_track_ecommerce_order(*args, **kwargs)
+        return self.__track_ecommerce_order(args, kwargs)
+
+    async def __track_ecommerce_order(self, args, kwargs):
+        """
+        Flush the cart update of the visitor, then track the order
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, super()._flush_cart)
+        return await super().do_track_ecommerce_order(*args, **kwargs)
+
+    def _flush_cart(self):
+        """
+        do_track_ecommerce_order() flushed the cart already
+
+        :rtype: None
+        """
+        pass
+
+
+class AsyncPiwikAnalytics(PiwikAnalytics):
+    """
+    The Piwik analytics API class for asyncio
+
+    Use it like PiwikAnalytics, but await send_request().
+    """
+    async def send_request(self):
+        """
+        Make the analytics API request, returns the request body
+
+        :rtype: bytes
+        """
+        url = self.get_query_string()
+        transport = self.transport
+        if transport is None:
+            transport = get_default_async_pool()
+        started = time.time()
+        try:
+            response = await transport.request('GET', url)
+        except Exception as e:
+            self._record_error(e)
+            raise
+        self._record_response(response, started)
+        return response.body
@@ -7,14 +7,14 @@ License: BSD, see LICENSE for details
 Source and development at https://github.com/piwik/piwik-python-api
 """
 
+import time
 try:
-    from urllib.request import Request, urlopen
     from urllib.parse import urlencode
 except ImportError:
-    from urllib2 import Request, urlopen
     from urllib import urlencode
 
 from .exceptions import ConfigurationError
+from .transport import get_default_pool
 
 
 class PiwikAnalytics(object):
@@ -30,6 +30,8 @@ class PiwikAnalytics(object):
         self.p = {}
         self.set_parameter('module', 'API')
         self.api_url = None
+        self.transport = None
+        self.metrics = None
 
     def set_parameter(self, key, value):
         """
@@ -122,6 +124,27 @@ class PiwikAnalytics(object):
         """
         self.api_url = api_url
 
+    def set_transport(self, transport):
+        """
+        Set the transport used to send the requests. By default the
+        connection pool shared by all trackers and analytics objects is used.
+
+        :param transport: Transport, None for the shared connection pool
+        :type transport: piwikapi.transport.HTTPConnectionPool or None
+        :rtype: None
+        """
+        self.transport = transport
+
+    def set_metrics(self, metrics):
+        """
+        Report request latencies and errors to a metrics sink
+
+        :param metrics: Metrics sink, None to report nothing
+        :type metrics: piwikapi.metrics.Metrics or None
+        :rtype: None
+        """
+        self.metrics = metrics
+
     def set_segment(self, segment):
         """
         :param segment: Which segment to request, see
@@ -154,7 +177,43 @@ class PiwikAnalytics(object):
 
         :rtype: str
         """
-        request = Request(self.get_query_string())
-        response = urlopen(request)
-        body = response.read()
-        return body
+        url = self.get_query_string()
+        transport = self.transport
+        if transport is None:
+            transport = get_default_pool()
+        started = time.time()
+        try:
+            response = transport.request('GET', url)
+        except Exception as e:
+            self._record_error(e)
+            raise
+        self._record_response(response, started)
+        return response.body
+
+    def _record_error(self, error):
+        """
+        Count a failed analytics request
+
+        :param error: The exception
+        :type error: Exception
+        :rtype: None
+        """
+        if self.metrics is not None:
+            self.metrics.increment('analytics.errors.' +
+                                   error.__class__.__name__)
+
+    def _record_response(self, response, started):
+        """
+        Count an analytics request and record its latency
+
+        :param response: The response
+        :type response: piwikapi.transport.Response
+        :param started: Time the request was started
+        :type started: float
+        :rtype: None
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.timing('analytics.latency', time.time() - started)
+            metrics.increment('analytics.requests')
+            metrics.increment('analytics.bytes_received', len(response.body))
@@ -0,0 +1,162 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+ASGI tracking middleware, requires Python 3.5 or newer.
+"""
+
+import asyncio
+import functools
+import logging
+
+from .aio import AsyncTrackerMixin
+from .wsgi import TrackingMiddlewareMixin
+
+
+#: The request headers the trackers read, and their request.META keys
+HEADERS = {
+    b'user-agent': 'HTTP_USER_AGENT',
+    b'referer': 'HTTP_REFERER',
+    b'accept-language': 'HTTP_ACCEPT_LANGUAGE',
+    b'cookie': 'HTTP_COOKIE',
+    b'host': 'SERVER_NAME',
+}
+
+
+class ScopeRequest(object):
+    """
+    A Django-like request built from an ASGI scope
+
+    Only the headers in HEADERS are decoded. The Host header is used as the
+    server name, it falls back to the server address of the scope. Repeated
+    Cookie headers, as sent over HTTP/2, are joined.
+    """
+    __slots__ = ('META', 'secure')
+
+    def __init__(self, scope):
+        """
+        :param scope: ASGI HTTP connection scope
+        :type scope: dict
+        :rtype: None
+        """
+        meta = {
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        }
+        for name, value in scope.get('headers', ()):
+            key = HEADERS.get(name)
+            if key is None:
+                continue
+            value = value.decode('latin-1')
+            if key == 'HTTP_COOKIE' and key in meta:
+                value = meta[key] + '; ' + value
+            meta[key] = value
+        if 'SERVER_NAME' not in meta and scope.get('server'):
+            meta['SERVER_NAME'] = scope['server'][0]
+        client = scope.get('client')
+        if client:
+            meta['REMOTE_ADDR'] = client[0]
+        self.META = meta
+        self.secure = scope.get('scheme') == 'https'
+
+    def is_secure(self):
+        """
+        :rtype: bool
+        """
+        return self.secure
+
+
+class PiwikASGIMiddleware(TrackingMiddlewareMixin):
+    """
+    Tracks a page view for every HTTP request of an ASGI application
+
+    The page view is tracked in a background task once the application has
+    sent the response. With an AsyncPiwikTracker template the hit is sent by
+    a task on the event loop. Blocking trackers without a dispatcher send it
+    from the loop's default executor.
+
+    Await drain() before the loop shuts down to finish the pending hits.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PiwikASGIMiddleware, self).__init__(*args, **kwargs)
+        self.__tasks = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self.is_excluded(scope['path']):
+            await self.app(scope, receive, send)
+            return
+        response = [None, None]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response[0] = message['status']
+                response[1] = message.get('headers', [])
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        if response[0] is not None:
+            self.track(scope, response[0], response[1])
+
+    def track(self, scope, status, headers):
+        """
+        Start tracking the page view of a finished request, errors are
+        logged
+
+        :param scope: ASGI HTTP connection scope
+        :type scope: dict
+        :param status: HTTP status code
+        :type status: int
+        :param headers: Response headers
+        :type headers: list of (bytes, bytes) tuples
+        :rtype: None
+        """
+        try:
+            title = self.get_title(scope, status, headers)
+            if title is None:
+                return
+            request = ScopeRequest(scope)
+            tracker = self.get_tracker(request,
+                                       request.META.get('REMOTE_ADDR'))
+            if isinstance(tracker, AsyncTrackerMixin):
+                task = asyncio.ensure_future(
+                    tracker.do_track_page_view(title))
+            elif tracker.dispatcher is not None:
+                # Only queues the hit
+                tracker.do_track_page_view(title)
+                return
+            else:
+                task = asyncio.get_event_loop().run_in_executor(
+                    None, tracker.do_track_page_view, title)
+        except Exception:
+            logging.exception("Failed to track %s" % scope.get('path'))
+            return
+        self.__tasks.add(task)
+        task.add_done_callback(functools.partial(self.__task_done,
+                                                 scope.get('path')))
+
+    def __task_done(self, path, task):
+        self.__tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("Failed to track %s: %r" %
+                          (path, task.exception()))
+
+    def pending(self):
+        """
+        Returns the number of hits that are still being sent
+
+        :rtype: int
+        """
+        return len(self.__tasks)
+
+    async def drain(self):
+        """
+        Wait until the pending hits were sent
+
+        :rtype: None
+        """
+        while self.__tasks:
+            await asyncio.wait(list(self.__tasks))
@@ -0,0 +1,143 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Micro benchmarks for the tracking code paths. Every benchmark module has a
+run() function returning a list of result dicts and can be run directly,
+e.g. ``python -m piwikapi.benchmarks.compression``. ``python -m
+piwikapi.benchmarks`` runs them all, see suite.py.
+"""
+
+import random
+import timeit
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+from ..tracking import PiwikTracker
+
+
+class BenchmarkRequest(object):
+    """
+    A request object with realistic headers, see tests/request.py
+    """
+    def __init__(self, path='/', query_string=''):
+        """
+        :param path: Request path
+        :type path: str
+        :param query_string: Request query string
+        :type query_string: str
+        :rtype: None
+        """
+        self.META = {
+            'HTTP_USER_AGENT': 'Mozilla/5.0 (X11; Linux x86_64) '
+                               'AppleWebKit/537.36 (KHTML, like Gecko) '
+                               'Chrome/120.0 Safari/537.36',
+            'HTTP_REFERER': 'https://www.example.com/search?q=piwik',
+            'REMOTE_ADDR': '192.0.2.1',
+            'HTTP_ACCEPT_LANGUAGE': 'en-US,en;q=0.9',
+            'QUERY_STRING': query_string,
+            'PATH_INFO': path,
+            'SERVER_NAME': 'shop.example.com',
+            'HTTPS': '',
+        }
+        self.COOKIES = False
+
+    def is_secure(self):
+        """
+        :rtype: bool
+        """
+        return False
+
+
+def get_tracker(id_site=1, path='/'):
+    """
+    Returns a tracker for a typical page view, with a custom variable
+
+    :param id_site: Site ID
+    :type id_site: int
+    :param path: Request path
+    :type path: str
+    :rtype: PiwikTracker
+    """
+    tracker = PiwikTracker(id_site, BenchmarkRequest(path))
+    tracker.set_api_url('http://piwik.example.com/piwik.php')
+    tracker.set_custom_variable(1, 'plan', 'premium')
+    return tracker
+
+
+def get_hits(count=1000, seed=1):
+    """
+    Returns count page view query strings as they would be queued for bulk
+    tracking, built with PiwikTracker._get_request()
+
+    :param count: Number of hits
+    :type count: int
+    :param seed: Random seed, so all runs build the same hits
+    :type seed: int
+    :rtype: list of str
+    """
+    tracker = get_tracker()
+    random.seed(seed)
+    hits = []
+    for i in range(count):
+        tracker.set_url('http://shop.example.com/products/%d/' %
+                        random.randint(1, 500))
+        url = tracker._get_request(tracker.id_site)
+        url += '&%s' % urlencode({'action_name': 'Product %d' % i})
+        hits.append(tracker._get_bulk_query_string(url))
+    return hits
+
+
+def measure(func, number=1, repeat=5):
+    """
+    Returns the best time of repeat runs of number calls, in seconds
+
+    :param func: Function without arguments
+    :type func: callable
+    :param number: Calls per run
+    :type number: int
+    :param repeat: Number of runs
+    :type repeat: int
+    :rtype: float
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat))
+
+
+def print_results(title, results):
+    """
+    Print benchmark results as a table
+
+    :param title: Benchmark name
+    :type title: str
+    :param results: Results as returned by a run() function
+    :type results: list of dict
+    :rtype: None
+    """
+    print(title)
+    print('=' * len(title))
+    if not results:
+        return
+    columns = list(results[0].keys())
+    widths = [max(len(column), max(len(format_value(result[column]))
+                                   for result in results))
+              for column in columns]
+    print('  '.join(column.ljust(width)
+                    for column, width in zip(columns, widths)).rstrip())
+    for result in results:
+        print('  '.join(format_value(result[column]).ljust(width)
+                        for column, width in zip(columns, widths)).rstrip())
+
+
+def format_value(value):
+    """
+    :rtype: str
+    """
+    if isinstance(value, float):
+        return '%.3f' % value
+    return str(value)
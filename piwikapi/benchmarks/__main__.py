@@ -0,0 +1,15 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import sys
+
+from .suite import main
+
+
+sys.exit(main())
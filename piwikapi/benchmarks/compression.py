@@ -0,0 +1,58 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Bytes on the wire and CPU cost of gzipping bulk tracking requests
+"""
+
+import collections
+
+from . import get_hits
+from . import measure
+from . import print_results
+from ..bulk import BulkTrackingResult
+from ..bulk import PiwikBulkTracker
+from ..transport import gzip_compress
+
+
+def run(hits=1000, levels=(1, 6, 9)):
+    """
+    Compress a bulk request of hits with every compression level
+
+    :param hits: Number of hits in the bulk request
+    :type hits: int
+    :param levels: gzip compression levels
+    :type levels: tuple of int
+    :rtype: list of dict
+    """
+    bulk = PiwikBulkTracker('http://piwik.example.com/piwik.php',
+                            'token', max_age=None)
+    body = bulk._get_body([BulkTrackingResult(query_string)
+                           for query_string in get_hits(hits)])
+    per_1000 = 1000.0 / hits
+    results = [collections.OrderedDict([
+        ('level', 'none'),
+        ('bytes', len(body)),
+        ('bytes/1000 hits', int(len(body) * per_1000)),
+        ('ratio', 1.0),
+        ('ms/1000 hits', 0.0),
+    ])]
+    for level in levels:
+        compressed = gzip_compress(body, level)
+        seconds = measure(lambda: gzip_compress(body, level))
+        results.append(collections.OrderedDict([
+            ('level', level),
+            ('bytes', len(compressed)),
+            ('bytes/1000 hits', int(len(compressed) * per_1000)),
+            ('ratio', float(len(body)) / len(compressed)),
+            ('ms/1000 hits', seconds * 1000 * per_1000),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('Bulk request compression', run())
@@ -0,0 +1,59 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Cost of creating a tracker per request and building its first hit
+"""
+
+import collections
+
+from . import BenchmarkRequest
+from . import measure
+from . import print_results
+from ..template import PiwikTrackerTemplate
+from ..tracking import PiwikTracker
+
+
+def run(trackers=1000):
+    """
+    Create trackers with PiwikTracker() and a PiwikTrackerTemplate
+
+    :param trackers: Number of trackers per run
+    :type trackers: int
+    :rtype: list of dict
+    """
+    request = BenchmarkRequest('/products/1/')
+    api_url = 'http://piwik.example.com/piwik.php'
+    template = PiwikTrackerTemplate(1, api_url, token_auth='token',
+                                    custom_variables=[(1, 'plan', 'premium')])
+
+    def construct():
+        tracker = PiwikTracker(1, request)
+        tracker.set_api_url(api_url)
+        tracker.set_token_auth('token')
+        tracker.set_custom_variable(1, 'plan', 'premium')
+        return tracker
+
+    def from_template():
+        return template.get_tracker(request)
+
+    results = []
+    for name, create in (('PiwikTracker()', construct),
+                         ('template.get_tracker()', from_template)):
+        create_seconds = measure(lambda: [create() for i in range(trackers)])
+        hit_seconds = measure(lambda: [create()._get_request(1)
+                                       for i in range(trackers)])
+        results.append(collections.OrderedDict([
+            ('name', name),
+            ('ms/1000 trackers', create_seconds * 1000000.0 / trackers),
+            ('ms/1000 trackers with hit', hit_seconds * 1000000.0 / trackers),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('Tracker construction', run())
@@ -0,0 +1,49 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Hit building with five page and five visit custom variables
+"""
+
+import collections
+
+from . import get_tracker
+from . import measure
+from . import print_results
+
+
+def run(hits=10000):
+    """
+    Build hits with the encoded custom variables reused, and with them
+    encoded again for every hit like before they were cached
+
+    :param hits: Number of hits per run
+    :type hits: int
+    :rtype: list of dict
+    """
+    tracker = get_tracker()
+    for i in range(1, 6):
+        tracker.set_custom_variable(i, 'page %d' % i, 'value %d' % i, 'page')
+        tracker.set_custom_variable(i, 'visit %d' % i, 'value %d' % i)
+
+    def encode_again():
+        tracker.custom_var_version += 1
+        return tracker._get_request(1)
+
+    results = []
+    for name, build in (('encoded every hit', encode_again),
+                        ('cached', lambda: tracker._get_request(1))):
+        seconds = measure(lambda: [build() for i in range(hits)])
+        results.append(collections.OrderedDict([
+            ('name', name),
+            ('us/hit', seconds * 1000000.0 / hits),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('Custom variables', run())
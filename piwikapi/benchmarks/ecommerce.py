@@ -0,0 +1,54 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Cost of tracking an ecommerce order by number of items, with the hits
+queued in a dispatcher that only collects them
+"""
+
+import collections
+
+from . import BenchmarkRequest
+from . import measure
+from . import print_results
+from .middleware import CollectingDispatcher
+from ..tracking import PiwikTrackerEcommerce
+
+
+def run(orders=1000, item_counts=(1, 10, 100)):
+    """
+    Add the items and track the order
+
+    :param orders: Number of orders per run
+    :type orders: int
+    :param item_counts: Numbers of items per order
+    :type item_counts: tuple of int
+    :rtype: list of dict
+    """
+    tracker = PiwikTrackerEcommerce(1, BenchmarkRequest('/checkout/'))
+    tracker.set_api_url('http://piwik.example.com/piwik.php')
+    tracker.set_dispatcher(CollectingDispatcher())
+    results = []
+    for item_count in item_counts:
+        items = [('sku%d' % i, 'Product %d' % i, ['Shoes', 'Sale'],
+                  19.99, 1) for i in range(item_count)]
+
+        def order():
+            for item in items:
+                tracker.add_ecommerce_item(*item)
+            tracker.do_track_ecommerce_order('order', 19.99 * item_count)
+
+        seconds = measure(lambda: [order() for i in range(orders)])
+        results.append(collections.OrderedDict([
+            ('name', '%d items' % item_count),
+            ('us/order', seconds * 1000000.0 / orders),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('Ecommerce orders', run())
@@ -0,0 +1,88 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Per hit cost of encoding the tracking query string
+"""
+
+import collections
+import random
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+from . import get_tracker
+from . import measure
+from . import print_results
+
+
+def urlencode_request(tracker, id_site):
+    """
+    How PiwikTracker._get_request() encoded a hit before the static
+    parameters were cached, without the attribution info
+    """
+    query_vars = {
+        'idsite': id_site,
+        'rec': 1,
+        'apiv': tracker.VERSION,
+        'rand': random.randint(0, 99999),
+        'url': tracker.page_url,
+        'urlref': tracker.referer,
+        'id': tracker.visitor_id,
+    }
+    if tracker.ip:
+        query_vars['cip'] = tracker.ip
+    if tracker.token_auth:
+        query_vars['token_auth'] = tracker.token_auth
+    if tracker.has_cookies:
+        query_vars['cookie'] = 1
+    if tracker.width and tracker.height:
+        query_vars['res'] = '%dx%d' % (tracker.width, tracker.height)
+    if tracker.forced_visitor_id:
+        query_vars['cid'] = tracker.forced_visitor_id
+    if tracker.page_custom_var:
+        query_vars['cvar'] = json.dumps(tracker.page_custom_var)
+    if tracker.visitor_custom_var:
+        query_vars['_cvar'] = json.dumps(tracker.visitor_custom_var)
+    for plugin, version in tracker.plugins.items():
+        query_vars[plugin] = version
+    return urlencode(query_vars)
+
+
+def run(hits=10000):
+    """
+    Encode hits of a tracker with auth token, IP, resolution and plugins
+
+    :param hits: Number of hits per run
+    :type hits: int
+    :rtype: list of dict
+    """
+    tracker = get_tracker()
+    tracker.set_token_auth('0123456789abcdef0123456789abcdef')
+    tracker.set_ip('192.0.2.1')
+    tracker.set_resolution(1920, 1080)
+    tracker.set_browser_has_cookies()
+    tracker.set_plugins(flash=1, java=1, pdf=1, silverlight=1)
+    results = []
+    for name, encode in (
+            ('urlencode(dict)', lambda: urlencode_request(tracker, 1)),
+            ('_get_request()', lambda: tracker._get_request(1))):
+        seconds = measure(lambda: [encode() for i in range(hits)])
+        results.append(collections.OrderedDict([
+            ('name', name),
+            ('us/hit', seconds * 1000000.0 / hits),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('Query string encoding', run())
@@ -0,0 +1,102 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Cost of do_track_page_view() including the request, against a local
+server that answers like piwik.php
+"""
+
+import collections
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from . import get_tracker
+from . import measure
+from . import print_results
+from ..transport import HTTPConnectionPool
+from ..transport import UrllibTransport
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request with an empty 204 response
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    A local server that runs in a background thread
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self):
+        """
+        :rtype: str
+        """
+        return 'http://%s:%d/piwik.php' % self.server_address
+
+    def stop(self):
+        """
+        :rtype: None
+        """
+        self.shutdown()
+        self.server_close()
+
+
+def run(hits=500):
+    """
+    Track page views through the connection pool and through urlopen()
+
+    :param hits: Number of page views per run
+    :type hits: int
+    :rtype: list of dict
+    """
+    server = StubServer()
+    pool = HTTPConnectionPool()
+    results = []
+    try:
+        for name, transport in (('connection pool', pool),
+                                ('urlopen()', UrllibTransport())):
+            tracker = get_tracker()
+            tracker.set_api_url(server.url())
+            tracker.set_transport(transport)
+            tracker.set_send_image(False)
+            seconds = measure(lambda: [tracker.do_track_page_view('Page')
+                                       for i in range(hits)], repeat=3)
+            results.append(collections.OrderedDict([
+                ('name', name),
+                ('us/hit', seconds * 1000000.0 / hits),
+            ]))
+    finally:
+        pool.close()
+        server.stop()
+    return results
+
+
+if __name__ == '__main__':
+    print_results('End to end page views', run())
@@ -0,0 +1,50 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Request thread cost of capturing a TrackingEvent against building the
+query string right away
+"""
+
+import collections
+
+from . import get_tracker
+from . import measure
+from . import print_results
+from ..events import TrackingEventSerializer
+
+
+def run(hits=10000):
+    """
+    :param hits: Number of hits per run
+    :type hits: int
+    :rtype: list of dict
+    """
+    tracker = get_tracker()
+    serializer = TrackingEventSerializer()
+    events = [tracker.capture_page_view('Product') for i in range(hits)]
+
+    def build():
+        url = tracker._get_request(1) + '&action_name=Product'
+        return tracker._get_dispatch_query_string(url)
+
+    results = []
+    for name, func in (
+            ('build query string', lambda: [build() for i in range(hits)]),
+            ('capture event', lambda: [tracker.capture_page_view('Product')
+                                       for i in range(hits)]),
+            ('serialize event', lambda: serializer.serialize_many(events))):
+        seconds = measure(func)
+        results.append(collections.OrderedDict([
+            ('name', name),
+            ('us/hit', seconds * 1000000.0 / hits),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('Tracking events', run())
@@ -0,0 +1,81 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Per-request overhead of the WSGI middleware, with the hits queued in a
+dispatcher that only collects them
+"""
+
+import collections
+
+from . import BenchmarkRequest
+from . import measure
+from . import print_results
+from ..template import PiwikTrackerTemplate
+from ..wsgi import PiwikWSGIMiddleware
+
+
+class CollectingDispatcher(object):
+    """
+    Stands in for a PiwikDispatcher, keeps the last query string
+    """
+    def __init__(self):
+        self.query_string = None
+
+    def add(self, query_string):
+        self.query_string = query_string
+        return True
+
+
+def run(requests=10000):
+    """
+    Call a WSGI application with and without the middleware
+
+    :param requests: Number of requests per run
+    :type requests: int
+    :rtype: list of dict
+    """
+    body = [b'Hello']
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return body
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    template = PiwikTrackerTemplate(
+        1, 'http://piwik.example.com/piwik.php', token_auth='token',
+        dispatcher=CollectingDispatcher())
+    middleware = PiwikWSGIMiddleware(app, template, exclude=('/static/',))
+    environ = dict(BenchmarkRequest('/products/1/').META)
+    environ['wsgi.url_scheme'] = 'http'
+    static_environ = dict(environ, PATH_INFO='/static/app.js')
+
+    def serve(application, environ):
+        response = application(environ, start_response)
+        for chunk in response:
+            pass
+        if hasattr(response, 'close'):
+            response.close()
+
+    results = []
+    for name, application, env in (
+            ('application', app, environ),
+            ('middleware, excluded path', middleware, static_environ),
+            ('middleware, tracked', middleware, environ)):
+        seconds = measure(lambda: [serve(application, env)
+                                   for i in range(requests)])
+        results.append(collections.OrderedDict([
+            ('name', name),
+            ('us/request', seconds * 1000000.0 / requests),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('WSGI middleware', run())
@@ -0,0 +1,55 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Per hit cost of PiwikTracker._get_request() with more custom variables and
+plugins
+"""
+
+import collections
+
+from . import get_tracker
+from . import measure
+from . import print_results
+from ..tracking import PiwikTracker
+
+
+def run(hits=10000, loads=((0, 0), (2, 4), (5, 9))):
+    """
+    Build hits of trackers with page and visit custom variables and plugins
+
+    :param hits: Number of hits per run
+    :type hits: int
+    :param loads: Number of custom variables per scope and of plugins
+    :type loads: tuple of (int, int) tuples
+    :rtype: list of dict
+    """
+    plugins = sorted(PiwikTracker.KNOWN_PLUGINS)
+    results = []
+    for custom_variables, plugin_count in loads:
+        tracker = get_tracker()
+        tracker.visitor_custom_var = {}
+        tracker.custom_var_version += 1
+        for i in range(1, custom_variables + 1):
+            tracker.set_custom_variable(i, 'page %d' % i, 'value %d' % i,
+                                        'page')
+            tracker.set_custom_variable(i, 'visit %d' % i, 'value %d' % i)
+        tracker.set_plugins(**dict((plugin, 1)
+                                   for plugin in plugins[:plugin_count]))
+        seconds = measure(lambda: [tracker._get_request(1)
+                                   for i in range(hits)])
+        results.append(collections.OrderedDict([
+            ('name', '%d cvars, %d plugins' % (custom_variables,
+                                               plugin_count)),
+            ('bytes/hit', len(tracker._get_request(1))),
+            ('us/hit', seconds * 1000000.0 / hits),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('Query string by load', run())
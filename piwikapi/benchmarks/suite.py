@@ -0,0 +1,210 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Runs all benchmarks, saves the results as JSON and compares them with a
+baseline, see ``python -m piwikapi.benchmarks --help``
+"""
+
+import collections
+import importlib
+import optparse
+import os
+import platform
+import sys
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from . import print_results
+
+
+#: Benchmark modules and their titles
+BENCHMARKS = collections.OrderedDict([
+    ('construction', 'Tracker construction'),
+    ('encoding', 'Query string encoding'),
+    ('request_load', 'Query string by load'),
+    ('custom_variables', 'Custom variables'),
+    ('ecommerce', 'Ecommerce orders'),
+    ('events', 'Captured events'),
+    ('visitor_id', 'Visitor IDs'),
+    ('compression', 'Bulk request compression'),
+    ('middleware', 'WSGI middleware'),
+    ('end_to_end', 'End to end page views'),
+])
+
+#: Columns holding times contain one of these, lower values are better
+TIME_COLUMNS = ('us/', 'ms/')
+
+
+def run_benchmarks(names=None, verbose=True):
+    """
+    Run benchmarks, returns their results
+
+    :param names: Benchmark module names, None for all
+    :type names: list of str or None
+    :param verbose: Print every result table
+    :type verbose: bool
+    :rtype: dict of {name: list of dict}
+    """
+    results = collections.OrderedDict()
+    for name in names or BENCHMARKS:
+        module = importlib.import_module('piwikapi.benchmarks.%s' % name)
+        results[name] = module.run()
+        if verbose:
+            print_results(BENCHMARKS.get(name, name), results[name])
+            print('')
+    return results
+
+
+def get_row_key(row):
+    """
+    Returns what identifies a result row within its benchmark
+
+    :param row: Result row
+    :type row: dict
+    :rtype: str
+    """
+    return str(row.get('name', row.get('level')))
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compare the times with a baseline
+
+    :param results: Benchmark results
+    :type results: dict of {name: list of dict}
+    :param baseline: Baseline results
+    :type baseline: dict of {name: list of dict}
+    :param threshold: A time more than this share above the baseline is a
+        regression
+    :type threshold: float
+    :rtype: list of (benchmark, row, column, baseline, current, ratio,
+        regression) tuples
+    """
+    comparisons = []
+    for name, rows in results.items():
+        baseline_rows = dict((get_row_key(row), row)
+                             for row in baseline.get(name, ()))
+        for row in rows:
+            key = get_row_key(row)
+            baseline_row = baseline_rows.get(key)
+            if baseline_row is None:
+                continue
+            for column, value in row.items():
+                if not any(unit in column for unit in TIME_COLUMNS):
+                    continue
+                old = baseline_row.get(column)
+                if not old:
+                    continue
+                ratio = float(value) / old
+                comparisons.append((name, key, column, old, value, ratio,
+                                    ratio > 1 + threshold))
+    return comparisons
+
+
+def print_comparison(comparisons):
+    """
+    Print a comparison as a table
+
+    :param comparisons: Comparison as returned by compare()
+    :type comparisons: list of tuple
+    :rtype: None
+    """
+    print_results('Comparison with the baseline', [
+        collections.OrderedDict([
+            ('benchmark', name),
+            ('name', key),
+            ('column', column),
+            ('baseline', old),
+            ('current', value),
+            ('change', '%+.1f%%' % ((ratio - 1) * 100)),
+            ('', regression and 'REGRESSION' or ''),
+        ]) for name, key, column, old, value, ratio, regression
+        in comparisons])
+
+
+def save(path, results):
+    """
+    Save results as JSON
+
+    :param path: File name
+    :type path: str
+    :param results: Benchmark results
+    :type results: dict of {name: list of dict}
+    :rtype: None
+    """
+    data = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': int(time.time()),
+        'results': results,
+    }
+    stream = open(path, 'w')
+    try:
+        json.dump(data, stream, indent=2)
+    finally:
+        stream.close()
+
+
+def load(path):
+    """
+    Load results saved with save()
+
+    :param path: File name
+    :type path: str
+    :rtype: dict of {name: list of dict}
+    """
+    stream = open(path)
+    try:
+        return json.load(stream)['results']
+    finally:
+        stream.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point, returns 1 if a time regressed
+
+    :param argv: Arguments, None for sys.argv
+    :type argv: list of str or None
+    :rtype: int
+    """
+    parser = optparse.OptionParser(
+        usage='%prog [options] [BENCHMARK ...]',
+        prog='python -m piwikapi.benchmarks',
+        description='Benchmarks: %s' % ', '.join(BENCHMARKS))
+    parser.add_option('--output', metavar='FILE',
+                      help='Save the results as JSON')
+    parser.add_option('--compare', metavar='FILE',
+                      help='Compare the times with saved results')
+    parser.add_option('--threshold', type='float', default=0.2,
+                      help='Allowed slowdown compared to the baseline '
+                           '[default: %default]')
+    options, args = parser.parse_args(argv)
+    for name in args:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark %s' % name)
+    results = run_benchmarks(args)
+    if options.output:
+        save(options.output, results)
+    if options.compare:
+        if not os.path.exists(options.compare):
+            print('No baseline %s, nothing to compare' % options.compare)
+            return 0
+        comparisons = compare(results, load(options.compare),
+                              options.threshold)
+        print_comparison(comparisons)
+        regressions = [comparison for comparison in comparisons
+                       if comparison[-1]]
+        if regressions:
+            print('%d times regressed more than %g%%' % (
+                len(regressions), options.threshold * 100))
+            return 1
+    return 0
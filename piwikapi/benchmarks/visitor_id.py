@@ -0,0 +1,49 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Visitor ID generation, VisitorIdGenerator against md5(os.urandom(500))
+"""
+
+import collections
+from hashlib import md5
+import os
+
+from . import measure
+from . import print_results
+from ..visitor import VisitorIdGenerator
+
+
+def md5_visitor_id():
+    """
+    How PiwikTracker generated visitor IDs before VisitorIdGenerator
+    """
+    return md5(os.urandom(500)).hexdigest()[:16]
+
+
+def run(ids=10000):
+    """
+    Generate visitor IDs with both implementations
+
+    :param ids: Number of IDs per run
+    :type ids: int
+    :rtype: list of dict
+    """
+    generator = VisitorIdGenerator()
+    results = []
+    for name, generate in (('md5(os.urandom(500))', md5_visitor_id),
+                           ('VisitorIdGenerator', generator.get)):
+        seconds = measure(lambda: [generate() for i in range(ids)])
+        results.append(collections.OrderedDict([
+            ('name', name),
+            ('us/id', seconds * 1000000.0 / ids),
+        ]))
+    return results
+
+
+if __name__ == '__main__':
+    print_results('Visitor ID generation', run())
@@ -0,0 +1,326 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import threading
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError
+
+from .exceptions import ConfigurationError
+from .exceptions import TrackingError
+from .transport import get_default_pool
+from .transport import gzip_compress
+
+
+class BulkTrackingResult(object):
+    """
+    The result of one hit queued in a PiwikBulkTracker
+
+    The result is resolved once the batch containing the hit was sent to
+    Piwik.
+    """
+    def __init__(self, query_string):
+        """
+        :param query_string: The query string of the hit
+        :type query_string: str
+        :rtype: None
+        """
+        self.query_string = query_string
+        self.tracked = None
+        self.error = None
+        self.__event = threading.Event()
+
+    def done(self):
+        """
+        Returns True once the hit was sent to Piwik
+
+        :rtype: bool
+        """
+        return self.__event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the hit was sent, returns False on timeout
+
+        :param timeout: Timeout in seconds
+        :type timeout: float or None
+        :rtype: bool
+        """
+        return self.__event.wait(timeout)
+
+    def get(self, timeout=None):
+        """
+        Wait until the hit was sent and return True if Piwik tracked it
+
+        :param timeout: Timeout in seconds
+        :type timeout: float or None
+        :raises: TrackingError if the hit wasn't tracked or the timeout
+            expired
+        :rtype: bool
+        """
+        if not self.wait(timeout):
+            raise TrackingError("Hit was not sent within %s seconds" % timeout)
+        if self.error is not None:
+            raise self.error
+        return self.tracked
+
+    def _resolve(self, tracked, error=None):
+        """
+        :param tracked: Whether Piwik tracked the hit
+        :type tracked: bool
+        :param error: The reason why the hit was not tracked
+        :type error: Exception or None
+        :rtype: None
+        """
+        self.tracked = tracked
+        self.error = error
+        self.__event.set()
+
+
+class PiwikBulkTracker(object):
+    """
+    Collects tracking hits and sends them as one bulk tracking request
+
+    A batch is sent once it holds ``max_hits`` hits, ``max_age`` seconds
+    after its first hit was added, or when flush() is called. Hits are
+    sent in the order they were added.
+
+    With a ``compress_level`` the request body is gzipped and sent with
+    ``Content-Encoding: gzip`` once it is at least ``compress_threshold``
+    bytes large. Your Piwik server, or the web server in front of it, has to
+    decompress such requests.
+
+    See http://piwik.org/docs/tracking-api/reference/#toc-advanced-bulk-tracking-requests
+    """
+    def __init__(self, api_url, token_auth=False, max_hits=100, max_age=10,
+                 transport=None, compress_level=None,
+                 compress_threshold=1024, metrics=None):
+        """
+        :param api_url: Piwik tracking API URL, the URL of piwik.php
+        :type api_url: str
+        :param token_auth: Auth token, sent once for the whole batch
+        :type token_auth: str
+        :param max_hits: Send the batch once it holds this many hits
+        :type max_hits: int
+        :param max_age: Send the batch this many seconds after the first
+            hit was added, None to only send on size or flush()
+        :type max_age: float or None
+        :param transport: Transport, None for the shared connection pool
+        :type transport: piwikapi.transport.HTTPConnectionPool or None
+        :param compress_level: gzip compression level from 1 to 9, None to
+            not compress
+        :type compress_level: int or None
+        :param compress_threshold: Don't compress smaller bodies
+        :type compress_threshold: int
+        :param metrics: Metrics sink, None to report nothing
+        :type metrics: piwikapi.metrics.Metrics or None
+        :rtype: None
+        """
+        if not api_url:
+            raise ConfigurationError('API URL not set')
+        if max_hits < 1:
+            raise ConfigurationError('max_hits must be at least 1')
+        if compress_level is not None and not 1 <= compress_level <= 9:
+            raise ConfigurationError('compress_level must be between 1 and 9')
+        self.api_url = api_url
+        self.token_auth = token_auth
+        self.max_hits = max_hits
+        self.max_age = max_age
+        self.transport = transport
+        self.compress_level = compress_level
+        self.compress_threshold = compress_threshold
+        self.metrics = metrics
+        self.hits = []
+        self.__lock = threading.Lock()
+        self.__send_lock = threading.Lock()
+        self.__timer = None
+
+    def add(self, query_string):
+        """
+        Queue a hit, return its result
+
+        :param query_string: Query string as built by
+            PiwikTracker._get_request()
+        :type query_string: str
+        :rtype: BulkTrackingResult
+        """
+        result = BulkTrackingResult(query_string)
+        with self.__lock:
+            self.hits.append(result)
+            full = len(self.hits) >= self.max_hits
+            if len(self.hits) == 1 and self.max_age is not None and not full:
+                self.__timer = threading.Timer(self.max_age, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+            pending = len(self.hits)
+        if self.metrics is not None:
+            self.metrics.gauge('bulk.pending', pending)
+        if full:
+            self.flush()
+        return result
+
+    def send(self, query_strings):
+        """
+        Send hits right away, in one request together with the queued hits,
+        return their results
+
+        :param query_strings: Query strings as built by
+            PiwikTracker._get_request()
+        :type query_strings: list of str
+        :rtype: list of BulkTrackingResult
+        """
+        results = [BulkTrackingResult(query_string)
+                   for query_string in query_strings]
+        with self.__send_lock:
+            with self.__lock:
+                hits = self.hits + results
+                self.hits = []
+                if self.__timer is not None:
+                    self.__timer.cancel()
+                    self.__timer = None
+            if hits:
+                self._send(hits)
+        return results
+
+    def pending(self):
+        """
+        Returns the number of queued hits
+
+        :rtype: int
+        """
+        return len(self.hits)
+
+    def flush(self):
+        """
+        Send all queued hits, return their results
+
+        :rtype: list of BulkTrackingResult
+        """
+        with self.__send_lock:
+            with self.__lock:
+                hits = self.hits
+                self.hits = []
+                if self.__timer is not None:
+                    self.__timer.cancel()
+                    self.__timer = None
+            if hits:
+                self._send(hits)
+        return hits
+
+    def close(self):
+        """
+        Send the remaining hits
+
+        :rtype: None
+        """
+        self.flush()
+
+    def _get_body(self, hits):
+        """
+        Returns the JSON encoded bulk request
+
+        :param hits: The hits to send
+        :type hits: list of BulkTrackingResult
+        :rtype: bytes
+        """
+        data = {
+            'requests': ['?%s' % hit.query_string for hit in hits],
+        }
+        if self.token_auth:
+            data['token_auth'] = self.token_auth
+        return json.dumps(data).encode('utf-8')
+
+    def _send(self, hits):
+        """
+        Send the hits, resolve their results
+
+        :param hits: The hits to send
+        :type hits: list of BulkTrackingResult
+        :rtype: None
+        """
+        transport = self.transport
+        if transport is None:
+            transport = get_default_pool()
+        headers = {'Content-Type': 'application/json'}
+        body = self._get_body(hits)
+        if self.compress_level is not None and \
+                len(body) >= self.compress_threshold:
+            body = gzip_compress(body, self.compress_level)
+            headers['Content-Encoding'] = 'gzip'
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.increment('bulk.requests')
+            metrics.increment('bulk.hits', len(hits))
+            metrics.increment('bulk.bytes_sent', len(body))
+            metrics.gauge('bulk.pending', len(self.hits))
+        http_error = None
+        started = time.time()
+        try:
+            try:
+                response = transport.request('POST', self.api_url, body,
+                                             headers)
+            except HTTPError as e:
+                # Piwik answers 400 when a hit fails but still says how many
+                # hits it tracked before that
+                response = http_error = e
+            body = response.read()
+        except Exception as e:
+            if metrics is not None:
+                metrics.increment('bulk.errors.' + e.__class__.__name__)
+            for hit in hits:
+                hit._resolve(False, e)
+            return
+        if metrics is not None:
+            metrics.timing('bulk.latency', time.time() - started)
+            if http_error is not None:
+                metrics.increment('bulk.errors.HTTPError')
+        self._resolve(hits, body, http_error)
+
+    def _resolve(self, hits, body, http_error=None):
+        """
+        Resolve the results from the bulk tracking response
+
+        Newer Piwik versions list the invalid hits, older ones stop at the
+        first invalid hit and only tell us how many were tracked.
+
+        :param hits: The hits that were sent
+        :type hits: list of BulkTrackingResult
+        :param body: The response body
+        :type body: bytes
+        :param http_error: The error if Piwik didn't answer with 200
+        :type http_error: HTTPError or None
+        :rtype: None
+        """
+        try:
+            data = json.loads(body.decode('utf-8'))
+            tracked = int(data.get('tracked', 0))
+        except (ValueError, AttributeError):
+            # Not an answer from Piwik, e.g. a proxy error page
+            error = http_error or TrackingError(
+                "Unexpected bulk tracking response %r" % body[:100])
+            for hit in hits:
+                hit._resolve(False, error)
+            return
+        if 'invalid_indices' in data:
+            invalid = set(data['invalid_indices'])
+        else:
+            invalid = set(range(tracked, len(hits)))
+        for index, hit in enumerate(hits):
+            if index in invalid:
+                hit._resolve(False, TrackingError(
+                    "Piwik did not track hit %d of the bulk request: %s" %
+                    (index, data.get('message', data.get('status')))))
+            else:
+                hit._resolve(True)
@@ -0,0 +1,261 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import atexit
+import collections
+import hashlib
+import logging
+import threading
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from .events import TrackingEventSerializer
+from .exceptions import ConfigurationError
+from .tracking import PiwikTracker
+
+
+_ID_SITE = PiwikTracker.EVENT_STATE.index('id_site')
+_VISITOR_ID = PiwikTracker.EVENT_STATE.index('_visitor_id')
+_FORCED_VISITOR_ID = PiwikTracker.EVENT_STATE.index('forced_visitor_id')
+
+
+class CartCoalescer(object):
+    """
+    Holds cart updates for a moment and only sends the latest one of each
+    visitor
+
+    A cart update is held for ``window`` seconds after the first update of
+    a visitor. Updates that come in meanwhile replace it, then the last one
+    is added to the target. It isn't sent at all if the cart and the grand
+    total are the same as in the last cart update sent for the visitor.
+
+    Visitors are told apart by PiwikTracker.get_visitor_id(), so the
+    updates of one _pk_id cookie are coalesced even if every request has
+    its own tracker. The held update of a visitor is sent right away when
+    the visitor orders, before the order. Add the order to the same target
+    so Piwik gets them in that order. The order empties the cart, so the
+    next cart of the visitor is sent even if it has the same items. The
+    capture time is sent as the tracking time, so holding doesn't change
+    when Piwik records the update::
+
+        dispatcher = PiwikDispatcher('http://yoursite.example.com/piwik.php')
+        coalescer = CartCoalescer(dispatcher, window=2)
+        pte.set_dispatcher(dispatcher)
+        pte.set_cart_coalescer(coalescer)
+
+    ``coalesced`` counts the updates that were replaced, ``unchanged`` the
+    ones that weren't sent because the cart didn't change and ``sent`` the
+    ones that were added to the target. An update the target drops doesn't
+    count as sent, the next update of the same cart is sent again.
+    """
+    def __init__(self, target, window=2.0, max_visitors=10000,
+                 flush_at_exit=True):
+        """
+        :param target: Where to add the cart updates
+        :type target: piwikapi.dispatch.PiwikDispatcher,
+            piwikapi.spool.PiwikSpool or piwikapi.bulk.PiwikBulkTracker
+        :param window: Seconds a cart update is held
+        :type window: float
+        :param max_visitors: Number of visitors whose last cart is
+            remembered
+        :type max_visitors: int
+        :param flush_at_exit: Add the held updates to the target at exit
+        :type flush_at_exit: bool
+        :rtype: None
+        """
+        if max_visitors < 1:
+            raise ConfigurationError('max_visitors must be at least 1')
+        self.target = target
+        self.window = window
+        self.max_visitors = max_visitors
+        self.coalesced = 0
+        self.unchanged = 0
+        self.sent = 0
+        self.__serializer = TrackingEventSerializer()
+        # visitor key: [deadline, event, cart hash], oldest deadline first
+        self.__pending = collections.OrderedDict()
+        # visitor key: hash of the last cart sent
+        self.__sent_carts = collections.OrderedDict()
+        self.__closed = False
+        self.__lock = threading.Lock()
+        # Held while updates are taken from __pending and added to the
+        # target, so a flush waits for the updates the worker is sending
+        self.__send_lock = threading.Lock()
+        self.__changed = threading.Condition(self.__lock)
+        self.__thread = threading.Thread(target=self.__work,
+                                         name='CartCoalescer')
+        self.__thread.daemon = True
+        self.__thread.start()
+        if flush_at_exit:
+            atexit.register(self.close)
+
+    @staticmethod
+    def get_cart_hash(event):
+        """
+        Returns a hash of the items and the grand total of a cart update
+
+        :param event: Cart update
+        :type event: piwikapi.tracking.TrackingEvent
+        :rtype: bytes
+        """
+        items = sorted(event.ecommerce_items or (),
+                       key=lambda item: str(item[0]))
+        data = json.dumps([event.arguments[0], items], sort_keys=True)
+        return hashlib.md5(data.encode('utf-8')).digest()
+
+    def add(self, event):
+        """
+        Hold a cart update, returns False if it wasn't held because the
+        cart is unchanged
+
+        :param event: Cart update, see capture_ecommerce_cart_update()
+        :type event: piwikapi.tracking.TrackingEvent
+        :rtype: bool
+        """
+        state = event.state
+        # Events the trackers capture carry the cookie visitor ID
+        key = (state[_ID_SITE], event.visitor_id or
+               state[_FORCED_VISITOR_ID] or state[_VISITOR_ID])
+        cart_hash = self.get_cart_hash(event)
+        with self.__lock:
+            pending = self.__pending.get(key)
+            if pending is not None:
+                pending[1] = event
+                pending[2] = cart_hash
+                self.coalesced += 1
+                return True
+            if self.__sent_carts.get(key) == cart_hash:
+                self.unchanged += 1
+                return False
+            closed = self.__closed
+            if not closed:
+                self.__pending[key] = [time.time() + self.window, event,
+                                       cart_hash]
+                self.__changed.notify()
+        if closed:
+            with self.__send_lock:
+                self.__send([event, cart_hash, key])
+        return True
+
+    def flush_visitor(self, id_site, visitor_id):
+        """
+        Send the held cart update of a visitor now and forget the last cart
+        sent, the trackers call this before they send an order
+
+        :param id_site: Site ID
+        :type id_site: int
+        :param visitor_id: Visitor ID
+        :type visitor_id: str
+        :rtype: None
+        """
+        key = (id_site, visitor_id)
+        with self.__send_lock:
+            with self.__lock:
+                pending = self.__pending.pop(key, None)
+            if pending is not None:
+                self.__send([pending[1], pending[2], key])
+            with self.__lock:
+                self.__sent_carts.pop(key, None)
+
+    def flush(self):
+        """
+        Send all held cart updates now
+
+        :rtype: None
+        """
+        with self.__send_lock:
+            with self.__lock:
+                pending = list(self.__pending.items())
+                self.__pending.clear()
+            for key, (deadline, event, cart_hash) in pending:
+                self.__send([event, cart_hash, key])
+
+    def pending(self):
+        """
+        Returns the number of held cart updates
+
+        :rtype: int
+        """
+        return len(self.__pending)
+
+    def close(self):
+        """
+        Send the held cart updates and stop the background thread, later
+        updates are sent right away
+
+        :rtype: None
+        """
+        with self.__lock:
+            self.__closed = True
+            self.__changed.notify()
+        self.flush()
+        # atexit.unregister() is new in Python 3
+        if hasattr(atexit, 'unregister'):
+            atexit.unregister(self.close)
+
+    def __send(self, update):
+        """
+        Add a cart update to the target unless the cart is unchanged, the
+        caller holds the send lock
+
+        :param update: Cart update, its hash and the visitor key
+        :type update: list of [event, hash, key]
+        :rtype: None
+        """
+        event, cart_hash, key = update
+        with self.__lock:
+            if self.__sent_carts.get(key) == cart_hash:
+                self.unchanged += 1
+                return
+        if not self.target.add(self.__serializer.serialize(event)):
+            return
+        with self.__lock:
+            self.__sent_carts.pop(key, None)
+            self.__sent_carts[key] = cart_hash
+            if len(self.__sent_carts) > self.max_visitors:
+                self.__sent_carts.popitem(last=False)
+            self.sent += 1
+
+    def __work(self):
+        """
+        Send the cart updates whose window is over until closed
+        """
+        while True:
+            with self.__lock:
+                while not self.__closed:
+                    if self.__pending:
+                        deadline = next(iter(self.__pending.values()))[0]
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self.__changed.wait(remaining)
+                    else:
+                        self.__changed.wait()
+                if self.__closed:
+                    return
+            # A flush_visitor() that comes in meanwhile waits until the
+            # due updates are added to the target
+            with self.__send_lock:
+                due = []
+                with self.__lock:
+                    now = time.time()
+                    while self.__pending:
+                        key, pending = next(iter(self.__pending.items()))
+                        if pending[0] > now:
+                            break
+                        del self.__pending[key]
+                        due.append([pending[1], pending[2], key])
+                for update in due:
+                    try:
+                        self.__send(update)
+                    except Exception:
+                        logging.exception("Failed to send a cart update")
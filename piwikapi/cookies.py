@@ -0,0 +1,100 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import collections
+import threading
+
+from .exceptions import ConfigurationError
+
+
+class VisitorCookieJar(object):
+    """
+    Remembers the cookie Piwik sets in its tracking responses, per visitor
+
+    The tracker stores the last cookie of a response under the visitor ID,
+    see PiwikTracker.get_visitor_id(), and sends it in the Cookie header of
+    the later hits of that visitor.
+    Only the cookies of the last ``max_visitors`` visitors are kept, the
+    least recently used ones are dropped first.
+
+    Every tracker creates its own jar when Piwik first sets a cookie. A jar
+    can be shared between threads and trackers, e.g. the ones of a
+    PiwikTrackerTemplate::
+
+        jar = VisitorCookieJar(max_visitors=5000)
+        template = PiwikTrackerTemplate(1, api_url, cookie_jar=jar)
+    """
+    def __init__(self, max_visitors=1000):
+        """
+        :param max_visitors: Number of visitors whose cookie is kept
+        :type max_visitors: int
+        :rtype: None
+        """
+        if max_visitors < 1:
+            raise ConfigurationError('max_visitors must be at least 1')
+        self.max_visitors = max_visitors
+        self.__cookies = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def get_cookie(set_cookie_headers):
+        """
+        Returns the name=value pair of the last Set-Cookie header, like the
+        PHP tracker only the last cookie is kept
+
+        :param set_cookie_headers: Values of the Set-Cookie headers
+        :type set_cookie_headers: list of str
+        :rtype: str or None
+        """
+        if not set_cookie_headers:
+            return None
+        return set_cookie_headers[-1].split(';', 1)[0].strip() or None
+
+    def get(self, visitor_id):
+        """
+        Returns the cookie of a visitor
+
+        :param visitor_id: Visitor ID
+        :type visitor_id: str
+        :rtype: str or None
+        """
+        with self.__lock:
+            cookie = self.__cookies.pop(visitor_id, None)
+            if cookie is not None:
+                # Move it to the end, the oldest visitors are dropped first
+                self.__cookies[visitor_id] = cookie
+            return cookie
+
+    def set(self, visitor_id, cookie):
+        """
+        Store the cookie of a visitor
+
+        :param visitor_id: Visitor ID
+        :type visitor_id: str
+        :param cookie: Cookie, name=value
+        :type cookie: str
+        :rtype: None
+        """
+        with self.__lock:
+            self.__cookies.pop(visitor_id, None)
+            self.__cookies[visitor_id] = cookie
+            if len(self.__cookies) > self.max_visitors:
+                self.__cookies.popitem(last=False)
+
+    def clear(self):
+        """
+        Forget all cookies
+
+        :rtype: None
+        """
+        with self.__lock:
+            self.__cookies.clear()
+
+    def __len__(self):
+        return len(self.__cookies)
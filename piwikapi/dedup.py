@@ -0,0 +1,226 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import collections
+import hashlib
+import math
+import struct
+import threading
+import time
+
+from .exceptions import ConfigurationError
+from .tracking import TrackingEvent
+
+
+class RotatingBloomFilter(object):
+    """
+    Remembers keys for a time window in a fixed amount of memory
+
+    Two Bloom filters are kept, new keys go into the current one. Once it
+    is ``window`` seconds old or holds ``capacity`` keys, the previous
+    filter is dropped and the current one takes its place. A key is found
+    if it was added to one of them, so keys are remembered for at least
+    ``window`` seconds unless more than ``capacity`` keys come in per
+    window.
+
+    A key that wasn't added is found with a probability of about
+    ``error_rate`` per filter. Both filters together use about
+    ``-2 * capacity * ln(error_rate) / ln(2) ** 2`` bits. The filter isn't
+    thread-safe, HitDeduplicator locks it.
+    """
+    def __init__(self, capacity=100000, error_rate=0.001, window=60):
+        """
+        :param capacity: Keys per window
+        :type capacity: int
+        :param error_rate: False positive rate of one filter
+        :type error_rate: float
+        :param window: Seconds a filter takes new keys
+        :type window: float
+        :rtype: None
+        """
+        if capacity < 1:
+            raise ConfigurationError('capacity must be at least 1')
+        if not 0 < error_rate < 1:
+            raise ConfigurationError('error_rate must be between 0 and 1')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.window = window
+        bits = int(math.ceil(-capacity * math.log(error_rate) /
+                             math.log(2) ** 2))
+        self.size = (bits + 7) // 8 * 8
+        self.hashes = max(1, int(round(self.size / float(capacity) *
+                                       math.log(2))))
+        self.__current = bytearray(self.size // 8)
+        self.__previous = bytearray(self.size // 8)
+        self.__count = 0
+        self.__started = time.time()
+
+    def __get_positions(self, key):
+        """
+        Returns the bit positions of a key, from two 64 bit hashes
+
+        :param key: Key
+        :type key: bytes
+        :rtype: list of int
+        """
+        first, second = struct.unpack('<QQ', hashlib.md5(key).digest())
+        size = self.size
+        return [(first + i * second) % size for i in range(self.hashes)]
+
+    def __rotate(self):
+        """
+        Start a new current filter if the current one is full or too old
+
+        :rtype: None
+        """
+        now = time.time()
+        if self.__count >= self.capacity or \
+                now - self.__started >= self.window:
+            if now - self.__started >= 2 * self.window:
+                # Nothing in the current filter is in the window anymore
+                self.__previous = bytearray(self.size // 8)
+            else:
+                self.__previous = self.__current
+            self.__current = bytearray(self.size // 8)
+            self.__count = 0
+            self.__started = now
+
+    def add(self, key):
+        """
+        Add a key, returns True if it was probably added before
+
+        :param key: Key
+        :type key: bytes
+        :rtype: bool
+        """
+        positions = self.__get_positions(key)
+        self.__rotate()
+        current = self.__current
+        previous = self.__previous
+        in_current = True
+        in_previous = True
+        for position in positions:
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not current[byte] & mask:
+                in_current = False
+                current[byte] |= mask
+            if in_previous and not previous[byte] & mask:
+                in_previous = False
+        if not in_current:
+            self.__count += 1
+        return in_current or in_previous
+
+
+class HitDeduplicator(object):
+    """
+    Suppresses hits that were already tracked
+
+    Page views are keyed on the visitor ID and the page URL, downloads and
+    outlinks on the visitor ID, the action URL and the action type. The
+    visitor ID is the one of the _pk_id cookie if the request has one, so
+    reloads are suppressed. These keys go into a RotatingBloomFilter, so a
+    repeated hit is suppressed within ``window`` seconds, and a new hit is
+    suppressed with a probability of about ``error_rate``.
+
+    Ecommerce orders are suppressed when the order ID of the site is one of
+    the last ``max_orders`` order IDs. Goals and cart updates are never
+    suppressed.
+
+    A deduplicator can be shared between threads and trackers::
+
+        deduplicator = HitDeduplicator(capacity=50000, window=30)
+        pt.set_deduplicator(deduplicator)
+    """
+    def __init__(self, capacity=100000, error_rate=0.001, window=60,
+                 max_orders=10000):
+        """
+        :param capacity: Page views and actions per window
+        :type capacity: int
+        :param error_rate: Share of new hits that are suppressed
+        :type error_rate: float
+        :param window: Seconds a hit is remembered
+        :type window: float
+        :param max_orders: Number of order IDs that are remembered
+        :type max_orders: int
+        :rtype: None
+        """
+        if max_orders < 1:
+            raise ConfigurationError('max_orders must be at least 1')
+        self.filter = RotatingBloomFilter(capacity, error_rate, window)
+        self.max_orders = max_orders
+        self.__orders = collections.OrderedDict()
+        self.__suppressed = dict((kind, 0) for kind in (
+            TrackingEvent.PAGE_VIEW, TrackingEvent.ACTION,
+            TrackingEvent.ORDER))
+        self.__checked = 0
+        self.__lock = threading.Lock()
+
+    def __seen_order(self, id_site, order_id):
+        """
+        Remember an order ID, returns True if it is known, the lock must be
+        held
+
+        :rtype: bool
+        """
+        key = (id_site, order_id)
+        orders = self.__orders
+        if key in orders:
+            # Move it to the end, the oldest order IDs are dropped first
+            orders[key] = orders.pop(key)
+            return True
+        orders[key] = True
+        if len(orders) > self.max_orders:
+            orders.popitem(last=False)
+        return False
+
+    def is_duplicate(self, id_site, visitor_id, url, kind, arguments):
+        """
+        Remember a hit, returns True if it was tracked before
+
+        :param id_site: Site ID
+        :type id_site: int
+        :param visitor_id: Visitor ID
+        :type visitor_id: str
+        :param url: Page URL
+        :type url: str
+        :param kind: Event kind, see TrackingEvent
+        :type kind: str
+        :param arguments: Arguments of the do_track_*() method
+        :type arguments: tuple
+        :rtype: bool
+        """
+        if kind == TrackingEvent.PAGE_VIEW:
+            key = '%s\0%s\0%s\0%s' % (kind, id_site, visitor_id, url)
+        elif kind == TrackingEvent.ACTION:
+            key = '%s\0%s\0%s\0%s\0%s' % (kind, id_site, visitor_id,
+                                          arguments[0], arguments[1])
+        elif kind != TrackingEvent.ORDER:
+            return False
+        with self.__lock:
+            self.__checked += 1
+            if kind == TrackingEvent.ORDER:
+                duplicate = self.__seen_order(id_site, arguments[0])
+            else:
+                if not isinstance(key, bytes):
+                    key = key.encode('utf-8')
+                duplicate = self.filter.add(key)
+            if duplicate:
+                self.__suppressed[kind] += 1
+        return duplicate
+
+    def stats(self):
+        """
+        Returns the number of checked hits and the suppressed hits per kind
+
+        :rtype: dict
+        """
+        with self.__lock:
+            stats = {'checked': self.__checked}
+            stats.update(self.__suppressed)
+            return stats
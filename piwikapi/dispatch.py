@@ -0,0 +1,264 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import atexit
+import collections
+import logging
+import threading
+import time
+
+from .exceptions import ConfigurationError
+from .transport import get_default_pool
+
+
+class PiwikDispatcher(object):
+    """
+    Sends tracking requests from a pool of background threads
+
+    Hits are put in a bounded queue and the do_track_*() methods return
+    right away. When the queue is full the ``overflow`` policy decides what
+    happens:
+
+    - ``block``: wait up to ``block_timeout`` seconds for space, then drop
+      the new hit
+    - ``drop_newest``: drop the new hit
+    - ``drop_oldest``: drop the oldest queued hit to make space
+
+    Dropped hits are counted in ``dropped``. At interpreter exit the
+    remaining hits are sent for at most ``shutdown_timeout`` seconds.
+    """
+    #: Valid overflow policies
+    OVERFLOW_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+    def __init__(self, api_url, workers=2, max_queue=1000, overflow='block',
+                 block_timeout=None, shutdown_timeout=5, transport=None,
+                 metrics=None):
+        """
+        :param api_url: Piwik tracking API URL, the URL of piwik.php
+        :type api_url: str
+        :param workers: Number of sending threads
+        :type workers: int
+        :param max_queue: Maximum number of queued hits
+        :type max_queue: int
+        :param overflow: What to do when the queue is full, see above
+        :type overflow: str
+        :param block_timeout: Seconds to wait for space with the ``block``
+            policy, None to wait forever
+        :type block_timeout: float or None
+        :param shutdown_timeout: Seconds to spend sending the remaining hits
+            at exit, None to not send them
+        :type shutdown_timeout: float or None
+        :param transport: Transport, None for the shared connection pool
+        :type transport: piwikapi.transport.HTTPConnectionPool or None
+        :param metrics: Metrics sink, None to report nothing
+        :type metrics: piwikapi.metrics.Metrics or None
+        :rtype: None
+        """
+        if not api_url:
+            raise ConfigurationError('API URL not set')
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ConfigurationError("Unknown overflow policy %s, please use "
+                                     "one of %s" % (overflow,
+                                                    self.OVERFLOW_POLICIES))
+        if workers < 1 or max_queue < 1:
+            raise ConfigurationError('workers and max_queue must be at '
+                                     'least 1')
+        self.api_url = api_url
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.transport = transport
+        self.metrics = metrics
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.__queue = collections.deque()
+        self.__unfinished = 0
+        self.__closed = False
+        self.__lock = threading.Lock()
+        self.__not_empty = threading.Condition(self.__lock)
+        self.__not_full = threading.Condition(self.__lock)
+        self.__all_done = threading.Condition(self.__lock)
+        self.__workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self.__work,
+                                      name='PiwikDispatcher-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+        if shutdown_timeout is not None:
+            atexit.register(self.close, shutdown_timeout)
+
+    def add(self, query_string):
+        """
+        Queue a hit, returns False if it was dropped
+
+        :param query_string: Query string as built by
+            PiwikTracker._get_dispatch_query_string()
+        :type query_string: str
+        :rtype: bool
+        """
+        with self.__lock:
+            dropped = self.dropped
+            added = self.__add(query_string)
+            dropped = self.dropped - dropped
+            depth = len(self.__queue)
+        metrics = self.metrics
+        if metrics is not None:
+            if dropped:
+                metrics.increment('dispatch.dropped', dropped)
+            metrics.gauge('dispatch.queue_depth', depth)
+        return added
+
+    def __add(self, query_string):
+        """
+        Queue a hit, the lock must be held
+
+        :rtype: bool
+        """
+        if self.__closed:
+            self.dropped += 1
+            return False
+        if len(self.__queue) >= self.max_queue:
+            if self.overflow == 'drop_oldest':
+                self.__queue.popleft()
+                self.__unfinished -= 1
+                self.dropped += 1
+            elif (self.overflow == 'drop_newest' or
+                  not self.__wait_for_space()):
+                self.dropped += 1
+                return False
+        self.__queue.append(query_string)
+        self.__unfinished += 1
+        self.__not_empty.notify()
+        return True
+
+    def __wait_for_space(self):
+        """
+        Wait for the workers to make space in the queue, the lock must be
+        held
+
+        :rtype: bool
+        """
+        if self.block_timeout is not None:
+            deadline = time.time() + self.block_timeout
+        while len(self.__queue) >= self.max_queue and not self.__closed:
+            if self.block_timeout is None:
+                self.__not_full.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.__not_full.wait(remaining)
+        return not self.__closed
+
+    def qsize(self):
+        """
+        Returns the number of queued hits
+
+        :rtype: int
+        """
+        return len(self.__queue)
+
+    def flush(self, timeout=None):
+        """
+        Wait until all queued hits were sent, returns False on timeout
+
+        :param timeout: Timeout in seconds
+        :type timeout: float or None
+        :rtype: bool
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.__lock:
+            while self.__unfinished:
+                if timeout is None:
+                    self.__all_done.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.__all_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Send the queued hits for at most timeout seconds and stop the
+        workers. Hits that couldn't be sent in time are counted as dropped.
+
+        :param timeout: Timeout in seconds, None to wait until all hits
+            were sent
+        :type timeout: float or None
+        :rtype: None
+        """
+        self.flush(timeout)
+        with self.__lock:
+            self.__closed = True
+            self.dropped += len(self.__queue)
+            self.__unfinished -= len(self.__queue)
+            self.__queue.clear()
+            self.__not_empty.notify_all()
+            self.__not_full.notify_all()
+            self.__all_done.notify_all()
+        # Don't keep closed dispatchers alive until exit, atexit.unregister()
+        # is new in Python 3
+        if hasattr(atexit, 'unregister'):
+            atexit.unregister(self.close)
+
+    def __work(self):
+        """
+        Send queued hits until the dispatcher is closed
+        """
+        while True:
+            with self.__lock:
+                while not self.__queue and not self.__closed:
+                    self.__not_empty.wait()
+                if not self.__queue:
+                    return
+                query_string = self.__queue.popleft()
+                self.__not_full.notify()
+            metrics = self.metrics
+            started = time.time()
+            try:
+                self._send(query_string)
+                sent = True
+            except Exception as e:
+                logging.exception("Failed to send tracking request")
+                sent = False
+                if metrics is not None:
+                    metrics.increment('dispatch.errors.' +
+                                      e.__class__.__name__)
+            with self.__lock:
+                if sent:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                self.__unfinished -= 1
+                depth = len(self.__queue)
+                if not self.__unfinished:
+                    self.__all_done.notify_all()
+            if metrics is not None:
+                if sent:
+                    metrics.timing('dispatch.latency', time.time() - started)
+                metrics.increment(sent and 'dispatch.sent' or
+                                  'dispatch.failed')
+                metrics.gauge('dispatch.queue_depth', depth)
+
+    def _send(self, query_string):
+        """
+        Send one hit
+
+        :param query_string: Query string
+        :type query_string: str
+        :rtype: None
+        """
+        transport = self.transport
+        if transport is None:
+            transport = get_default_pool()
+        transport.request('GET', '%s?%s' % (self.api_url, query_string))
@@ -0,0 +1,89 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+from .template import _TemplateRequest
+from .tracking import PiwikTrackerEcommerce
+
+
+#: Custom variable dicts of the event state, a new one is only encoded if
+#: custom_var_version changes
+_CUSTOM_VARIABLES = ('page_custom_var', 'visitor_custom_var')
+
+class TrackingEventSerializer(object):
+    """
+    Turns TrackingEvent objects into query strings
+
+    The query strings are the ones a tracker's dispatcher would get, with
+    the capture time as the tracking time. They can be added to a
+    PiwikDispatcher, PiwikSpool or PiwikBulkTracker.
+
+    The serializer keeps one tracker that it loads with the state of every
+    event, the encoded parameters are reused when consecutive events share
+    them. Use one serializer per thread.
+    """
+    def __init__(self, tracker_class=PiwikTrackerEcommerce):
+        """
+        :param tracker_class: The tracker class, must be able to track all
+            event kinds that are serialized
+        :type tracker_class: class
+        :rtype: None
+        """
+        self.tracker = tracker_class(0, _TemplateRequest())
+
+    def serialize(self, event):
+        """
+        Returns the query string of an event
+
+        :param event: The event
+        :type event: piwikapi.tracking.TrackingEvent
+        :raises: InvalidParameter if the tracker class can't track the event
+        :rtype: str
+        """
+        tracker = self.tracker
+        attributes = tracker.__dict__
+        for name, value in zip(tracker.EVENT_STATE, event.state):
+            # Keep equal values, their encoding is cached
+            current = attributes.get(name)
+            if type(current) is not type(value) or current != value:
+                attributes[name] = value
+                if name in _CUSTOM_VARIABLES:
+                    tracker.custom_var_version += 1
+        if event.ecommerce_items is not None:
+            tracker.ecommerce_items = dict((item[0], item)
+                                           for item in event.ecommerce_items)
+        url = tracker._get_event_url(event.kind, event.arguments)
+        url = tracker._get_bulk_query_string(url)
+        return url + '&cdt=%d' % event.timestamp
+
+    def serialize_many(self, events):
+        """
+        Returns the query strings of events
+
+        :param events: The events, None values of dropped hits are
+            skipped
+        :type events: iterable of piwikapi.tracking.TrackingEvent
+        :rtype: list of str
+        """
+        serialize = self.serialize
+        return [serialize(event) for event in events if event is not None]
+
+    def send(self, events, target):
+        """
+        Add the query strings of events to a dispatcher, spool or bulk
+        tracker, returns what its add() method returned
+
+        :param events: The events
+        :type events: iterable of piwikapi.tracking.TrackingEvent
+        :param target: Where to add the query strings
+        :type target: piwikapi.dispatch.PiwikDispatcher,
+            piwikapi.spool.PiwikSpool or piwikapi.bulk.PiwikBulkTracker
+        :rtype: list
+        """
+        return [target.add(query_string)
+                for query_string in self.serialize_many(events)]
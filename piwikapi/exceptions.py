@@ -4,3 +4,11 @@ class InvalidParameter(Exception):
 
 class ConfigurationError(Exception):
     pass
+
+
+class TrackingError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
@@ -0,0 +1,174 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import threading
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from .bulk import PiwikBulkTracker
+from .events import TrackingEventSerializer
+from .exceptions import ConfigurationError
+from .exceptions import InvalidParameter
+from .tracking import PiwikTracker
+from .tracking import _quote
+
+
+_PAGE_CUSTOM_VAR = PiwikTracker.EVENT_STATE.index('page_custom_var')
+_VISITOR_CUSTOM_VAR = PiwikTracker.EVENT_STATE.index('visitor_custom_var')
+
+
+class SiteFanOut(object):
+    """
+    Tracks a captured hit in several sites
+
+    The hit is encoded once, the query string of each site only differs in
+    the site ID and in the auth token and custom variables set for the
+    site. Custom variables of a site are merged into the ones of the hit.
+
+    With a PiwikBulkTracker as target the hits of all sites are sent right
+    away in one bulk request, other targets get them one by one::
+
+        bulk = PiwikBulkTracker('http://yoursite.example.com/piwik.php',
+                                token_auth='YOUR_AUTH_TOKEN_STRING')
+        fan_out = SiteFanOut([3, 1], bulk)
+        fan_out.set_custom_variable(1, 1, 'Brand', 'shoes', 'page')
+        fan_out.send(pt.capture_page_view('Some page title'))
+
+    A fan-out can be shared between threads.
+    """
+    def __init__(self, sites, target):
+        """
+        :param sites: Site IDs
+        :type sites: list of int
+        :param target: Where to send the hits
+        :type target: piwikapi.bulk.PiwikBulkTracker,
+            piwikapi.dispatch.PiwikDispatcher or piwikapi.spool.PiwikSpool
+        :raises: ConfigurationError if no site was given
+        :rtype: None
+        """
+        if not sites:
+            raise ConfigurationError('At least one site is needed')
+        self.sites = list(sites)
+        self.target = target
+        self.site_tokens = {}
+        self.site_custom_vars = {}
+        self.__serializer = TrackingEventSerializer()
+        self.__lock = threading.Lock()
+
+    def set_token_auth(self, id_site, token_auth):
+        """
+        Send the hits of a site with another auth token
+
+        :param id_site: Site ID
+        :type id_site: int
+        :param token_auth: Auth token
+        :type token_auth: str
+        :rtype: None
+        """
+        self.site_tokens[id_site] = token_auth
+
+    def set_custom_variable(self, id_site, id, name, value, scope='visit'):
+        """
+        Set a custom variable for the hits of one site, see
+        PiwikTracker.set_custom_variable()
+
+        :param id_site: Site ID
+        :type id_site: int
+        :param id: Custom variable slot ID, 1-5
+        :type id: int
+        :param name: Variable name
+        :type name: str
+        :param value: Variable value
+        :type value: str
+        :param scope: Variable scope, either visit or page
+        :type scope: str
+        :raises: InvalidParameter if the ID or scope is invalid
+        :rtype: None
+        """
+        if type(id) != type(int()):
+            raise InvalidParameter("Parameter id must be int, not %s" %
+                                   type(id))
+        if scope not in ('page', 'visit'):
+            raise InvalidParameter("Invalid scope parameter value %s" % scope)
+        custom_vars = self.site_custom_vars.setdefault(
+            id_site, {'page': {}, 'visit': {}})
+        custom_vars[scope][id] = (name, value)
+
+    def __get_overrides(self, id_site, event):
+        """
+        Returns the encoded parameters that differ for a site
+
+        :rtype: dict of {name: encoded value}
+        """
+        overrides = {}
+        token_auth = self.site_tokens.get(id_site)
+        if token_auth:
+            overrides['token_auth'] = _quote(token_auth)
+        custom_vars = self.site_custom_vars.get(id_site)
+        if custom_vars:
+            for scope, name, index in (('page', 'cvar', _PAGE_CUSTOM_VAR),
+                                       ('visit', '_cvar',
+                                        _VISITOR_CUSTOM_VAR)):
+                if custom_vars[scope]:
+                    merged = dict(event.state[index])
+                    merged.update(custom_vars[scope])
+                    overrides[name] = _quote(json.dumps(merged))
+        return overrides
+
+    def serialize(self, event):
+        """
+        Returns the query strings of an event for all sites
+
+        :param event: The event, None for a dropped hit
+        :type event: piwikapi.tracking.TrackingEvent or None
+        :rtype: list of str
+        """
+        if event is None:
+            return []
+        with self.__lock:
+            query_string = self.__serializer.serialize(event)
+        # Every value is encoded, so the query string can be split at '&'.
+        # The site ID comes first.
+        params = query_string.split('&')[1:]
+        rest = '&'.join(params)
+        query_strings = []
+        for id_site in self.sites:
+            overrides = self.__get_overrides(id_site, event)
+            if not overrides:
+                query_strings.append('idsite=%s&%s' % (id_site, rest))
+                continue
+            site_params = ['idsite=%s' % id_site]
+            for param in params:
+                name = param.split('=', 1)[0]
+                if name in overrides:
+                    param = '%s=%s' % (name, overrides.pop(name))
+                site_params.append(param)
+            site_params.extend('%s=%s' % override
+                               for override in sorted(overrides.items()))
+            query_strings.append('&'.join(site_params))
+        return query_strings
+
+    def send(self, event):
+        """
+        Send an event to all sites, returns what the target returned
+
+        :param event: The event, see the capture_*() methods of the
+            trackers. None for a dropped hit, nothing is sent then.
+        :type event: piwikapi.tracking.TrackingEvent or None
+        :rtype: list
+        """
+        query_strings = self.serialize(event)
+        if isinstance(self.target, PiwikBulkTracker):
+            if not query_strings:
+                return []
+            return self.target.send(query_strings)
+        return [self.target.add(query_string)
+                for query_string in query_strings]
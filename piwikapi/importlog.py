@@ -0,0 +1,504 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+Imports web server access logs through bulk tracking requests::
+
+    python -m piwikapi.importlog --url http://piwik.example.com/piwik.php \\
+        --id-site 1 --token-auth TOKEN --hostname www.example.com access.log
+"""
+
+import datetime
+import hashlib
+import itertools
+import multiprocessing
+import optparse
+import re
+import sys
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .bulk import PiwikBulkTracker
+from .exceptions import ConfigurationError
+from .template import _TemplateRequest
+from .tracking import PiwikTracker
+
+
+_COMMON = (r'(?P<ip>\S+) \S+ \S+ \[(?P<date>[^\]]+)\] '
+           r'"(?P<method>\S+) (?P<path>\S+)[^"]*" (?P<status>\d{3}) \S+')
+
+#: Regular expressions of the supported log formats
+LOG_FORMATS = {
+    'common': _COMMON,
+    'combined': _COMMON + r' "(?P<referer>[^"]*)" "(?P<user_agent>[^"]*)"',
+}
+
+MONTHS = dict((month, i + 1) for i, month in enumerate((
+    'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+    'Nov', 'Dec')))
+
+
+def parse_date(value):
+    """
+    Parse a log date like ``10/Oct/2000:13:55:36 -0700`` into a naive
+    datetime in UTC
+
+    :param value: Log date
+    :type value: str
+    :raises: ValueError if the date is invalid
+    :rtype: datetime.datetime
+    """
+    date, _, zone = value.partition(' ')
+    day, month, rest = date.split('/')
+    year, hour, minute, second = rest.split(':')
+    try:
+        month = MONTHS[month]
+    except KeyError:
+        raise ValueError('Unknown month %s' % month)
+    parsed = datetime.datetime(int(year), month, int(day), int(hour),
+                               int(minute), int(second))
+    if zone:
+        offset = datetime.timedelta(hours=int(zone[1:3]),
+                                    minutes=int(zone[3:5]))
+        if zone[0] == '-':
+            parsed += offset
+        else:
+            parsed -= offset
+    return parsed
+
+
+def read_chunks(stream, chunk_lines=1000, offset=0):
+    """
+    Read complete lines from a binary stream in chunks
+
+    A last line without a newline isn't read, it may still be written.
+
+    :param stream: Binary stream positioned at offset
+    :type stream: file
+    :param chunk_lines: Lines per chunk
+    :type chunk_lines: int
+    :param offset: Byte offset of the stream position
+    :type offset: int
+    :rtype: generator of (end offset, list of bytes) tuples
+    """
+    lines = []
+    for line in iter(stream.readline, b''):
+        if not line.endswith(b'\n'):
+            break
+        offset += len(line)
+        lines.append(line)
+        if len(lines) >= chunk_lines:
+            yield offset, lines
+            lines = []
+    if lines:
+        yield offset, lines
+
+
+class LogParser(object):
+    """
+    Turns access log lines into bulk tracking query strings
+
+    Every line becomes a page view of the logged URL at the logged time.
+    The visitor ID is a hash of the IP and the user agent, so the lines of
+    a visitor are one visit in Piwik. Lines with a status outside of 2xx
+    and paths matching ``exclude_path`` are skipped.
+    """
+    def __init__(self, id_site, hostname, log_format='combined',
+                 https=False, exclude_path=None, shards=1):
+        """
+        :param id_site: Site ID
+        :type id_site: int
+        :param hostname: Host name of the logged site
+        :type hostname: str
+        :param log_format: Log format, a key of LOG_FORMATS
+        :type log_format: str
+        :param https: Whether the site is served over HTTPS
+        :type https: bool
+        :param exclude_path: Regular expression of paths to skip
+        :type exclude_path: str or None
+        :param shards: Number of shards the visitors are split into
+        :type shards: int
+        :rtype: None
+        """
+        if log_format not in LOG_FORMATS:
+            raise ConfigurationError("Unknown log format %s, please use one "
+                                     "of %s" % (log_format,
+                                                sorted(LOG_FORMATS)))
+        self.id_site = id_site
+        self.pattern = re.compile(LOG_FORMATS[log_format])
+        self.base_url = '%s://%s' % (https and 'https' or 'http', hostname)
+        self.exclude_path = exclude_path and re.compile(exclude_path)
+        self.shards = shards
+        self.tracker = PiwikTracker(id_site, _TemplateRequest())
+
+    def parse_line(self, line):
+        """
+        Returns the shard and the query string of a log line, None if it is
+        skipped
+
+        :param line: Log line
+        :type line: str
+        :raises: ValueError if the line can't be parsed
+        :rtype: tuple of (int, str) or None
+        """
+        match = self.pattern.match(line)
+        if match is None:
+            raise ValueError('Invalid log line %r' % line)
+        fields = match.groupdict()
+        path = fields['path']
+        if not fields['status'].startswith('2') or \
+                (self.exclude_path and self.exclude_path.match(path)):
+            return None
+        user_agent = fields.get('user_agent') or ''
+        if user_agent == '-':
+            user_agent = ''
+        referer = fields.get('referer') or ''
+        if referer == '-':
+            referer = ''
+        visitor_id = hashlib.md5(
+            ('%s %s' % (fields['ip'], user_agent)).encode('utf-8')
+        ).hexdigest()[:PiwikTracker.LENGTH_VISITOR_ID]
+        tracker = self.tracker
+        tracker.page_url = self.base_url + path
+        tracker.referer = referer
+        tracker.user_agent = user_agent
+        tracker.ip = fields['ip']
+        tracker.visitor_id = visitor_id
+        tracker.forced_datetime = parse_date(fields['date'])
+        url = tracker._get_request(self.id_site)
+        url = tracker._get_bulk_query_string(url)
+        return int(visitor_id[:8], 16) % self.shards, url
+
+    def parse_chunk(self, lines):
+        """
+        Parse the lines of a chunk
+
+        :param lines: Log lines
+        :type lines: list of bytes
+        :rtype: tuple of (list of (shard, query string) tuples, number of
+            invalid lines, number of skipped lines)
+        """
+        hits = []
+        invalid = 0
+        skipped = 0
+        parse_line = self.parse_line
+        for line in lines:
+            try:
+                hit = parse_line(line.decode('utf-8', 'replace'))
+            except ValueError:
+                invalid += 1
+                continue
+            if hit is None:
+                skipped += 1
+            else:
+                hits.append(hit)
+        return hits, invalid, skipped
+
+
+_parser = None
+
+
+def _init_worker(options):
+    global _parser
+    _parser = LogParser(**options)
+
+
+def _parse_chunk(chunk):
+    offset, lines = chunk
+    return (offset, len(lines)) + _parser.parse_chunk(lines)
+
+
+class _Shard(object):
+    """
+    Sends the hits of some visitors in order from a background thread
+    """
+    def __init__(self, bulk_tracker, max_queue):
+        self.bulk_tracker = bulk_tracker
+        self.queue = queue.Queue(max_queue)
+        self.results = []
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.bulk_tracker.flush()
+                return
+            if hasattr(item, 'set'):
+                # A checkpoint
+                self.bulk_tracker.flush()
+                item.set()
+            else:
+                self.results.append(self.bulk_tracker.add(item))
+
+    def get_failed(self):
+        """
+        Returns the number of failed hits since the last call, the shard
+        must be flushed
+
+        :rtype: int
+        """
+        failed = len([result for result in self.results
+                      if not result.tracked])
+        self.results = []
+        return failed
+
+
+class LogImporter(object):
+    """
+    Imports access logs through bulk tracking requests
+
+    The log is read in chunks of lines that are parsed by a process pool.
+    The hits are split into shards by visitor, every shard sends its hits
+    in order from a thread, so the hits of a visitor stay in order.
+
+    Every ``report_interval`` seconds all shards are flushed and ``report``
+    is called with the stats. Their ``offset`` is the byte offset up to
+    which all hits were sent, pass it to run() to resume an import.
+    """
+    def __init__(self, api_url, id_site, token_auth, hostname,
+                 log_format='combined', https=False, exclude_path=None,
+                 processes=None, shards=4, max_hits=100, chunk_lines=1000,
+                 transport=None, compress_level=None, report_interval=10,
+                 report=None):
+        """
+        :param api_url: Piwik tracking API URL, the URL of piwik.php
+        :type api_url: str
+        :param id_site: Site ID
+        :type id_site: int
+        :param token_auth: Auth token, required to track past hits
+        :type token_auth: str
+        :param hostname: Host name of the logged site
+        :type hostname: str
+        :param log_format: Log format, a key of LOG_FORMATS
+        :type log_format: str
+        :param https: Whether the site is served over HTTPS
+        :type https: bool
+        :param exclude_path: Regular expression of paths to skip
+        :type exclude_path: str or None
+        :param processes: Parsing processes, None for one per CPU, 0 to
+            parse in this process
+        :type processes: int or None
+        :param shards: Number of sending threads
+        :type shards: int
+        :param max_hits: Hits per bulk request
+        :type max_hits: int
+        :param chunk_lines: Lines parsed per task
+        :type chunk_lines: int
+        :param transport: Transport, None for the shared connection pool
+        :type transport: piwikapi.transport.HTTPConnectionPool or None
+        :param compress_level: gzip level of the bulk requests, None to not
+            compress
+        :type compress_level: int or None
+        :param report_interval: Seconds between progress reports
+        :type report_interval: float
+        :param report: Called with the stats dict, None to print them
+        :type report: callable or None
+        :rtype: None
+        """
+        if not token_auth:
+            raise ConfigurationError('token_auth is required to import logs')
+        if shards < 1:
+            raise ConfigurationError('shards must be at least 1')
+        self.parser_options = {
+            'id_site': id_site,
+            'hostname': hostname,
+            'log_format': log_format,
+            'https': https,
+            'exclude_path': exclude_path,
+            'shards': shards,
+        }
+        # Fail early on invalid options
+        LogParser(**self.parser_options)
+        self.api_url = api_url
+        self.token_auth = token_auth
+        self.processes = processes
+        self.shards = shards
+        self.max_hits = max_hits
+        self.chunk_lines = chunk_lines
+        self.transport = transport
+        self.compress_level = compress_level
+        self.report_interval = report_interval
+        self.report = report or print_stats
+
+    def run(self, stream, offset=0):
+        """
+        Import a log, returns the stats
+
+        :param stream: Binary stream, positioned at offset
+        :type stream: file
+        :param offset: Byte offset of the stream position
+        :type offset: int
+        :rtype: dict
+        """
+        shards = [_Shard(PiwikBulkTracker(self.api_url, self.token_auth,
+                                          self.max_hits, None,
+                                          self.transport,
+                                          self.compress_level),
+                         self.max_hits * 10)
+                  for i in range(self.shards)]
+        stats = {
+            'lines': 0,
+            'hits': 0,
+            'invalid': 0,
+            'skipped': 0,
+            'failed': 0,
+            'offset': offset,
+            'seconds': 0.0,
+            'hits_per_second': 0.0,
+        }
+        started = last_report = time.time()
+        pool = None
+        if self.processes == 0:
+            parser = LogParser(**self.parser_options)
+
+            def parse(chunks):
+                return [(offset, len(lines)) + parser.parse_chunk(lines)
+                        for offset, lines in chunks]
+        else:
+            pool = multiprocessing.Pool(self.processes, _init_worker,
+                                        (self.parser_options,))
+
+            def parse(chunks):
+                return pool.imap(_parse_chunk, chunks)
+        parsed_offset = offset
+        try:
+            chunks = read_chunks(stream, self.chunk_lines, offset)
+            # Only read a few chunks ahead of the senders
+            window = (self.processes or multiprocessing.cpu_count()) * 4
+            while True:
+                batch = list(itertools.islice(chunks, window))
+                if not batch:
+                    break
+                for parsed_offset, lines, hits, invalid, skipped in \
+                        parse(batch):
+                    stats['lines'] += lines
+                    stats['invalid'] += invalid
+                    stats['skipped'] += skipped
+                    stats['hits'] += len(hits)
+                    for shard, query_string in hits:
+                        shards[shard].queue.put(query_string)
+                if time.time() - last_report >= self.report_interval:
+                    self.__checkpoint(shards, stats, parsed_offset, started)
+                    self.report(stats)
+                    last_report = time.time()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            for shard in shards:
+                shard.queue.put(None)
+            for shard in shards:
+                shard.thread.join()
+        self.__update_stats(shards, stats, parsed_offset, started)
+        self.report(stats)
+        return stats
+
+    def __checkpoint(self, shards, stats, offset, started):
+        """
+        Wait until the shards sent all hits, then update the stats
+        """
+        events = []
+        for shard in shards:
+            event = threading.Event()
+            shard.queue.put(event)
+            events.append(event)
+        for event in events:
+            event.wait()
+        self.__update_stats(shards, stats, offset, started)
+
+    def __update_stats(self, shards, stats, offset, started):
+        stats['failed'] += sum(shard.get_failed() for shard in shards)
+        stats['offset'] = offset
+        stats['seconds'] = time.time() - started
+        if stats['seconds']:
+            stats['hits_per_second'] = stats['hits'] / stats['seconds']
+
+
+def print_stats(stats):
+    """
+    Print the progress of an import to stderr
+
+    :param stats: Stats as passed to the report callback of LogImporter
+    :type stats: dict
+    :rtype: None
+    """
+    sys.stderr.write('%(lines)d lines, %(hits)d hits, %(invalid)d invalid, '
+                     '%(skipped)d skipped, %(failed)d failed, '
+                     '%(hits_per_second).0f hits/s, offset %(offset)d\n' %
+                     stats)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    :param argv: Arguments, None for sys.argv
+    :type argv: list of str or None
+    :rtype: int
+    """
+    parser = optparse.OptionParser(
+        usage='%prog --url URL --id-site ID --token-auth TOKEN '
+              '--hostname HOST [options] LOGFILE',
+        prog='python -m piwikapi.importlog')
+    parser.add_option('--url', help='Piwik tracking API URL')
+    parser.add_option('--id-site', type='int', help='Site ID')
+    parser.add_option('--token-auth', help='Auth token')
+    parser.add_option('--hostname', help='Host name of the logged site')
+    parser.add_option('--https', action='store_true', default=False,
+                      help='The site is served over HTTPS')
+    parser.add_option('--format', default='combined',
+                      choices=sorted(LOG_FORMATS),
+                      help='Log format: %s [default: %%default]' %
+                      ', '.join(sorted(LOG_FORMATS)))
+    parser.add_option('--exclude-path', metavar='REGEX',
+                      help='Skip paths matching this regular expression')
+    parser.add_option('--offset', type='int', default=0,
+                      help='Resume from this byte offset')
+    parser.add_option('--processes', type='int',
+                      help='Parsing processes [default: one per CPU]')
+    parser.add_option('--shards', type='int', default=4,
+                      help='Sending threads [default: %default]')
+    parser.add_option('--max-hits', type='int', default=100,
+                      help='Hits per bulk request [default: %default]')
+    parser.add_option('--compress-level', type='int',
+                      help='gzip level of the bulk requests')
+    parser.add_option('--report-interval', type='float', default=10,
+                      help='Seconds between progress reports '
+                           '[default: %default]')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('Please pass one log file')
+    for name in ('url', 'id_site', 'token_auth', 'hostname'):
+        if getattr(options, name) is None:
+            parser.error('--%s is required' % name.replace('_', '-'))
+    try:
+        importer = LogImporter(
+            options.url, options.id_site, options.token_auth,
+            options.hostname, options.format, options.https,
+            options.exclude_path, options.processes, options.shards,
+            options.max_hits, compress_level=options.compress_level,
+            report_interval=options.report_interval)
+    except ConfigurationError as e:
+        parser.error(str(e))
+    stream = open(args[0], 'rb')
+    try:
+        stream.seek(options.offset)
+        stats = importer.run(stream, options.offset)
+    finally:
+        stream.close()
+    return stats['failed'] and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import bisect
+import socket
+import threading
+
+
+class Metrics(object):
+    """
+    A metrics sink that ignores everything
+
+    Trackers, analytics objects, dispatchers and bulk trackers report into
+    a sink set with their ``set_metrics()`` method or ``metrics`` argument.
+    Subclass this to report to your own monitoring, the methods must be
+    thread-safe. The reported metrics are:
+
+    - ``tracking.hits.<kind>`` and ``tracking.dropped.<kind>``: hits per
+      event kind, e.g. ``page_view`` or ``order``, and the ones the sampler
+      or deduplicator dropped
+    - ``tracking.bytes_encoded``: query string bytes built by trackers
+    - ``tracking.bytes_sent``, ``tracking.latency`` and
+      ``tracking.errors.<class>``: requests sent by trackers themselves
+    - ``dispatch.queue_depth``, ``dispatch.sent``, ``dispatch.failed``,
+      ``dispatch.dropped``, ``dispatch.latency`` and
+      ``dispatch.errors.<class>``: PiwikDispatcher
+    - ``bulk.pending``, ``bulk.requests``, ``bulk.hits``,
+      ``bulk.bytes_sent``, ``bulk.latency`` and ``bulk.errors.<class>``:
+      PiwikBulkTracker
+    - ``analytics.requests``, ``analytics.bytes_received``,
+      ``analytics.latency`` and ``analytics.errors.<class>``: analytics API
+      requests
+    """
+    def increment(self, name, value=1):
+        """
+        Add to a counter
+
+        :param name: Metric name
+        :type name: str
+        :param value: Value to add
+        :type value: int
+        :rtype: None
+        """
+        pass
+
+    def gauge(self, name, value):
+        """
+        Set a gauge
+
+        :param name: Metric name
+        :type name: str
+        :param value: Current value
+        :type value: int or float
+        :rtype: None
+        """
+        pass
+
+    def timing(self, name, seconds):
+        """
+        Record a duration
+
+        :param name: Metric name
+        :type name: str
+        :param seconds: Duration in seconds
+        :type seconds: float
+        :rtype: None
+        """
+        pass
+
+
+class InMemoryMetrics(Metrics):
+    """
+    Keeps counters, gauges and latency histograms in memory
+
+    Durations are counted in fixed buckets, each bucket counts the
+    durations up to its bound that didn't fit in a smaller one. The last
+    bucket, with the bound None, counts the longer ones::
+
+        metrics = InMemoryMetrics()
+        pt.set_metrics(metrics)
+        pt.do_track_page_view('Some page title')
+        metrics.get_histogram('tracking.latency')
+    """
+    #: Upper bounds of the histogram buckets in seconds
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+               2.5, 5, 10)
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: Upper bounds of the histogram buckets in seconds
+        :type buckets: tuple of float
+        :rtype: None
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.__counters = {}
+        self.__gauges = {}
+        self.__histograms = {}
+        self.__lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self.__lock:
+            self.__gauges[name] = value
+
+    def timing(self, name, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if histogram is None:
+                histogram = self.__histograms[name] = \
+                    [[0] * (len(self.buckets) + 1), 0, 0.0]
+            histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    def get_counter(self, name):
+        """
+        :param name: Metric name
+        :type name: str
+        :rtype: int
+        """
+        return self.__counters.get(name, 0)
+
+    def get_gauge(self, name):
+        """
+        :param name: Metric name
+        :type name: str
+        :rtype: int, float or None
+        """
+        return self.__gauges.get(name)
+
+    def get_histogram(self, name):
+        """
+        Returns a histogram, None if nothing was recorded
+
+        :param name: Metric name
+        :type name: str
+        :rtype: dict with the ``buckets`` as list of (bound, count) tuples,
+            the ``count`` and the ``sum`` of the durations
+        """
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if histogram is None:
+                return None
+            counts, count, total = histogram
+            return {
+                'buckets': list(zip(self.buckets + (None,), counts)),
+                'count': count,
+                'sum': total,
+            }
+
+    def snapshot(self):
+        """
+        Returns all metrics
+
+        :rtype: dict with the ``counters``, ``gauges`` and ``histograms``
+        """
+        with self.__lock:
+            names = list(self.__histograms)
+            snapshot = {
+                'counters': dict(self.__counters),
+                'gauges': dict(self.__gauges),
+            }
+        snapshot['histograms'] = dict((name, self.get_histogram(name))
+                                      for name in names)
+        return snapshot
+
+    def reset(self):
+        """
+        Forget all metrics
+
+        :rtype: None
+        """
+        with self.__lock:
+            self.__counters.clear()
+            self.__gauges.clear()
+            self.__histograms.clear()
+
+
+class StatsdMetrics(Metrics):
+    """
+    Sends the metrics as statsd lines over UDP or a Unix datagram socket
+
+    Counters are sent as ``name:value|c``, gauges as ``name:value|g`` and
+    durations as ``name:milliseconds|ms``, every name is prefixed with
+    ``prefix``. Lines that can't be sent are dropped::
+
+        metrics = StatsdMetrics(('127.0.0.1', 8125), prefix='shop.piwik.')
+        metrics = StatsdMetrics('/var/run/statsd.sock')
+    """
+    def __init__(self, address=('127.0.0.1', 8125), prefix='piwikapi.'):
+        """
+        :param address: Host and port, or the path of a Unix socket
+        :type address: tuple of (str, int) or str
+        :param prefix: Prefix of the metric names
+        :type prefix: str
+        :rtype: None
+        """
+        if isinstance(address, tuple):
+            family = socket.AF_INET
+        else:
+            family = socket.AF_UNIX
+        self.address = address
+        self.prefix = prefix
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def _send(self, line):
+        """
+        :param line: statsd line without the prefix
+        :type line: str
+        :rtype: None
+        """
+        try:
+            self.socket.sendto((self.prefix + line).encode('utf-8'),
+                               self.address)
+        except (socket.error, OSError):
+            pass
+
+    def increment(self, name, value=1):
+        self._send('%s:%d|c' % (name, value))
+
+    def gauge(self, name, value):
+        self._send('%s:%s|g' % (name, value))
+
+    def timing(self, name, seconds):
+        self._send('%s:%.3f|ms' % (name, seconds * 1000))
+
+    def close(self):
+        """
+        Close the socket
+
+        :rtype: None
+        """
+        self.socket.close()
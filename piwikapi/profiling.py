@@ -0,0 +1,284 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import atexit
+import cProfile
+import pstats
+import sys
+import threading
+import time
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+try:
+    now_ns = time.perf_counter_ns
+except AttributeError:
+    def now_ns():
+        """
+        Returns the time in nanoseconds, for Pythons without
+        time.perf_counter_ns()
+
+        :rtype: int
+        """
+        return int(time.time() * 1000000000)
+
+
+class PhaseTimer(object):
+    """
+    Times the phases of one tracking call, see PhaseProfiler.start()
+    """
+    __slots__ = ('profiler', 'started', 'last', 'phases', 'cprofile')
+
+    def __init__(self, profiler, cprofile=None):
+        """
+        :param profiler: Where the phases are recorded
+        :type profiler: PhaseProfiler
+        :param cprofile: Profiler running for this call
+        :type cprofile: cProfile.Profile or None
+        :rtype: None
+        """
+        self.profiler = profiler
+        self.started = self.last = now_ns()
+        self.phases = {}
+        self.cprofile = cprofile
+
+    def mark(self, phase):
+        """
+        Add the time since the last mark to a phase
+
+        :param phase: Phase name
+        :type phase: str
+        :rtype: None
+        """
+        now = now_ns()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.last
+        self.last = now
+
+    def cancel(self):
+        """
+        Stop timing a call that failed, nothing is recorded
+
+        :rtype: None
+        """
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile = None
+
+    def finish(self):
+        """
+        Record the phases and the total time of the call
+
+        :rtype: None
+        """
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.profiler._add_cprofile(self.cprofile)
+        record = self.profiler.record
+        for phase, duration in self.phases.items():
+            record(phase, duration)
+        record('total', self.last - self.started)
+
+
+class PhaseProfiler(object):
+    """
+    Records how long the phases of the tracking calls take
+
+    The durations of each phase go into a ring buffer holding the last
+    ``size`` of them, report() shows their percentiles. The phases are:
+
+    - ``tracker``: creating a tracker from a PiwikTrackerTemplate
+    - ``filter``: sampling and duplicate checks
+    - ``encode``: building the query string, except for:
+    - ``json``: JSON encoding of custom variables and ecommerce items
+    - ``capture``: copying the state of a capture_*() call
+    - ``enqueue``: adding the hit to a dispatcher or bulk tracker
+    - ``request``: sending the hit, an HTTPConnectionPool with the same
+      profiler splits this into ``connect`` (including DNS), ``send`` and
+      ``read``
+    - ``total``: the whole do_track_*() or capture_*() call
+
+    With ``profile_every`` one in that many calls runs under cProfile, the
+    report adds the functions they spent the most time in::
+
+        profiler = PhaseProfiler(profile_every=100, report_at_exit=True)
+        pt.set_profiler(profiler)
+        pool = HTTPConnectionPool(profiler=profiler)
+
+    A profiler can be shared between threads and trackers.
+    """
+    #: Percentiles shown by report()
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, size=10000, profile_every=None, report_at_exit=False,
+                 stream=None):
+        """
+        :param size: Number of durations kept per phase
+        :type size: int
+        :param profile_every: Run one in this many calls under cProfile,
+            None to never
+        :type profile_every: int or None
+        :param report_at_exit: Write the report to ``stream`` at exit
+        :type report_at_exit: bool
+        :param stream: Where dump() writes, defaults to sys.stderr
+        :type stream: file-like object or None
+        :rtype: None
+        """
+        self.size = size
+        self.profile_every = profile_every
+        self.stream = stream
+        self.__buffers = {}
+        self.__calls = 0
+        self.__stats = None
+        self.__lock = threading.Lock()
+        if report_at_exit:
+            atexit.register(self.dump)
+
+    def start(self):
+        """
+        Returns a timer for a new tracking call
+
+        :rtype: PhaseTimer
+        """
+        cprofile = None
+        if self.profile_every:
+            with self.__lock:
+                self.__calls += 1
+                sampled = self.__calls % self.profile_every == 0
+            if sampled:
+                cprofile = cProfile.Profile()
+                try:
+                    cprofile.enable()
+                except ValueError:
+                    # Another profiler is already running
+                    cprofile = None
+        return PhaseTimer(self, cprofile)
+
+    def record(self, phase, duration):
+        """
+        Record the duration of a phase
+
+        :param phase: Phase name
+        :type phase: str
+        :param duration: Duration in nanoseconds
+        :type duration: int
+        :rtype: None
+        """
+        with self.__lock:
+            buffer = self.__buffers.get(phase)
+            if buffer is None:
+                buffer = self.__buffers[phase] = [[0] * self.size, 0]
+            samples, count = buffer
+            samples[count % self.size] = duration
+            buffer[1] = count + 1
+
+    def _add_cprofile(self, cprofile):
+        """
+        Add the statistics of a cProfile run
+
+        :param cprofile: Finished profiler
+        :type cprofile: cProfile.Profile
+        :rtype: None
+        """
+        with self.__lock:
+            if self.__stats is None:
+                self.__stats = pstats.Stats(cprofile)
+            else:
+                self.__stats.add(cprofile)
+
+    def get_samples(self, phase):
+        """
+        Returns the kept durations of a phase in nanoseconds
+
+        :param phase: Phase name
+        :type phase: str
+        :rtype: list of int
+        """
+        with self.__lock:
+            buffer = self.__buffers.get(phase)
+            if buffer is None:
+                return []
+            samples, count = buffer
+            return samples[:min(count, self.size)]
+
+    def get_percentiles(self, phase, percentiles=PERCENTILES):
+        """
+        Returns percentiles of the durations of a phase in nanoseconds
+
+        :param phase: Phase name
+        :type phase: str
+        :param percentiles: Percentiles from 0 to 100
+        :type percentiles: tuple of int
+        :rtype: dict of {percentile: int}, empty if nothing was recorded
+        """
+        samples = sorted(self.get_samples(phase))
+        if not samples:
+            return {}
+        last = len(samples) - 1
+        return dict((percentile,
+                     samples[int(round(last * percentile / 100.0))])
+                    for percentile in percentiles)
+
+    def get_phases(self):
+        """
+        Returns the names of the recorded phases
+
+        :rtype: list of str
+        """
+        with self.__lock:
+            return sorted(self.__buffers)
+
+    def report(self, functions=20):
+        """
+        Returns the percentiles of every phase in microseconds and, if
+        calls were profiled, the functions with the most time
+
+        :param functions: Number of functions to show
+        :type functions: int
+        :rtype: str
+        """
+        percentiles = self.PERCENTILES
+        lines = ['%-10s %8s %s' % ('phase', 'calls', ' '.join(
+            '%10s' % ('p%d us' % percentile) for percentile in percentiles))]
+        for phase in self.get_phases():
+            with self.__lock:
+                calls = self.__buffers[phase][1]
+            values = self.get_percentiles(phase, percentiles)
+            lines.append('%-10s %8d %s' % (phase, calls, ' '.join(
+                '%10.1f' % (values[percentile] / 1000.0)
+                for percentile in percentiles)))
+        report = '\n'.join(lines) + '\n'
+        with self.__lock:
+            if self.__stats is not None:
+                stream = StringIO()
+                self.__stats.stream = stream
+                self.__stats.sort_stats('cumulative').print_stats(functions)
+                report += stream.getvalue()
+        return report
+
+    def dump(self):
+        """
+        Write the report to the stream
+
+        :rtype: None
+        """
+        (self.stream or sys.stderr).write(self.report())
+
+    def reset(self):
+        """
+        Forget all durations and cProfile statistics
+
+        :rtype: None
+        """
+        with self.__lock:
+            self.__buffers.clear()
+            self.__calls = 0
+            self.__stats = None
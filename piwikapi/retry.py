@@ -0,0 +1,440 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import random
+import socket
+import threading
+import time
+try:
+    from http.client import HTTPException
+    from urllib.error import HTTPError
+except ImportError:
+    from httplib import HTTPException
+    from urllib2 import HTTPError
+
+from .exceptions import CircuitOpenError
+from .exceptions import ConfigurationError
+from .transport import HTTPConnectionPool
+from .transport import get_endpoint
+
+
+class RetryBudget(object):
+    """
+    Limits retries to a share of the requests
+
+    Within the last ``window`` seconds at most ``ratio`` retries per request
+    plus ``min_per_second`` retries per second are allowed. This keeps
+    retries from multiplying the load on a Piwik server that is already
+    struggling.
+    """
+    def __init__(self, ratio=0.2, min_per_second=1, window=10):
+        """
+        :param ratio: Retries allowed per request
+        :type ratio: float
+        :param min_per_second: Retries per second that are always allowed
+        :type min_per_second: float
+        :param window: Window in seconds
+        :type window: int
+        :rtype: None
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self.__buckets = {}
+        self.__lock = threading.Lock()
+
+    def __get_bucket(self):
+        """
+        Returns the counters for the current second, the lock must be held
+
+        :rtype: list of [requests, retries]
+        """
+        now = int(time.time())
+        bucket = self.__buckets.get(now)
+        if bucket is None:
+            for second in list(self.__buckets):
+                if second <= now - self.window:
+                    del self.__buckets[second]
+            bucket = self.__buckets[now] = [0, 0]
+        return bucket
+
+    def record_request(self):
+        """
+        :rtype: None
+        """
+        with self.__lock:
+            self.__get_bucket()[0] += 1
+
+    def withdraw(self):
+        """
+        Take a retry from the budget, returns False if there is none left
+
+        :rtype: bool
+        """
+        with self.__lock:
+            bucket = self.__get_bucket()
+            requests = sum(b[0] for b in self.__buckets.values())
+            retries = sum(b[1] for b in self.__buckets.values())
+            allowed = self.min_per_second * self.window + \
+                self.ratio * requests
+            if retries >= allowed:
+                return False
+            bucket[1] += 1
+            return True
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests are retried and how long to wait
+
+    Requests that failed with one of ``retry_exceptions`` or an HTTP error
+    with one of ``retry_statuses`` are retried up to ``max_retries`` times,
+    as long as the retry budget allows it. The wait before retry n is
+    ``backoff_factor * 2 ** n`` seconds, at most ``max_backoff``, with full
+    jitter.
+
+    Only requests with one of ``retry_methods`` are retried. A POST, e.g. a
+    bulk tracking request, may have been stored by Piwik before the error,
+    a retry would then track all of its hits twice.
+    """
+    #: Status codes that are retried by default
+    RETRY_STATUSES = (429, 502, 503, 504)
+
+    #: Methods that are retried by default, the idempotent ones
+    RETRY_METHODS = ('GET', 'HEAD')
+
+    #: Exceptions that are retried by default, connection errors and
+    #: timeouts
+    RETRY_EXCEPTIONS = (socket.error, HTTPException)
+
+    def __init__(self, max_retries=3, backoff_factor=0.1, max_backoff=10,
+                 jitter=True, retry_statuses=None, retry_exceptions=None,
+                 budget=None, retry_methods=None):
+        """
+        :param max_retries: Maximum number of retries per request
+        :type max_retries: int
+        :param backoff_factor: Base wait in seconds
+        :type backoff_factor: float
+        :param max_backoff: Maximum wait in seconds
+        :type max_backoff: float
+        :param jitter: Wait a random time up to the backoff
+        :type jitter: bool
+        :param retry_statuses: HTTP status codes to retry, defaults to
+            RETRY_STATUSES
+        :type retry_statuses: tuple of int
+        :param retry_exceptions: Exception classes to retry, defaults to
+            RETRY_EXCEPTIONS
+        :type retry_exceptions: tuple of classes
+        :param budget: Retry budget, None for a new RetryBudget
+        :type budget: RetryBudget or None
+        :param retry_methods: HTTP methods to retry, defaults to
+            RETRY_METHODS
+        :type retry_methods: tuple of str
+        :rtype: None
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        if retry_statuses is None:
+            retry_statuses = self.RETRY_STATUSES
+        self.retry_statuses = retry_statuses
+        if retry_exceptions is None:
+            retry_exceptions = self.RETRY_EXCEPTIONS
+        self.retry_exceptions = retry_exceptions
+        if budget is None:
+            budget = RetryBudget()
+        self.budget = budget
+        if retry_methods is None:
+            retry_methods = self.RETRY_METHODS
+        self.retry_methods = tuple(method.upper() for method in retry_methods)
+
+    def is_failure(self, exception):
+        """
+        Returns True if the exception means the server is unhealthy. Client
+        errors like 404 don't count.
+
+        :param exception: Exception raised by the transport
+        :type exception: Exception
+        :rtype: bool
+        """
+        if isinstance(exception, HTTPError):
+            return exception.code >= 500 or \
+                exception.code in self.retry_statuses
+        return isinstance(exception, self.retry_exceptions)
+
+    def is_retryable(self, exception, method='GET'):
+        """
+        :param exception: Exception raised by the transport
+        :type exception: Exception
+        :param method: HTTP method of the failed request
+        :type method: str
+        :rtype: bool
+        """
+        if method.upper() not in self.retry_methods:
+            return False
+        if isinstance(exception, HTTPError):
+            return exception.code in self.retry_statuses
+        return isinstance(exception, self.retry_exceptions)
+
+    def get_backoff(self, retry):
+        """
+        Returns the seconds to wait before a retry
+
+        :param retry: Number of the retry, starting at 0
+        :type retry: int
+        :rtype: float
+        """
+        backoff = min(self.max_backoff, self.backoff_factor * 2 ** retry)
+        if self.jitter:
+            backoff = random.uniform(0, backoff)
+        return backoff
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to a server that keeps failing
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    requests fail right away with a CircuitOpenError. After
+    ``recovery_timeout`` seconds it lets ``half_open_max_calls`` probe
+    requests through. If a probe succeeds the breaker closes again, if it
+    fails the breaker opens for another ``recovery_timeout`` seconds.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name='', failure_threshold=5, recovery_timeout=30,
+                 half_open_max_calls=1):
+        """
+        :param name: Name for introspection, usually the endpoint
+        :type name: str
+        :param failure_threshold: Consecutive failures that open the breaker
+        :type failure_threshold: int
+        :param recovery_timeout: Seconds before a probe request is allowed
+        :type recovery_timeout: float
+        :param half_open_max_calls: Number of concurrent probe requests
+        :type half_open_max_calls: int
+        :rtype: None
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.opened_at = None
+        self.__probes = 0
+        self.__lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Call this before sending a request
+
+        :raises: CircuitOpenError if the request must not be sent
+        :rtype: None
+        """
+        with self.__lock:
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.recovery_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError("Circuit for %s is open" %
+                                           self.name)
+                self.state = self.HALF_OPEN
+                self.__probes = 0
+            if self.state == self.HALF_OPEN:
+                if self.__probes >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError("Circuit for %s is half open" %
+                                           self.name)
+                self.__probes += 1
+
+    def record_success(self):
+        """
+        :rtype: None
+        """
+        with self.__lock:
+            self.failures = 0
+            self.state = self.CLOSED
+            self.opened_at = None
+
+    def record_failure(self):
+        """
+        :rtype: None
+        """
+        with self.__lock:
+            self.failures += 1
+            self.total_failures += 1
+            if self.state == self.HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def get_state(self):
+        """
+        Returns the current state, an open breaker whose recovery timeout
+        expired is reported as half open
+
+        :rtype: str
+        """
+        with self.__lock:
+            if self.state == self.OPEN and \
+                    time.time() - self.opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self.state
+
+    def stats(self):
+        """
+        Returns the breaker state for introspection
+
+        :rtype: dict
+        """
+        return {
+            'name': self.name,
+            'state': self.get_state(),
+            'failures': self.failures,
+            'total_failures': self.total_failures,
+            'rejected': self.rejected,
+            'opened_at': self.opened_at,
+        }
+
+
+class CircuitBreakerRegistry(object):
+    """
+    One CircuitBreaker per scheme, host and port
+    """
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: Arguments for new CircuitBreaker instances
+        :rtype: None
+        """
+        if 'name' in kwargs:
+            raise ConfigurationError('The breaker name is the endpoint')
+        self.kwargs = kwargs
+        self.__breakers = {}
+        self.__lock = threading.Lock()
+
+    def get(self, url):
+        """
+        Returns the breaker for an URL
+
+        :param url: URL
+        :type url: str
+        :rtype: CircuitBreaker
+        """
+        endpoint = get_endpoint(url)
+        breaker = self.__breakers.get(endpoint)
+        if breaker is None:
+            with self.__lock:
+                breaker = self.__breakers.get(endpoint)
+                if breaker is None:
+                    name = '%s://%s:%d' % endpoint
+                    breaker = CircuitBreaker(name, **self.kwargs)
+                    self.__breakers[endpoint] = breaker
+        return breaker
+
+    def stats(self):
+        """
+        Returns the state of all breakers
+
+        :rtype: dict of {endpoint name: CircuitBreaker.stats()}
+        """
+        with self.__lock:
+            breakers = list(self.__breakers.values())
+        return dict((breaker.name, breaker.stats()) for breaker in breakers)
+
+
+_default_registry = CircuitBreakerRegistry()
+
+
+def get_circuit_breakers():
+    """
+    Returns the breakers shared by all ResilientTransport instances that
+    don't have their own registry
+
+    :rtype: CircuitBreakerRegistry
+    """
+    return _default_registry
+
+
+class ResilientTransport(object):
+    """
+    Wraps a transport with a RetryPolicy and per endpoint circuit breakers
+
+    Use it for all trackers and analytics objects::
+
+        from piwikapi.retry import ResilientTransport
+        from piwikapi.transport import set_default_pool
+
+        set_default_pool(ResilientTransport())
+    """
+    def __init__(self, transport=None, retry_policy=None, breakers=None):
+        """
+        :param transport: The wrapped transport, None for a new
+            HTTPConnectionPool
+        :type transport: piwikapi.transport.HTTPConnectionPool or None
+        :param retry_policy: Retry policy, None for a new RetryPolicy
+        :type retry_policy: RetryPolicy or None
+        :param breakers: Circuit breakers, None for the shared registry
+        :type breakers: CircuitBreakerRegistry or None
+        :rtype: None
+        """
+        if transport is None:
+            # Not get_default_pool(), this usually becomes the default pool
+            transport = HTTPConnectionPool()
+        self.transport = transport
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        if breakers is None:
+            breakers = get_circuit_breakers()
+        self.breakers = breakers
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Make a request, see HTTPConnectionPool.request()
+
+        :raises: CircuitOpenError if the endpoint's breaker is open, the
+            last error if all retries failed
+        :rtype: piwikapi.transport.Response
+        """
+        breaker = self.breakers.get(url)
+        policy = self.retry_policy
+        policy.budget.record_request()
+        retry = 0
+        while True:
+            breaker.before_request()
+            try:
+                response = self.transport.request(method, url, body, headers)
+            except Exception as e:
+                if policy.is_failure(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if retry >= policy.max_retries or \
+                        not policy.is_retryable(e, method) or \
+                        not policy.budget.withdraw():
+                    raise
+                time.sleep(policy.get_backoff(retry))
+                retry += 1
+                continue
+            breaker.record_success()
+            return response
+
+    def close(self):
+        """
+        Close the wrapped transport
+
+        :rtype: None
+        """
+        if hasattr(self.transport, 'close'):
+            self.transport.close()
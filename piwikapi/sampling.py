@@ -0,0 +1,142 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import threading
+import zlib
+
+from .exceptions import ConfigurationError
+from .tracking import TrackingEvent
+
+
+class VisitorSampler(object):
+    """
+    Keeps or drops whole visits, decided by the visitor ID
+
+    The first 8 hex characters of the visitor ID are read as a number below
+    2**32, the hits of a visitor are kept if it is below ``rate`` * 2**32.
+    Visitor IDs that aren't hex are hashed with CRC32 instead. The same
+    visitor ID always gets the same decision, in every process, so all hits
+    of a sampled visit are kept.
+
+    Goals and ecommerce orders are always kept. The sampler counts the kept
+    and dropped hits per site, multiply your Piwik numbers by
+    ``get_scale()`` to estimate the real ones.
+
+    A sampler can be shared between threads and trackers::
+
+        sampler = VisitorSampler(0.1, site_rates={2: 0.5})
+        pt.set_sampler(sampler)
+    """
+    #: Event kinds that are never dropped
+    ALWAYS_KEEP = (TrackingEvent.GOAL, TrackingEvent.ORDER)
+
+    #: Visitor ID values are below this
+    SCALE = 2 ** 32
+
+    def __init__(self, rate=1.0, site_rates=None, always_keep=ALWAYS_KEEP):
+        """
+        :param rate: Share of the visitors that are kept, from 0 to 1
+        :type rate: float
+        :param site_rates: Rates for single sites
+        :type site_rates: dict of {id_site: rate} or None
+        :param always_keep: Event kinds that are never dropped
+        :type always_keep: tuple of str
+        :rtype: None
+        """
+        self.rate = rate
+        self.site_rates = dict(site_rates or {})
+        self.always_keep = frozenset(always_keep)
+        self.__threshold = self.__get_threshold(rate)
+        self.__site_thresholds = dict(
+            (id_site, self.__get_threshold(site_rate))
+            for id_site, site_rate in self.site_rates.items())
+        self.__counters = {}
+        self.__lock = threading.Lock()
+
+    def __get_threshold(self, rate):
+        """
+        :param rate: Share of the visitors that are kept
+        :type rate: float
+        :raises: ConfigurationError if the rate isn't between 0 and 1
+        :rtype: int
+        """
+        if not 0 <= rate <= 1:
+            raise ConfigurationError('Sampling rate must be from 0 to 1, '
+                                     'not %r' % rate)
+        return int(rate * self.SCALE)
+
+    def get_rate(self, id_site):
+        """
+        :param id_site: Site ID
+        :type id_site: int
+        :rtype: float
+        """
+        return self.site_rates.get(id_site, self.rate)
+
+    def get_value(self, visitor_id):
+        """
+        Returns the number a visitor ID is sampled by
+
+        :param visitor_id: Visitor ID
+        :type visitor_id: str
+        :rtype: int
+        """
+        try:
+            return int(visitor_id[:8], 16)
+        except ValueError:
+            return zlib.crc32(visitor_id.encode('utf-8')) & 0xffffffff
+
+    def keep(self, id_site, visitor_id, kind=TrackingEvent.PAGE_VIEW):
+        """
+        Decide whether a hit is tracked and count it
+
+        :param id_site: Site ID
+        :type id_site: int
+        :param visitor_id: Visitor ID
+        :type visitor_id: str
+        :param kind: Event kind, see TrackingEvent
+        :type kind: str
+        :rtype: bool
+        """
+        if kind in self.always_keep:
+            keep = True
+        else:
+            threshold = self.__site_thresholds.get(id_site, self.__threshold)
+            keep = self.get_value(visitor_id) < threshold
+        with self.__lock:
+            counters = self.__counters.get(id_site)
+            if counters is None:
+                counters = self.__counters[id_site] = [0, 0]
+            counters[not keep] += 1
+        return keep
+
+    def get_scale(self, id_site):
+        """
+        Returns the factor from tracked to real hits of a site
+
+        :param id_site: Site ID
+        :type id_site: int
+        :rtype: float
+        """
+        with self.__lock:
+            kept, sampled_out = self.__counters.get(id_site, (0, 0))
+        if not kept:
+            return 1.0
+        return float(kept + sampled_out) / kept
+
+    def stats(self):
+        """
+        Returns the kept and sampled out hits per site
+
+        :rtype: dict of {id_site: {'kept': int, 'sampled_out': int}}
+        """
+        with self.__lock:
+            return dict((id_site, {'kept': kept, 'sampled_out': sampled_out})
+                        for id_site, (kept, sampled_out)
+                        in self.__counters.items())
@@ -0,0 +1,390 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+
+from .bulk import PiwikBulkTracker
+from .exceptions import ConfigurationError
+from .exceptions import TrackingError
+
+
+class PiwikSpool(object):
+    """
+    An append-only on-disk queue for tracking requests
+
+    Hits are appended to segment files in a directory, one query string per
+    line. A new segment is started once the current one is larger than
+    ``segment_size`` bytes. Writes are fsynced every ``fsync_every`` hits
+    or ``fsync_interval`` seconds, whatever comes first.
+
+    The position up to which hits were sent to Piwik is stored in an
+    ``ack`` file, so hits that were already sent are not sent again after
+    a crash. Segments that were sent completely are deleted. If the spool
+    holds more than ``max_size`` bytes new hits are dropped and counted in
+    ``dropped``.
+
+    The spool can be set as a tracker's dispatcher, see
+    PiwikTracker.set_dispatcher(), and is sent to Piwik by a
+    PiwikSpoolReplayer.
+    """
+    SEGMENT_PATTERN = re.compile(r'^segment-(\d{12})\.log$')
+
+    def __init__(self, directory, segment_size=4 * 1024 * 1024,
+                 max_size=64 * 1024 * 1024, fsync_every=100,
+                 fsync_interval=1.0):
+        """
+        :param directory: Spool directory, created if it doesn't exist
+        :type directory: str
+        :param segment_size: Start a new segment after this many bytes
+        :type segment_size: int
+        :param max_size: Drop new hits when the spool is this large
+        :type max_size: int
+        :param fsync_every: Fsync after this many hits
+        :type fsync_every: int
+        :param fsync_interval: Fsync when the last fsync was this many
+            seconds ago
+        :type fsync_interval: float
+        :rtype: None
+        """
+        if segment_size < 1 or max_size < segment_size:
+            raise ConfigurationError('max_size must be at least segment_size')
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.dropped = 0
+        self.size = 0
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__unsynced = 0
+        self.__last_sync = time.time()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        segments = self._get_segments()
+        for segment in segments:
+            self.size += os.path.getsize(self._get_path(segment))
+        self.__acked = self._read_ack(segments)
+        if segments and self._ends_with_newline(segments[-1]):
+            self.__segment = segments[-1]
+        elif segments:
+            # The last write was interrupted, don't append to a broken line
+            self.__segment = segments[-1] + 1
+        else:
+            self.__segment = self.__acked[0]
+        self.__open_segment()
+
+    def _get_path(self, segment):
+        """
+        :param segment: Segment number
+        :type segment: int
+        :rtype: str
+        """
+        return os.path.join(self.directory, 'segment-%012d.log' % segment)
+
+    def _get_segments(self):
+        """
+        Returns the sorted segment numbers in the spool directory
+
+        :rtype: list of int
+        """
+        segments = []
+        for name in os.listdir(self.directory):
+            match = self.SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append(int(match.group(1)))
+        return sorted(segments)
+
+    def _ends_with_newline(self, segment):
+        """
+        :param segment: Segment number
+        :type segment: int
+        :rtype: bool
+        """
+        with open(self._get_path(segment), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if not f.tell():
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _read_ack(self, segments):
+        """
+        Returns the acked position
+
+        :rtype: tuple of (segment, offset)
+        """
+        try:
+            with open(os.path.join(self.directory, 'ack'), 'r') as f:
+                segment, offset = f.read().split()
+            return int(segment), int(offset)
+        except (IOError, OSError, ValueError):
+            if segments:
+                return segments[0], 0
+            return 0, 0
+
+    def __open_segment(self):
+        self.__file = open(self._get_path(self.__segment), 'ab')
+
+    def __sync(self):
+        """
+        Fsync the current segment, the lock must be held
+        """
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__unsynced = 0
+        self.__last_sync = time.time()
+
+    def add(self, query_string):
+        """
+        Append a hit, returns False if it was dropped
+
+        :param query_string: Query string as built by
+            PiwikTracker._get_dispatch_query_string()
+        :type query_string: str
+        :rtype: bool
+        """
+        line = query_string.encode('utf-8') + b'\n'
+        with self.__lock:
+            if self.size + len(line) > self.max_size:
+                self.dropped += 1
+                return False
+            if self.__file.tell() + len(line) > self.segment_size and \
+                    self.__file.tell():
+                self.__sync()
+                self.__file.close()
+                self.__segment += 1
+                self.__open_segment()
+            self.__file.write(line)
+            self.__file.flush()
+            self.size += len(line)
+            self.__unsynced += 1
+            if self.__unsynced >= self.fsync_every or \
+                    time.time() - self.__last_sync >= self.fsync_interval:
+                self.__sync()
+        return True
+
+    def sync(self):
+        """
+        Fsync all appended hits
+
+        :rtype: None
+        """
+        with self.__lock:
+            if self.__unsynced:
+                self.__sync()
+
+    def read(self, max_hits):
+        """
+        Returns up to max_hits hits after the acked position, each with the
+        position to ack once it was sent
+
+        :param max_hits: Maximum number of hits
+        :type max_hits: int
+        :rtype: list of (query_string, (segment, offset)) tuples
+        """
+        hits = []
+        with self.__lock:
+            segment, offset = self.__acked
+            while len(hits) < max_hits and segment <= self.__segment:
+                path = self._get_path(segment)
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        f.seek(offset)
+                        for line in f:
+                            if not line.endswith(b'\n'):
+                                break
+                            offset += len(line)
+                            hits.append((line[:-1].decode('utf-8'),
+                                         (segment, offset)))
+                            if len(hits) >= max_hits:
+                                break
+                if len(hits) >= max_hits:
+                    break
+                segment += 1
+                offset = 0
+        return hits
+
+    def ack(self, position):
+        """
+        Mark all hits up to position as sent and delete the segments that
+        were sent completely
+
+        :param position: Position as returned by read()
+        :type position: tuple of (segment, offset)
+        :rtype: None
+        """
+        segment, offset = position
+        with self.__lock:
+            if segment != self.__segment and \
+                    offset >= os.path.getsize(self._get_path(segment)):
+                segment, offset = segment + 1, 0
+            path = os.path.join(self.directory, 'ack')
+            with open(path + '.tmp', 'w') as f:
+                f.write('%d %d\n' % (segment, offset))
+                f.flush()
+                os.fsync(f.fileno())
+            if hasattr(os, 'replace'):
+                os.replace(path + '.tmp', path)
+            else:
+                os.rename(path + '.tmp', path)
+            self.__acked = segment, offset
+            for old in self._get_segments():
+                if old >= segment:
+                    break
+                old_path = self._get_path(old)
+                self.size -= os.path.getsize(old_path)
+                os.remove(old_path)
+
+    def pending(self):
+        """
+        Returns True if there are hits that weren't acked yet
+
+        :rtype: bool
+        """
+        return bool(self.read(1))
+
+    def close(self):
+        """
+        Fsync and close the current segment
+
+        :rtype: None
+        """
+        with self.__lock:
+            if not self.__file.closed:
+                self.__sync()
+                self.__file.close()
+
+
+class PiwikSpoolReplayer(object):
+    """
+    Sends the hits of a PiwikSpool to Piwik in bulk tracking requests
+
+    Hits are only acked once Piwik answered the bulk request. If Piwik
+    can't be reached the batch is retried after ``retry_interval``
+    seconds. Hits Piwik rejected are acked as well, they would be rejected
+    again.
+
+    The hits carry the time they were spooled, Piwik requires the auth
+    token for hits that are older than a few hours.
+    """
+    def __init__(self, spool, api_url, token_auth=False, batch_size=100,
+                 interval=1.0, retry_interval=10.0, transport=None,
+                 compress_level=None, compress_threshold=1024):
+        """
+        :param spool: The spool to send
+        :type spool: PiwikSpool
+        :param api_url: Piwik tracking API URL, the URL of piwik.php
+        :type api_url: str
+        :param token_auth: Auth token
+        :type token_auth: str
+        :param batch_size: Maximum number of hits per bulk request
+        :type batch_size: int
+        :param interval: Seconds to wait when the spool is empty
+        :type interval: float
+        :param retry_interval: Seconds to wait after a failed request
+        :type retry_interval: float
+        :param transport: Transport, None for the shared connection pool
+        :type transport: piwikapi.transport.HTTPConnectionPool or None
+        :param compress_level: gzip compression level, see PiwikBulkTracker
+        :type compress_level: int or None
+        :param compress_threshold: Don't compress smaller bodies
+        :type compress_threshold: int
+        :rtype: None
+        """
+        self.spool = spool
+        self.bulk_tracker = PiwikBulkTracker(
+            api_url, token_auth, max_hits=batch_size + 1, max_age=None,
+            transport=transport, compress_level=compress_level,
+            compress_threshold=compress_threshold)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.sent = 0
+        self.rejected = 0
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def replay_once(self):
+        """
+        Send one batch, returns the number of acked hits
+
+        :raises: the transport's exception if Piwik couldn't be reached
+        :rtype: int
+        """
+        self.spool.sync()
+        hits = self.spool.read(self.batch_size)
+        if not hits:
+            return 0
+        for query_string, position in hits:
+            self.bulk_tracker.add(query_string)
+        results = self.bulk_tracker.flush()
+        for result in results:
+            if result.error is not None and \
+                    not isinstance(result.error, TrackingError):
+                raise result.error
+        self.spool.ack(hits[-1][1])
+        for result in results:
+            if result.tracked:
+                self.sent += 1
+            else:
+                self.rejected += 1
+        return len(hits)
+
+    def replay(self):
+        """
+        Send batches until the spool is empty
+
+        :rtype: int
+        """
+        total = 0
+        while True:
+            count = self.replay_once()
+            if not count:
+                return total
+            total += count
+
+    def start(self):
+        """
+        Send the spooled hits from a background thread
+
+        :rtype: None
+        """
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='PiwikSpoolReplayer')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the background thread
+
+        :param timeout: Seconds to wait for the thread
+        :type timeout: float or None
+        :rtype: None
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def __run(self):
+        while not self.__stop.is_set():
+            try:
+                count = self.replay_once()
+                wait = 0 if count else self.interval
+            except Exception:
+                logging.exception("Failed to replay spooled tracking requests")
+                wait = self.retry_interval
+            if wait:
+                self.__stop.wait(wait)
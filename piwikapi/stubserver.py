@@ -0,0 +1,973 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+
+A local server that answers like Piwik, for load and integration tests that
+shouldn't need a real Piwik install
+"""
+
+import collections
+import hashlib
+import optparse
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import zlib
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qsl, urlparse
+
+
+#: A transparent 1x1 GIF, what piwik.php returns for a tracking request
+GIF = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00!\xf9' \
+    b'\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02' \
+    b'\x02D\x01\x00;'
+
+#: A transparent 1x1 PNG, what ImageGraph.get returns
+PNG = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00' \
+    b'\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\x0bIDATx\x9cc`' \
+    b'\x00\x02\x00\x00\x05\x00\x01z^\xab?\x00\x00\x00\x00IEND\xaeB`\x82'
+
+#: Plugin parameters in the order Piwik lists the plugins of a visit
+PLUGINS = (
+    ('fla', 'flash'),
+    ('java', 'java'),
+    ('dir', 'director'),
+    ('qt', 'quicktime'),
+    ('realp', 'realplayer'),
+    ('pdf', 'pdf'),
+    ('wma', 'windowsmedia'),
+    ('gears', 'gears'),
+    ('ag', 'silverlight'),
+    ('cookie', 'cookie'),
+)
+
+#: User agent substrings and the operating system they stand for
+OPERATING_SYSTEMS = (
+    ('Windows NT 10.0', 'Windows 10'),
+    ('Windows NT 6.3', 'Windows 8.1'),
+    ('Windows NT 6.2', 'Windows 8'),
+    ('Windows NT 6.1', 'Windows 7'),
+    ('Windows NT 6.0', 'Windows Vista'),
+    ('Windows NT 5.1', 'Windows XP'),
+    ('Android', 'Android'),
+    ('iPhone', 'iOS'),
+    ('iPad', 'iOS'),
+    ('Mac OS X', 'Mac OS X'),
+    ('Linux', 'Linux'),
+)
+
+#: User agent patterns, the browser name and family they stand for
+BROWSERS = (
+    (re.compile(r'Edge/(\d+)\.(\d+)'), 'Edge', 'edge'),
+    (re.compile(r'(?:Chrome|CriOS)/(\d+)\.(\d+)'), 'Chrome', 'webkit'),
+    (re.compile(r'Firefox/(\d+)\.(\d+)'), 'Firefox', 'gecko'),
+    (re.compile(r'Version/(\d+)\.(\d+).*Safari/'), 'Safari', 'webkit'),
+    (re.compile(r'Opera[/ ](\d+)\.(\d+)'), 'Opera', 'presto'),
+    (re.compile(r'MSIE (\d+)\.(\d+)'), 'Internet Explorer', 'trident'),
+)
+
+SEGMENT_CONDITION = re.compile(r'^(\w+)(==|!=|<=|>=|=@|!@|<|>)(.*)$')
+
+
+def _get_number(value):
+    """
+    Returns a parameter as int or float, like Piwik stores revenues
+
+    :param value: Parameter value
+    :type value: str or None
+    :rtype: int, float or None
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _get_custom_variables(cvar):
+    """
+    Returns custom variables like Piwik lists them
+
+    :param cvar: The cvar or _cvar parameter
+    :type cvar: str or None
+    :rtype: dict
+    """
+    try:
+        cvars = json.loads(cvar or '{}')
+    except ValueError:
+        return {}
+    return dict((slot, {'customVariableName%s' % slot: name,
+                        'customVariableValue%s' % slot: value})
+                for slot, (name, value) in cvars.items())
+
+
+def _escape(value):
+    """
+    Escape a value for the debug output, like PHP's htmlspecialchars()
+
+    :param value: Value
+    :type value: str
+    :rtype: str
+    """
+    return value.replace('&', '&amp;').replace('<', '&lt;') \
+        .replace('>', '&gt;').replace('"', '&quot;')
+
+
+def get_operating_system(user_agent):
+    """
+    Returns the operating system name of a user agent
+
+    :param user_agent: User agent
+    :type user_agent: str
+    :rtype: str
+    """
+    for token, name in OPERATING_SYSTEMS:
+        if token in user_agent:
+            return name
+    return 'Unknown'
+
+
+def get_browser(user_agent):
+    """
+    Returns the browser name and family of a user agent
+
+    :param user_agent: User agent
+    :type user_agent: str
+    :rtype: tuple of (name, family)
+    """
+    for pattern, name, family in BROWSERS:
+        match = pattern.search(user_agent)
+        if match is not None:
+            return '%s %s.%s' % ((name, ) + match.groups()), family
+    return 'Unknown', 'unknown'
+
+
+class RecordedRequest(object):
+    """
+    A request received by the PiwikStubServer
+    """
+    def __init__(self, method, path, headers, body, client_address=None):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.client_address = client_address
+
+    def get_header(self, name):
+        """
+        Return a request header, None if it wasn't sent
+
+        :param name: Header name, case insensitive
+        :type name: str
+        :rtype: str or None
+        """
+        for header, value in self.headers.items():
+            if header.lower() == name.lower():
+                return value
+        return None
+
+    def get_body(self):
+        """
+        Return the request body, decompressed if it was gzipped
+
+        :rtype: bytes
+        """
+        if self.get_header('Content-Encoding') == 'gzip':
+            return zlib.decompress(self.body, 16 + zlib.MAX_WBITS)
+        return self.body
+
+    def json(self):
+        """
+        Return the decoded JSON request body
+
+        :rtype: dict
+        """
+        return json.loads(self.get_body().decode('utf-8'))
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    Records every request and passes it to the server to answer
+    """
+    protocol_version = 'HTTP/1.1'
+    # Small responses would otherwise wait for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_request(b'')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.handle_request(self.rfile.read(length))
+
+    def handle_request(self, body):
+        recorded = RecordedRequest(self.command, self.path,
+                                   dict(self.headers.items()), body,
+                                   self.client_address)
+        self.server.record(recorded)
+        status, headers, body = self.server.respond(recorded)
+        self.send_response(status)
+        for header, value in headers:
+            self.send_header(header, value)
+        if 'Transfer-Encoding' not in dict(headers):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PiwikStubServer(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP server that answers like Piwik
+
+    piwik.php takes single tracking requests, bulk tracking requests and
+    send_image=0. The hits are recorded in ``hits`` and grouped into visits
+    like Piwik does, index.php?module=API answers the common API methods
+    from these visits, including Live.getLastVisitsDetails with segments
+    and API.getBulkRequest. Responses are always JSON. Use set_response()
+    to add a method or replace an answer.
+
+    ``debug`` makes piwik.php answer with debug output like Piwik does
+    with debug enabled in its config, appending debug=1 does that for a
+    single request. ``latency`` seconds plus up to ``jitter`` seconds are
+    waited before answering, ``error_rate`` of the requests are answered
+    with ``error_status``, see also fail_next().
+
+    The server can run the tests of this package::
+
+        server = PiwikStubServer(debug=True)
+        server.start()
+        os.environ.update(server.get_environment())
+
+    or from the command line, see ``python -m piwikapi.stubserver --help``.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    #: Seconds of inactivity after which a visitor starts a new visit
+    VISIT_LENGTH = 30 * 60
+
+    #: Version API.getPiwikVersion returns
+    PIWIK_VERSION = '1.12'
+
+    def __init__(self, address=('127.0.0.1', 0), token_auth=None,
+                 id_site=1, debug=False, latency=0, jitter=0,
+                 error_rate=0, error_status=500):
+        """
+        :param address: Host and port, port 0 picks a free port
+        :type address: tuple of (str, int)
+        :param token_auth: Auth token, a random one by default
+        :type token_auth: str or None
+        :param id_site: Site ID get_environment() returns
+        :type id_site: int
+        :param debug: Answer tracking requests with debug output
+        :type debug: bool
+        :param latency: Seconds to wait before answering
+        :type latency: float
+        :param jitter: Up to this many seconds are added to the latency
+        :type jitter: float
+        :param error_rate: Share of the requests that fail, from 0 to 1
+        :type error_rate: float
+        :param error_status: HTTP status of the failed requests
+        :type error_status: int
+        :rtype: None
+        """
+        HTTPServer.__init__(self, address, StubRequestHandler)
+        if token_auth is None:
+            token_auth = hashlib.md5(os.urandom(32)).hexdigest()
+        self.token_auth = token_auth
+        self.id_site = id_site
+        self.debug = debug
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = []
+        self.hits = []
+        self.responder = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.__failures = collections.deque()
+        self.__responses = {}
+        # (id_site, visitor ID): visit, in the order of the last action
+        self.__visits = collections.OrderedDict()
+        self.__last_id_visit = 0
+        self.__goals = {}
+        self.__last_id_goal = 0
+
+    def start(self):
+        """
+        Serve requests in a background thread
+
+        :rtype: None
+        """
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        :rtype: None
+        """
+        self.shutdown()
+        self.server_close()
+
+    def url(self, path='/piwik.php'):
+        """
+        Return the URL of the given path on this server
+
+        :param path: Path
+        :type path: str
+        :rtype: str
+        """
+        return 'http://%s:%d%s' % (self.server_address[0],
+                                   self.server_address[1], path)
+
+    def get_environment(self):
+        """
+        Returns the environment variables the tests of this package read
+
+        :rtype: dict
+        """
+        return {
+            'PIWIK_TRACKING_API_URL': self.url(),
+            'PIWIK_ANALYTICS_API_URL': self.url('/index.php'),
+            'PIWIK_SITE_ID': str(self.id_site),
+            'PIWIK_TOKEN_AUTH': self.token_auth,
+        }
+
+    def set_response(self, method, value):
+        """
+        Answer an API method with canned data
+
+        :param method: API method, for example 'Referers.getWebsites'
+        :type method: str
+        :param value: Data that is sent as JSON, or a callable that takes the
+            request parameters and returns it
+        :type value: anything JSON can encode, or callable
+        :rtype: None
+        """
+        self.__responses[method] = value
+
+    def fail_next(self, count=1, status=500):
+        """
+        Answer the next requests with an error
+
+        :param count: Number of requests that fail
+        :type count: int
+        :param status: HTTP status
+        :type status: int
+        :rtype: None
+        """
+        with self.lock:
+            self.__failures.extend([status] * count)
+
+    def get_hits(self, id_site=None):
+        """
+        Returns the parameters of the tracked hits
+
+        :param id_site: Only return the hits of this site
+        :type id_site: int or None
+        :rtype: list of dict
+        """
+        with self.lock:
+            return [dict(hit) for hit in self.hits
+                    if id_site is None or hit.get('idsite') == str(id_site)]
+
+    def get_visits(self, id_site=None):
+        """
+        Returns the visits, the most recent one first, like
+        Live.getLastVisitsDetails does
+
+        :param id_site: Only return the visits of this site
+        :type id_site: int or None
+        :rtype: list of dict
+        """
+        with self.lock:
+            visits = [json.loads(json.dumps(visit))
+                      for visit in self.__visits.values()
+                      if id_site is None or visit['idSite'] == int(id_site)]
+        visits.reverse()
+        return visits
+
+    def clear(self):
+        """
+        Forget the recorded requests, hits and visits
+
+        :rtype: None
+        """
+        with self.lock:
+            del self.requests[:]
+            del self.hits[:]
+            self.__visits.clear()
+
+    def record(self, request):
+        with self.lock:
+            self.requests.append(request)
+
+    def respond(self, request):
+        """
+        Answer a request
+
+        :param request: The request
+        :type request: RecordedRequest
+        :rtype: tuple of (status, headers, body)
+        """
+        if self.responder is not None:
+            return self.responder(request)
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        with self.lock:
+            if self.__failures:
+                status = self.__failures.popleft()
+            elif self.error_rate and random.random() < self.error_rate:
+                status = self.error_status
+            else:
+                status = None
+        if status is not None:
+            return status, [('Content-Type', 'text/plain')], \
+                b'Injected error'
+        parsed = urlparse(request.path)
+        params = dict(parse_qsl(parsed.query, keep_blank_values=True))
+        if parsed.path.endswith('.php') and \
+                not parsed.path.endswith('/index.php'):
+            return self.respond_tracking(request, params)
+        if params.get('module') == 'API':
+            return self.respond_api(params)
+        return 404, [('Content-Type', 'text/plain')], b'Not found'
+
+    def respond_tracking(self, request, params):
+        """
+        Answer a request to piwik.php
+
+        :param request: The request
+        :type request: RecordedRequest
+        :param params: Query parameters
+        :type params: dict
+        :rtype: tuple of (status, headers, body)
+        """
+        client_ip = request.client_address and request.client_address[0]
+        if request.method == 'POST':
+            body = request.get_body()
+            content_type = request.get_header('Content-Type') or ''
+            if content_type.startswith('application/x-www-form-urlencoded'):
+                params.update(parse_qsl(body.decode('utf-8'),
+                                        keep_blank_values=True))
+            else:
+                try:
+                    data = json.loads(body.decode('utf-8'))
+                    queries = data['requests']
+                except (ValueError, KeyError, TypeError):
+                    return 400, [('Content-Type', 'application/json')], \
+                        b'{"status": "error", "tracked": 0}'
+                token_auth = data.get('token_auth')
+                for query in queries:
+                    hit = dict(parse_qsl(urlparse(query).query or
+                                         query.lstrip('?'),
+                                         keep_blank_values=True))
+                    if token_auth and 'token_auth' not in hit:
+                        hit['token_auth'] = token_auth
+                    self.track(hit, client_ip)
+                body = json.dumps({'status': 'success',
+                                   'tracked': len(queries)})
+                return 200, [('Content-Type', 'application/json')], \
+                    body.encode('utf-8')
+        headers = dict((name.lower(), value)
+                       for name, value in request.headers.items())
+        if 'ua' not in params and 'user-agent' in headers:
+            params['ua'] = headers['user-agent']
+        if 'lang' not in params and 'accept-language' in headers:
+            params['lang'] = headers['accept-language']
+        output = self.track(params, client_ip)
+        if self.debug or params.get('debug') == '1':
+            return 200, [('Content-Type', 'text/plain; charset=utf-8')], \
+                '\n'.join(output).encode('utf-8')
+        if params.get('send_image') == '0':
+            return 204, [], b''
+        return 200, [('Content-Type', 'image/gif')], GIF
+
+    def track(self, params, client_ip=None):
+        """
+        Record a hit and add it to its visit, returns the debug output
+
+        :param params: Parameters of the tracking request
+        :type params: dict
+        :param client_ip: IP of the host that sent the request
+        :type client_ip: str or None
+        :rtype: list of str
+        """
+        output = ['Debug enabled - Input parameters: ', 'array (']
+        for key, value in sorted(params.items()):
+            output.append("  '%s' => '%s'," % (key, value))
+        output.append(')')
+        authenticated = params.get('token_auth') == self.token_auth
+        if authenticated:
+            output.append('token_auth is authenticated!')
+        ip = authenticated and params.get('cip') or client_ip or ''
+        now = time.time()
+        timestamp = authenticated and _get_number(params.get('cdt')) or now
+        user_agent = params.get('ua', '')
+        visitor_id = authenticated and params.get('cid') or \
+            params.get('_id') or ''
+        config_id = hashlib.md5(('%s%s%s' % (
+            user_agent, ip, params.get('lang', ''))).encode('utf-8')
+        ).hexdigest()[:16]
+        output.append('Matching visitors with: visitorId=%s OR configId=%s' %
+                      (visitor_id or config_id, config_id))
+        try:
+            id_site = int(params.get('idsite'))
+        except (TypeError, ValueError):
+            output.append('Invalid idSite, the hit was not tracked')
+            return output
+        key = (id_site, visitor_id or config_id)
+        with self.lock:
+            self.hits.append(dict(params))
+            visit = self.__visits.pop(key, None)
+            if visit is not None and \
+                    timestamp - visit['lastActionTimestamp'] > \
+                    self.VISIT_LENGTH:
+                visit = None
+            if visit is None:
+                output.append('New Visit (IP = %s)' % ip)
+                visit = self.__get_new_visit(id_site, visitor_id or config_id,
+                                             ip, timestamp, params)
+            else:
+                output.append('Visit is known (IP = %s)' % ip)
+            self.__visits[key] = visit
+            self.__add_action(visit, params, timestamp, output)
+        return output
+
+    def __get_new_visit(self, id_site, visitor_id, ip, timestamp, params):
+        """
+        Returns a new visit in the format of Live.getLastVisitsDetails, the
+        lock must be held
+
+        :rtype: dict
+        """
+        self.__last_id_visit += 1
+        user_agent = params.get('ua', '')
+        browser_name, browser_family = get_browser(user_agent)
+        return {
+            'idSite': id_site,
+            'idVisit': self.__last_id_visit,
+            'visitorId': visitor_id,
+            'visitIp': ip,
+            'firstActionTimestamp': int(timestamp),
+            'lastActionTimestamp': int(timestamp),
+            'visitDuration': 0,
+            'actions': 0,
+            'resolution': params.get('res') or 'unknown',
+            'plugins': ', '.join(name for key, name in PLUGINS
+                                 if params.get(key, '0') not in ('', '0')),
+            'operatingSystem': get_operating_system(user_agent),
+            'browserName': browser_name,
+            'browserFamily': browser_family,
+            'browserLanguage': params.get('lang', ''),
+            'referrerUrl': params.get('urlref', ''),
+            'goalConversions': 0,
+            'visitEcommerceStatus': 'none',
+            'revenue': 0,
+            'customVariables': {},
+            'actionDetails': [],
+        }
+
+    def __add_action(self, visit, params, timestamp, output):
+        """
+        Add the action of a hit to its visit, the lock must be held
+
+        :rtype: None
+        """
+        action = {'timestamp': int(timestamp)}
+        id_goal = params.get('idgoal')
+        if id_goal == '0':
+            items = self.__get_items(params.get('ec_items'))
+            action['revenue'] = _get_number(params.get('revenue')) or 0
+            action['items'] = str(sum(int(item['quantity'])
+                                      for item in items))
+            action['itemDetails'] = items
+            # Only the last cart of a visit is kept
+            visit['actionDetails'] = [
+                other for other in visit['actionDetails']
+                if other['type'] != 'ecommerceAbandonedCart']
+            if params.get('ec_id'):
+                action['type'] = 'ecommerceOrder'
+                action['orderId'] = params['ec_id']
+                visit['visitEcommerceStatus'] = 'ordered'
+                visit['revenue'] += action['revenue']
+                output.append('Ecommerce order %s, revenue = %s' %
+                              (params['ec_id'], action['revenue']))
+            else:
+                action['type'] = 'ecommerceAbandonedCart'
+                if visit['visitEcommerceStatus'] == 'none':
+                    visit['visitEcommerceStatus'] = 'abandonedCart'
+                elif visit['visitEcommerceStatus'] == 'ordered':
+                    visit['visitEcommerceStatus'] = \
+                        'orderedThenAbandonedCart'
+                output.append('Ecommerce cart update, revenue = %s' %
+                              action['revenue'])
+        elif id_goal:
+            action['type'] = 'goal'
+            action['goalId'] = id_goal
+            action['url'] = params.get('url', '')
+            action['revenue'] = _get_number(params.get('revenue')) or 0
+            visit['goalConversions'] += 1
+            visit['revenue'] += action['revenue']
+            output.append('Goal %s converted' % id_goal)
+        else:
+            if params.get('link'):
+                action['type'] = 'outlink'
+                action['url'] = params['link']
+            elif params.get('download'):
+                action['type'] = 'download'
+                action['url'] = params['download']
+            else:
+                action['type'] = 'action'
+                action['url'] = params.get('url', '')
+                action['pageTitle'] = params.get('action_name', '')
+                output.append('Action name = %s' % action['pageTitle'])
+            output.append('Action URL = %s' % _escape(action['url']))
+            custom_variables = _get_custom_variables(params.get('cvar'))
+            if custom_variables:
+                action['customVariables'] = custom_variables
+        visit['customVariables'].update(
+            _get_custom_variables(params.get('_cvar')))
+        visit['actionDetails'].append(action)
+        visit['actions'] = len(visit['actionDetails'])
+        visit['lastActionTimestamp'] = int(timestamp)
+        visit['visitDuration'] = \
+            visit['lastActionTimestamp'] - visit['firstActionTimestamp']
+
+    def __get_items(self, ec_items):
+        """
+        Returns the ecommerce items of a hit like Piwik lists them
+
+        :param ec_items: The ec_items parameter
+        :type ec_items: str or None
+        :rtype: list of dict
+        """
+        try:
+            items = json.loads(ec_items or '[]')
+        except ValueError:
+            items = []
+        details = []
+        for item in items:
+            item = list(item) + [''] * (5 - len(item))
+            details.append({
+                'itemSKU': item[0],
+                'itemName': item[1],
+                'itemCategory': item[2],
+                'price': item[3],
+                'quantity': str(item[4] or 1),
+            })
+        return details
+
+    def respond_api(self, params):
+        """
+        Answer a request to index.php?module=API
+
+        :param params: Query parameters
+        :type params: dict
+        :rtype: tuple of (status, headers, body)
+        """
+        if params.get('method') == 'ImageGraph.get' and \
+                params.get('token_auth') == self.token_auth:
+            return 200, [('Content-Type', 'image/png')], PNG
+        body = json.dumps(self.call(params))
+        return 200, [('Content-Type', 'application/json; charset=utf-8')], \
+            body.encode('utf-8')
+
+    def call(self, params):
+        """
+        Returns the data of an API method
+
+        :param params: Request parameters
+        :type params: dict
+        :rtype: anything JSON can encode
+        """
+        method = params.get('method', '')
+        if params.get('token_auth') != self.token_auth:
+            return self.__get_error(
+                "You can't access this resource as it requires 'view' "
+                "access for the website id = %s." % params.get('idSite'))
+        if method in self.__responses:
+            value = self.__responses[method]
+            if callable(value):
+                return value(params)
+            return value
+        handler = getattr(self, '_api_' + method.replace('.', '_'), None)
+        if handler is None:
+            return self.__get_error("The method '%s' does not exist or is "
+                                    "not available." % method)
+        try:
+            return handler(params)
+        except (KeyError, TypeError, ValueError) as e:
+            return self.__get_error('Invalid parameters for %s: %s' %
+                                    (method, e))
+
+    def __get_error(self, message):
+        """
+        :rtype: dict
+        """
+        return {'result': 'error', 'message': message}
+
+    def __get_segment_filter(self, segment):
+        """
+        Returns a function that tells whether a visit is in a segment
+
+        Conditions are joined by ; for AND and , for OR and compare a visit
+        field with ==, !=, <, <=, >, >=, =@ (contains) or !@.
+
+        :param segment: Segment definition
+        :type segment: str
+        :raises: ValueError if the segment is invalid
+        :rtype: callable
+        """
+        groups = []
+        for group in segment.split(';'):
+            conditions = []
+            for condition in group.split(','):
+                match = SEGMENT_CONDITION.match(condition)
+                if match is None:
+                    raise ValueError("The segment '%s' is not valid" %
+                                     segment)
+                name, operator, value = match.groups()
+                conditions.append((name, operator, unquote(value)))
+            groups.append(conditions)
+
+        def compare(field, operator, value):
+            if operator == '==':
+                return field == value
+            if operator == '!=':
+                return field != value
+            if operator == '=@':
+                return value in field
+            if operator == '!@':
+                return value not in field
+            try:
+                field, value = float(field), float(value)
+            except ValueError:
+                return False
+            return {'<': field < value, '<=': field <= value,
+                    '>': field > value, '>=': field >= value}[operator]
+
+        def matches(visit):
+            for conditions in groups:
+                for name, operator, value in conditions:
+                    if any(compare(field, operator, value)
+                           for field in self.__get_fields(visit, name)):
+                        break
+                else:
+                    return False
+            return True
+        return matches
+
+    def __get_fields(self, visit, name):
+        """
+        Returns the values a segment dimension has in a visit
+
+        :rtype: list of str
+        """
+        match = re.match(r'^customVariable(Name|Value)(\d)$', name)
+        if match is not None:
+            variable = visit['customVariables'].get(match.group(2))
+            if variable is None:
+                return ['']
+            return [variable[name]]
+        if name in ('pageUrl', 'pageTitle'):
+            key = name == 'pageUrl' and 'url' or 'pageTitle'
+            return [action[key] for action in visit['actionDetails']
+                    if key in action]
+        if name == 'visitorType':
+            return ['new']
+        value = visit.get(name)
+        if value is None:
+            return ['']
+        return [str(value)]
+
+    def __get_site_visits(self, params):
+        """
+        Returns the visits of the requested site in the requested segment,
+        the most recent one first
+
+        :rtype: list of dict
+        """
+        visits = self.get_visits(params['idSite'])
+        if params.get('lastMinutes'):
+            since = time.time() - float(params['lastMinutes']) * 60
+            visits = [visit for visit in visits
+                      if visit['lastActionTimestamp'] >= int(since)]
+        if params.get('segment'):
+            matches = self.__get_segment_filter(params['segment'])
+            visits = [visit for visit in visits if matches(visit)]
+        return visits
+
+    def _api_API_getPiwikVersion(self, params):
+        return {'value': self.PIWIK_VERSION}
+
+    def _api_API_getBulkRequest(self, params):
+        results = []
+        i = 0
+        while 'urls[%d]' % i in params:
+            request = dict(params)
+            request.update(parse_qsl(params['urls[%d]' % i],
+                                     keep_blank_values=True))
+            results.append(self.call(request))
+            i += 1
+        return results
+
+    def _api_SitesManager_getSiteFromId(self, params):
+        id_site = int(params['idSite'])
+        return [{'idsite': str(id_site), 'name': 'Site %d' % id_site,
+                 'main_url': 'http://example.com'}]
+
+    def _api_Live_getLastVisitsDetails(self, params):
+        visits = self.__get_site_visits(params)
+        offset = int(params.get('filter_offset', 0))
+        limit = int(params.get('filter_limit', 100))
+        if limit < 0:
+            return visits[offset:]
+        return visits[offset:offset + limit]
+
+    def _api_Live_getCounters(self, params):
+        visits = self.__get_site_visits(params)
+        return [{
+            'visits': len(visits),
+            'actions': sum(visit['actions'] for visit in visits),
+            'visitors': len(set(visit['visitorId'] for visit in visits)),
+            'visitsConverted': len([visit for visit in visits
+                                    if visit['goalConversions']]),
+        }]
+
+    def _api_VisitsSummary_get(self, params):
+        visits = self.__get_site_visits(params)
+        return {
+            'nb_uniq_visitors': len(set(visit['visitorId']
+                                        for visit in visits)),
+            'nb_visits': len(visits),
+            'nb_actions': sum(visit['actions'] for visit in visits),
+            'nb_visits_converted': len([visit for visit in visits
+                                        if visit['goalConversions']]),
+            'bounce_count': len([visit for visit in visits
+                                 if visit['actions'] == 1]),
+            'sum_visit_length': sum(visit['visitDuration']
+                                    for visit in visits),
+            'max_actions': max([visit['actions'] for visit in visits] or
+                               [0]),
+        }
+
+    def _api_Goals_addGoal(self, params):
+        with self.lock:
+            self.__last_id_goal += 1
+            id_goal = self.__last_id_goal
+            self.__goals[id_goal] = {
+                'idsite': str(params['idSite']),
+                'idgoal': str(id_goal),
+                'name': params['name'],
+                'match_attribute': params['matchAttribute'],
+                'pattern': params['pattern'],
+                'pattern_type': params['patternType'],
+            }
+        return {'value': id_goal}
+
+    def _api_Goals_deleteGoal(self, params):
+        with self.lock:
+            self.__goals.pop(int(params['idGoal']), None)
+        return {'result': 'success', 'message': 'ok'}
+
+    def _api_Goals_getGoals(self, params):
+        with self.lock:
+            return dict((str(id_goal), goal)
+                        for id_goal, goal in self.__goals.items()
+                        if goal['idsite'] == str(params['idSite']))
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    Without a command the server runs until it is interrupted, with one it
+    runs the command with the environment variables of the tests set and
+    stops when the command exits.
+
+    :param argv: Arguments, None for sys.argv
+    :type argv: list of str or None
+    :rtype: int
+    """
+    parser = optparse.OptionParser(
+        usage='%prog [options] [-- COMMAND...]',
+        prog='python -m piwikapi.stubserver')
+    parser.disable_interspersed_args()
+    parser.add_option('--host', default='127.0.0.1',
+                      help='Address to listen on [default: %default]')
+    parser.add_option('--port', type='int', default=0,
+                      help='Port to listen on [default: a free port]')
+    parser.add_option('--token-auth', help='Auth token [default: random]')
+    parser.add_option('--id-site', type='int', default=1,
+                      help='Site ID for the tests [default: %default]')
+    parser.add_option('--debug', action='store_true', default=False,
+                      help='Answer tracking requests with debug output')
+    parser.add_option('--latency', type='float', default=0,
+                      help='Seconds to wait before answering '
+                           '[default: %default]')
+    parser.add_option('--jitter', type='float', default=0,
+                      help='Random extra latency up to this many seconds '
+                           '[default: %default]')
+    parser.add_option('--error-rate', type='float', default=0,
+                      help='Share of the requests that fail '
+                           '[default: %default]')
+    parser.add_option('--error-status', type='int', default=500,
+                      help='HTTP status of the failed requests '
+                           '[default: %default]')
+    options, args = parser.parse_args(argv)
+    server = PiwikStubServer((options.host, options.port),
+                             options.token_auth, options.id_site,
+                             options.debug, options.latency, options.jitter,
+                             options.error_rate, options.error_status)
+    environment = server.get_environment()
+    if args:
+        server.start()
+        env = dict(os.environ)
+        env.update(environment)
+        try:
+            return subprocess.call(args, env=env)
+        finally:
+            server.stop()
+    for name, value in sorted(environment.items()):
+        print('export %s=%s' % (name, value))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+from .profiling import now_ns
+from .tracking import PiwikTracker
+
+
+class _TemplateRequest(object):
+    """
+    An empty request for the prototype tracker
+    """
+    META = {}
+
+    def is_secure(self):
+        return False
+
+
+class PiwikTrackerTemplate(object):
+    """
+    Creates trackers for one site without running PiwikTracker.__init__()
+
+    The site configuration is applied once to a prototype tracker, every
+    tracker returned by get_tracker() starts out as a copy of it. The
+    visitor ID and the local time are only generated when a hit is built.
+
+    A template can't be changed after it was created, so it can be shared
+    between threads::
+
+        template = PiwikTrackerTemplate(
+            1, 'http://yoursite.example.com/piwik.php',
+            token_auth='YOUR_AUTH_TOKEN_STRING')
+
+        def view(request):
+            pt = template.get_tracker(request)
+            pt.do_track_page_view('Some page title')
+    """
+    __slots__ = ('tracker_class', '__defaults', '__copied')
+
+    #: Attributes that are read from the request of each tracker
+    REQUEST_ATTRIBUTES = ('request', 'host', 'script', 'query_string',
+                          'user_agent', 'referer', 'accept_language',
+                          'page_url')
+
+    def __init__(self, id_site, api_url, token_auth=False, plugins=None,
+                 custom_variables=(), tracker_class=PiwikTracker, **settings):
+        """
+        :param id_site: Site ID
+        :type id_site: int
+        :param api_url: Piwik tracking API URL, the URL of piwik.php
+        :type api_url: str
+        :param token_auth: Auth token
+        :type token_auth: str
+        :param plugins: Plugins, see PiwikTracker.set_plugins()
+        :type plugins: dict of {str: int} or None
+        :param custom_variables: Custom variables set on every tracker, see
+            PiwikTracker.set_custom_variable()
+        :type custom_variables: list of (id, name, value, scope) tuples
+        :param tracker_class: The tracker class, e.g. PiwikTrackerEcommerce
+            or AsyncPiwikTracker
+        :type tracker_class: class
+        :param settings: Arguments for the tracker's set_*() methods, e.g.
+            ``transport=pool`` calls set_transport(pool)
+        :rtype: None
+        """
+        prototype = tracker_class(id_site, _TemplateRequest())
+        prototype.set_api_url(api_url)
+        if token_auth:
+            prototype.set_token_auth(token_auth)
+        if plugins:
+            prototype.set_plugins(**plugins)
+        for custom_variable in custom_variables:
+            prototype.set_custom_variable(*custom_variable)
+        for name, value in settings.items():
+            getattr(prototype, 'set_%s' % name)(value)
+        # Encode the static parameters and custom variables once for all
+        # trackers
+        prototype._get_static_query(id_site)
+        prototype._get_custom_var_query()
+        defaults = dict(prototype.__dict__)
+        for name in self.REQUEST_ATTRIBUTES:
+            defaults.pop(name, None)
+        object.__setattr__(self, 'tracker_class', tracker_class)
+        object.__setattr__(self, '_PiwikTrackerTemplate__defaults', defaults)
+        # The setters change these dicts in place, every tracker needs a copy
+        object.__setattr__(self, '_PiwikTrackerTemplate__copied', tuple(
+            name for name, value in defaults.items()
+            if isinstance(value, dict)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PiwikTrackerTemplate can't be changed")
+
+    @property
+    def id_site(self):
+        """
+        :rtype: int
+        """
+        return self.__defaults['id_site']
+
+    @property
+    def api_url(self):
+        """
+        :rtype: str
+        """
+        return self.__defaults['api_url']
+
+    def get_tracker(self, request):
+        """
+        Returns a new tracker for a request
+
+        :param request: Request
+        :type request: A Django-like request object
+        :rtype: PiwikTracker
+        """
+        profiler = self.__defaults['profiler']
+        if profiler is not None:
+            started = now_ns()
+        tracker = self.tracker_class.__new__(self.tracker_class)
+        attributes = self.__defaults.copy()
+        for name in self.__copied:
+            attributes[name] = attributes[name].copy()
+        tracker.__dict__ = attributes
+        tracker._set_request(request)
+        if profiler is not None:
+            profiler.record('tracker', now_ns() - started)
+        return tracker
@@ -1,3 +1,4 @@
+import sys
 try:
     import unittest2 as unittest
 except ImportError:
@@ -6,11 +7,35 @@ except ImportError:
 from analytics import AnalyticsClassTestCase
 from analytics import AnalyticsTestCase
 from analytics import AnalyticsLiveTestCase
+from benchmarks import BenchmarkSuiteTestCase
+from bulk import BulkTrackerTestCase
+from cart import CartCoalescerTestCase
+from cookies import CookieJarTestCase
+from cookies import CookieTestCase
+from dedup import DeduplicatorTestCase
+from dispatch import DispatcherTestCase
 from ecommerce import TrackerEcommerceVerifyTestCase
+from encoding import QueryEncodingTestCase
+from events import TrackingEventTestCase
+from fanout import SiteFanOutTestCase
 from goals import GoalsTestCase
+from importlog import LogImportTestCase
+from metrics import MetricsTestCase
+from profiling import ProfilingTestCase
+from retry import RetryTestCase
+from sampling import SamplingTestCase
+from spool import SpoolTestCase
+from stubserver import StubServerTestCase
+from template import TemplateTestCase
 from tracking import TrackerClassTestCase
 from tracking import TrackerVerifyDebugTestCase
 from tracking import TrackerVerifyTestCase
+from transport import TransportTestCase
+from visitor import VisitorIdTestCase
+from wsgi import WSGIMiddlewareTestCase
+if sys.version_info >= (3, 5):
+    from aio import AsyncTrackerTestCase
+    from asgi import ASGIMiddlewareTestCase
 
 
 if __name__ == '__main__':
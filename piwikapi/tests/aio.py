@@ -0,0 +1,206 @@
+import asyncio
+import random
+import threading
+import time
+from http.client import RemoteDisconnected
+from urllib.error import HTTPError
+
+from piwikapi.aio import AsyncConnectionPool
+from piwikapi.aio import AsyncPiwikAnalytics
+from piwikapi.aio import AsyncPiwikTracker
+from piwikapi.aio import AsyncPiwikTrackerEcommerce
+from piwikapi.cart import CartCoalescer
+from piwikapi.sampling import VisitorSampler
+from piwikapi.tracking import PiwikTracker
+
+from sampling import CollectingDispatcher
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class ThreadRecordingDispatcher(CollectingDispatcher):
+    """
+    Remembers the threads hits were added from
+    """
+    def __init__(self, overflow='block'):
+        super(ThreadRecordingDispatcher, self).__init__()
+        self.overflow = overflow
+        self.threads = []
+
+    def add(self, query_string):
+        self.threads.append(threading.current_thread())
+        return super(ThreadRecordingDispatcher, self).add(query_string)
+
+
+class AsyncTrackerTestCase(TrackerBaseTestCase):
+    """
+    AsyncPiwikTracker and AsyncPiwikAnalytics tests, against a local server
+    """
+    def setUp(self):
+        super(AsyncTrackerTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.loop = asyncio.new_event_loop()
+        self.pool = AsyncConnectionPool(limit_per_endpoint=2)
+        self.apt = AsyncPiwikTracker(1, self.request)
+        self.apt.set_api_url(self.server.url())
+        self.apt.set_transport(self.pool)
+
+    def tearDown(self):
+        self.run_async(self.pool.aclose())
+        self.loop.close()
+        self.server.stop()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_do_track_page_view(self):
+        body = self.run_async(self.apt.do_track_page_view('async'))
+        self.assertTrue('GIF89a' in body, "Unexpected body %s" % body)
+        self.assertEqual(1, len(self.server.requests))
+        headers = dict((key.lower(), value) for key, value in
+                       self.server.requests[0].headers.items())
+        self.assertEqual(self.request.META['HTTP_USER_AGENT'],
+                         headers['user-agent'])
+
+    def test_send_image_disabled(self):
+        self.apt.set_send_image(False)
+        response = self.run_async(self.apt.do_track_page_view('no image'))
+        self.assertEqual(204, response.status)
+
+    def test_sampled_out(self):
+        self.apt.set_sampler(VisitorSampler(0))
+        self.assertFalse(self.run_async(self.apt.do_track_page_view('no')))
+        self.assertEqual(0, len(self.server.requests))
+
+    def test_same_query_as_blocking_tracker(self):
+        pt = PiwikTracker(1, self.request)
+        pt.visitor_id = self.apt.visitor_id
+        random.seed(1)
+        blocking = pt._get_request(1)
+        random.seed(1)
+        self.assertEqual(blocking, self.apt._get_request(1),
+                         "Query strings differ")
+
+    def test_connection_is_reused(self):
+        self.run_async(self.apt.do_track_page_view('first'))
+        self.run_async(self.apt.do_track_action('http://example.com/',
+                                                'link'))
+        first, second = self.server.requests
+        self.assertEqual(first.client_address, second.client_address,
+                         "The second request used a new connection")
+
+    def test_concurrency_limit(self):
+        async def track_many():
+            return await asyncio.gather(*[
+                self.apt.do_track_page_view('page %d' % i) for i in range(6)
+            ])
+        self.run_async(track_many())
+        self.assertEqual(6, len(self.server.requests))
+        clients = set(request.client_address
+                      for request in self.server.requests)
+        self.assertTrue(len(clients) <= 2,
+                        "More than two concurrent connections: %s" % clients)
+
+    def test_ecommerce_order(self):
+        apte = AsyncPiwikTrackerEcommerce(1, self.request)
+        apte.set_api_url(self.server.url())
+        apte.set_transport(self.pool)
+        apte.add_ecommerce_item('sku', 'name', price=10, quantity=2)
+        self.run_async(apte.do_track_ecommerce_order('order1', 20))
+        self.assertTrue('ec_id=order1' in self.server.requests[0].path)
+
+    def test_blocking_calls_off_the_loop(self):
+        """
+        Adding to a dispatcher that blocks when full and flushing the cart
+        before an order don't run on the event loop
+        """
+        loop_thread = threading.current_thread()
+        dispatcher = ThreadRecordingDispatcher()
+        coalescer = CartCoalescer(dispatcher, flush_at_exit=False)
+        apte = AsyncPiwikTrackerEcommerce(1, self.request)
+        apte.set_dispatcher(dispatcher)
+        apte.set_cart_coalescer(coalescer)
+        try:
+            apte.add_ecommerce_item('sku', 'name', price=10, quantity=2)
+            self.assertTrue(self.run_async(
+                apte.do_track_ecommerce_cart_update(20)))
+            apte.add_ecommerce_item('sku', 'name', price=10, quantity=2)
+            self.assertTrue(self.run_async(
+                apte.do_track_ecommerce_order('order1', 20)))
+        finally:
+            coalescer.close()
+        self.assertEqual(2, len(dispatcher.query_strings))
+        self.assertFalse('ec_id' in dispatcher.query_strings[0])
+        self.assertTrue('ec_id=order1' in dispatcher.query_strings[1])
+        self.assertFalse(loop_thread in dispatcher.threads)
+        dispatcher = ThreadRecordingDispatcher('drop_newest')
+        self.apt.set_dispatcher(dispatcher)
+        self.assertTrue(self.run_async(self.apt.do_track_page_view('drop')))
+        self.assertEqual([loop_thread], dispatcher.threads)
+
+    def test_http_error(self):
+        self.server.responder = lambda request: (503, [], b'down')
+        self.assertRaises(HTTPError, self.run_async,
+                          self.apt.do_track_page_view('error'))
+
+    def test_timeout_covers_connect(self):
+        async def slow_connect(key):
+            await asyncio.sleep(10)
+        pool = AsyncConnectionPool(timeout=0.1)
+        pool._new_connection = slow_connect
+        started = time.time()
+        self.assertRaises(asyncio.TimeoutError, self.run_async,
+                          pool.request('GET', self.server.url()))
+        self.assertTrue(time.time() - started < 5, "Connect wasn't timed out")
+
+    def test_resend_on_new_connection(self):
+        """
+        A POST that fails on a reused connection is only sent again if the
+        server closed it without a response
+        """
+        url = self.server.url()
+        key = self.pool._get_key(url)
+        exchange = self.pool._exchange
+        calls = []
+
+        def reset_once(error):
+            async def _exchange(connection, *args):
+                calls.append(connection)
+                if len(calls) == 1:
+                    raise error
+                return await exchange(connection, *args)
+            del calls[:]
+            self.pool._put_connection(
+                key, self.run_async(self.pool._new_connection(key)))
+            self.pool._exchange = _exchange
+
+        reset_once(ConnectionResetError())
+        self.assertRaises(ConnectionResetError, self.run_async,
+                          self.pool.request('POST', url, b'{}'))
+        self.assertEqual(1, len(calls))
+        reset_once(RemoteDisconnected())
+        self.run_async(self.pool.request('POST', url, b'{}'))
+        self.assertEqual(2, len(calls))
+        reset_once(ConnectionResetError())
+        self.run_async(self.pool.request('GET', url))
+        self.assertEqual(2, len(calls))
+
+    def test_header_injection(self):
+        for headers in ({'User-Agent': 'x\r\nX-Injected: 1'},
+                        {'X-Name\n': 'value'}):
+            self.assertRaises(ValueError, self.run_async,
+                              self.pool.request('GET', self.server.url(),
+                                                headers=headers))
+        self.assertRaises(ValueError, self.run_async, self.pool.request(
+            'GET', self.server.url('/piwik.php?a\r\nX-Injected: 1')))
+        self.assertEqual(0, len(self.server.requests))
+
+    def test_analytics(self):
+        self.server.responder = lambda request: (
+            200, [('Transfer-Encoding', 'chunked')], b'2\r\n[]\r\n0\r\n\r\n')
+        a = AsyncPiwikAnalytics()
+        a.set_api_url(self.server.url('/'))
+        a.set_transport(self.pool)
+        a.set_method('API.getPiwikVersion')
+        self.assertEqual(b'[]', self.run_async(a.send_request()))
@@ -0,0 +1,131 @@
+import asyncio
+from urllib.parse import parse_qs
+
+from piwikapi.aio import AsyncConnectionPool
+from piwikapi.aio import AsyncPiwikTracker
+from piwikapi.asgi import PiwikASGIMiddleware
+from piwikapi.asgi import ScopeRequest
+from piwikapi.dedup import HitDeduplicator
+from piwikapi.template import PiwikTrackerTemplate
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class ASGIMiddlewareTestCase(TrackerBaseTestCase):
+    """
+    PiwikASGIMiddleware tests, against a local server
+    """
+    def setUp(self):
+        super(ASGIMiddlewareTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.status = 200
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.server.stop()
+
+    async def app(self, scope, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Hello'})
+
+    def get_scope(self, path='/page/'):
+        return {
+            'type': 'http',
+            'scheme': 'https',
+            'path': path,
+            'query_string': b'a=1',
+            'headers': [(b'host', b'shop.example.com'),
+                        (b'user-agent', b'Test agent'),
+                        (b'cookie', b'other=1')],
+            'client': ('192.0.2.7', 50000),
+            'server': ('127.0.0.1', 8000),
+        }
+
+    def run_app(self, middleware, scope):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        async def run():
+            await middleware(scope, receive, send)
+            await middleware.drain()
+        self.loop.run_until_complete(run())
+        return messages
+
+    def get_query(self, index=0):
+        path = self.server.requests[index].path
+        return parse_qs(path.split('?', 1)[1])
+
+    def test_blocking_tracker(self):
+        template = PiwikTrackerTemplate(1, self.server.url(),
+                                        token_auth='token')
+        middleware = PiwikASGIMiddleware(self.app, template)
+        messages = self.run_app(middleware, self.get_scope())
+        self.assertEqual(2, len(messages))
+        self.assertEqual(0, middleware.pending())
+        self.assertEqual(1, len(self.server.requests))
+        query = self.get_query()
+        self.assertEqual(['https://shop.example.com/page/?a=1'],
+                         query['url'])
+        self.assertEqual('Test agent',
+                         self.server.requests[0].get_header('User-Agent'))
+        self.assertEqual(['192.0.2.7'], query['cip'])
+
+    def test_async_tracker(self):
+        pool = AsyncConnectionPool()
+        template = PiwikTrackerTemplate(1, self.server.url(),
+                                        tracker_class=AsyncPiwikTracker,
+                                        transport=pool)
+        middleware = PiwikASGIMiddleware(
+            self.app, template, exclude=('/static/',),
+            get_title=lambda scope, status, headers: 'Title')
+        self.run_app(middleware, self.get_scope())
+        self.run_app(middleware, self.get_scope('/static/app.js'))
+        self.loop.run_until_complete(pool.aclose())
+        self.assertEqual(1, len(self.server.requests))
+        query = self.get_query()
+        self.assertEqual(['Title'], query['action_name'])
+        self.assertFalse('cip' in query, "IP sent without token")
+
+    def test_errors_not_tracked(self):
+        self.status = 500
+        template = PiwikTrackerTemplate(1, self.server.url())
+        middleware = PiwikASGIMiddleware(self.app, template)
+        self.run_app(middleware, self.get_scope())
+        self.assertEqual(0, len(self.server.requests))
+
+    def test_scope_request(self):
+        scope = self.get_scope()
+        del scope['headers'][0]
+        request = ScopeRequest(scope)
+        self.assertTrue(request.is_secure())
+        self.assertEqual('127.0.0.1', request.META['SERVER_NAME'])
+        self.assertEqual('other=1', request.META['HTTP_COOKIE'])
+        scope['headers'].append((b'cookie', b'_pk_ses.1.1fff=*'))
+        self.assertEqual('other=1; _pk_ses.1.1fff=*',
+                         ScopeRequest(scope).META['HTTP_COOKIE'])
+
+    def test_visitor_cookie(self):
+        """
+        The trackers read the _pk_id cookie, so a reload of the same visitor
+        is a duplicate
+        """
+        template = PiwikTrackerTemplate(1, self.server.url(),
+                                        deduplicator=HitDeduplicator())
+        middleware = PiwikASGIMiddleware(self.app, template)
+        for i in range(2):
+            scope = self.get_scope()
+            scope['headers'].append(
+                (b'cookie', b'_pk_id.1.1fff=0123456789abcdef.1360000000'))
+            self.run_app(middleware, scope)
+        self.assertEqual(1, len(self.server.requests))
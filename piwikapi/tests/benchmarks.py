@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from piwikapi.benchmarks import suite
+
+
+class BenchmarkSuiteTestCase(unittest.TestCase):
+    """
+    Tests for the benchmark result comparison
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compare(self):
+        baseline = {
+            'encoding': [{'name': 'fast', 'us/hit': 10.0},
+                         {'name': 'gone', 'us/hit': 1.0}],
+            'compression': [{'level': 1, 'bytes': 100, 'ms/1000 hits': 2.0},
+                            {'level': 'none', 'ms/1000 hits': 0.0}],
+        }
+        results = {
+            'encoding': [{'name': 'fast', 'us/hit': 12.5},
+                         {'name': 'new', 'us/hit': 1.0}],
+            'compression': [{'level': 1, 'bytes': 500, 'ms/1000 hits': 2.1},
+                            {'level': 'none', 'ms/1000 hits': 0.0}],
+        }
+        comparisons = sorted(suite.compare(results, baseline, 0.2))
+        self.assertEqual([
+            ('compression', '1', 'ms/1000 hits', 2.0, 2.1, 1.05, False),
+            ('encoding', 'fast', 'us/hit', 10.0, 12.5, 1.25, True),
+        ], [comparison[:5] + (round(comparison[5], 2), comparison[6])
+            for comparison in comparisons])
+
+    def test_save_and_load(self):
+        path = os.path.join(self.directory, 'bench.json')
+        results = {'encoding': [{'name': 'fast', 'us/hit': 10.0}]}
+        suite.save(path, results)
+        self.assertEqual(results, suite.load(path))
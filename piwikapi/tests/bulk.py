@@ -0,0 +1,144 @@
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from piwikapi.bulk import PiwikBulkTracker
+from piwikapi.exceptions import TrackingError
+from piwikapi.tracking import PiwikTrackerEcommerce
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class BulkTrackerTestCase(TrackerBaseTestCase):
+    """
+    PiwikBulkTracker tests, against a local server
+    """
+    def setUp(self):
+        super(BulkTrackerTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.bulk = PiwikBulkTracker(self.server.url(), 'bulktoken',
+                                     max_hits=3, max_age=None)
+        self.pt.set_bulk_tracker(self.bulk)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_bulk_requests(self):
+        return [request for request in self.server.requests
+                if request.method == 'POST']
+
+    def test_hits_are_queued(self):
+        result = self.pt.do_track_page_view('queued')
+        self.assertFalse(result.done(), "Hit was sent right away")
+        self.assertEqual(1, self.bulk.pending())
+        self.assertEqual([], self.server.requests, "Request was sent")
+
+    def test_flush_on_size(self):
+        results = [self.pt.do_track_page_view('page %d' % i)
+                   for i in range(3)]
+        self.assertEqual(0, self.bulk.pending())
+        requests = self.get_bulk_requests()
+        self.assertEqual(1, len(requests), "Expected one bulk request")
+        data = requests[0].json()
+        self.assertEqual('bulktoken', data['token_auth'])
+        self.assertEqual(3, len(data['requests']))
+        for result in results:
+            self.assertTrue(result.get(1), "Hit not tracked")
+
+    def test_explicit_flush(self):
+        result = self.pt.do_track_action('http://out.example.com/', 'link')
+        results = self.bulk.flush()
+        self.assertEqual([result], results)
+        self.assertTrue(result.get(1), "Hit not tracked")
+        self.assertEqual([], self.bulk.flush(), "Empty flush sent hits")
+        self.assertEqual(1, len(self.get_bulk_requests()))
+
+    def test_flush_on_age(self):
+        bulk = PiwikBulkTracker(self.server.url(), max_hits=100, max_age=0.1)
+        self.pt.set_bulk_tracker(bulk)
+        result = self.pt.do_track_page_view('aged')
+        self.assertTrue(result.get(5), "Hit not tracked")
+        self.assertFalse('token_auth' in self.get_bulk_requests()[0].json())
+
+    def test_headers_sent_as_parameters(self):
+        self.pt.set_token_auth('hittoken')
+        self.pt.do_track_page_view('headers')
+        self.bulk.flush()
+        data = self.get_bulk_requests()[0].json()
+        self.assertEqual('bulktoken', data['token_auth'])
+        query = data['requests'][0]
+        self.assertTrue(query.startswith('?'), "Query must start with ?")
+        params = parse_qs(query[1:])
+        self.assertEqual([self.request.META['HTTP_USER_AGENT']], params['ua'])
+        self.assertEqual([self.request.META['HTTP_ACCEPT_LANGUAGE']],
+                         params['lang'])
+        self.assertEqual(['headers'], params['action_name'])
+        self.assertFalse('token_auth' in params)
+
+    def test_invalid_indices(self):
+        def responder(request):
+            body = json.dumps({'status': 'success', 'tracked': 1,
+                               'invalid': 1, 'invalid_indices': [0]})
+            return 200, [], body.encode('utf-8')
+        self.server.responder = responder
+        first = self.pt.do_track_page_view('invalid')
+        second = self.pt.do_track_page_view('valid')
+        self.bulk.flush()
+        self.assertRaises(TrackingError, first.get, 1)
+        self.assertTrue(second.get(1))
+
+    def test_failed_request(self):
+        def responder(request):
+            body = json.dumps({'status': 'error', 'tracked': 1,
+                               'message': 'broken'})
+            return 400, [], body.encode('utf-8')
+        self.server.responder = responder
+        first = self.pt.do_track_page_view('tracked')
+        second = self.pt.do_track_page_view('not tracked')
+        self.bulk.flush()
+        self.assertTrue(first.get(1))
+        self.assertRaises(TrackingError, second.get, 1)
+
+    def test_ecommerce_order(self):
+        pte = PiwikTrackerEcommerce(1, self.request)
+        pte.set_bulk_tracker(self.bulk)
+        pte.add_ecommerce_item('sku', 'name', price=10, quantity=2)
+        result = pte.do_track_ecommerce_order('order1', 20)
+        self.assertEqual({}, pte.ecommerce_items, "Items were not reset")
+        self.bulk.flush()
+        self.assertTrue(result.get(1))
+        params = parse_qs(result.query_string)
+        self.assertEqual(['order1'], params['ec_id'])
+        self.assertEqual(['0'], params['idgoal'])
+
+    def test_compression(self):
+        bulk = PiwikBulkTracker(self.server.url(), max_hits=10, max_age=None,
+                                compress_level=6, compress_threshold=100)
+        self.pt.set_bulk_tracker(bulk)
+        results = [self.pt.do_track_page_view('compressed %d' % i)
+                   for i in range(5)]
+        bulk.flush()
+        request = self.get_bulk_requests()[0]
+        self.assertEqual('gzip', request.get_header('Content-Encoding'))
+        self.assertTrue(len(request.body) < len(request.get_body()),
+                        "Body was not compressed")
+        self.assertEqual(5, len(request.json()['requests']))
+        for result in results:
+            self.assertTrue(result.get(1), "Hit not tracked")
+
+    def test_compression_threshold(self):
+        bulk = PiwikBulkTracker(self.server.url(), max_age=None,
+                                compress_level=6, compress_threshold=100000)
+        self.pt.set_bulk_tracker(bulk)
+        self.pt.do_track_page_view('small')
+        bulk.flush()
+        request = self.get_bulk_requests()[0]
+        self.assertEqual(None, request.get_header('Content-Encoding'))
+        self.assertEqual(1, len(request.json()['requests']))
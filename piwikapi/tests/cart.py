@@ -0,0 +1,189 @@
+import atexit
+import gc
+import threading
+import time
+import unittest
+import weakref
+
+from piwikapi.cart import CartCoalescer
+from piwikapi.tracking import PiwikTrackerEcommerce
+
+from request import FakeRequest
+from sampling import CollectingDispatcher
+from tracking import TrackerBaseTestCase
+
+
+class SlowDispatcher(CollectingDispatcher):
+    """
+    Takes a while to add cart updates, drops them while ``full`` is set
+    """
+    def __init__(self):
+        super(SlowDispatcher, self).__init__()
+        self.adding = threading.Event()
+        self.full = False
+
+    def add(self, query_string):
+        if 'ec_id' not in query_string:
+            if self.full:
+                return False
+            self.adding.set()
+            time.sleep(0.1)
+        return super(SlowDispatcher, self).add(query_string)
+
+
+class CartCoalescerTestCase(TrackerBaseTestCase):
+    """
+    CartCoalescer tests
+    """
+    def setUp(self):
+        super(CartCoalescerTestCase, self).setUp()
+        self.dispatcher = CollectingDispatcher()
+        self.coalescer = CartCoalescer(self.dispatcher, window=10,
+                                       flush_at_exit=False)
+        self.pte = self.get_tracker()
+
+    def tearDown(self):
+        self.coalescer.close()
+
+    def get_tracker(self, request=None):
+        pte = PiwikTrackerEcommerce(1, request or self.request)
+        pte.set_dispatcher(self.dispatcher)
+        pte.set_cart_coalescer(self.coalescer)
+        return pte
+
+    def update_cart(self, quantity, pte=None):
+        pte = pte or self.pte
+        pte.add_ecommerce_item('sku', 'Product', price=10,
+                               quantity=quantity)
+        return pte.do_track_ecommerce_cart_update(10 * quantity)
+
+    def test_coalesce(self):
+        for quantity in range(1, 6):
+            self.assertTrue(self.update_cart(quantity))
+        self.assertEqual(1, self.coalescer.pending())
+        self.assertEqual([], self.dispatcher.query_strings)
+        self.coalescer.flush()
+        self.assertEqual(1, len(self.dispatcher.query_strings))
+        self.assertTrue('revenue=50' in self.dispatcher.query_strings[0])
+        self.assertEqual(4, self.coalescer.coalesced)
+
+    def test_unchanged_cart(self):
+        self.update_cart(1)
+        self.coalescer.flush()
+        self.assertFalse(self.update_cart(1), "Unchanged cart held")
+        self.update_cart(2)
+        self.update_cart(1)
+        self.coalescer.flush()
+        self.assertEqual(1, len(self.dispatcher.query_strings))
+        self.assertEqual(2, self.coalescer.unchanged)
+
+    def test_cart_after_order(self):
+        self.update_cart(1)
+        self.coalescer.flush()
+        self.pte.add_ecommerce_item('sku', 'Product', price=10, quantity=1)
+        self.pte.do_track_ecommerce_order('order', 10)
+        self.assertTrue(self.update_cart(1), "Cart after the order dropped")
+        self.coalescer.flush()
+        self.assertEqual(3, len(self.dispatcher.query_strings))
+        self.assertEqual(0, self.coalescer.unchanged)
+
+    def test_dropped_update(self):
+        dispatcher = SlowDispatcher()
+        dispatcher.full = True
+        coalescer = CartCoalescer(dispatcher, flush_at_exit=False)
+        self.pte.set_cart_coalescer(coalescer)
+        try:
+            self.update_cart(1)
+            coalescer.flush()
+            self.assertEqual(0, coalescer.sent)
+            dispatcher.full = False
+            self.assertTrue(self.update_cart(1), "Dropped cart not retried")
+            coalescer.flush()
+            self.assertEqual(1, coalescer.sent)
+            self.assertEqual(1, len(dispatcher.query_strings))
+        finally:
+            coalescer.close()
+
+    def test_order_waits_for_worker(self):
+        """
+        An order that comes in while the worker adds the cart update goes
+        after it
+        """
+        dispatcher = SlowDispatcher()
+        coalescer = CartCoalescer(dispatcher, window=0.01,
+                                  flush_at_exit=False)
+        self.pte.set_dispatcher(dispatcher)
+        self.pte.set_cart_coalescer(coalescer)
+        try:
+            self.update_cart(1)
+            self.assertTrue(dispatcher.adding.wait(2))
+            self.pte.add_ecommerce_item('sku', 'Product', price=10,
+                                        quantity=1)
+            self.pte.do_track_ecommerce_order('order', 10)
+            self.assertEqual(2, len(dispatcher.query_strings))
+            self.assertTrue('ec_id=order' in dispatcher.query_strings[1])
+        finally:
+            coalescer.close()
+
+    def test_order_flushes_cart(self):
+        other = self.get_tracker()
+        self.update_cart(2)
+        self.update_cart(3, other)
+        self.pte.add_ecommerce_item('sku', 'Product', price=10, quantity=2)
+        self.pte.do_track_ecommerce_order('order', 20)
+        query_strings = self.dispatcher.query_strings
+        self.assertEqual(2, len(query_strings))
+        self.assertFalse('ec_id' in query_strings[0])
+        self.assertTrue('ec_id=order' in query_strings[1])
+        self.assertEqual(1, self.coalescer.pending())
+
+    def test_visitor_cookie(self):
+        """
+        Every request of a visitor gets a new tracker, the updates and the
+        order are matched by the visitor ID of the _pk_id cookie
+        """
+        meta = dict(self.request.META,
+                    HTTP_COOKIE='_pk_id.1.1fff=0123456789abcdef.1360000000')
+        for quantity in range(1, 4):
+            self.update_cart(quantity,
+                             self.get_tracker(FakeRequest(dict(meta))))
+        self.assertEqual(1, self.coalescer.pending())
+        self.assertEqual(2, self.coalescer.coalesced)
+        pte = self.get_tracker(FakeRequest(dict(meta)))
+        pte.add_ecommerce_item('sku', 'Product', price=10, quantity=3)
+        pte.do_track_ecommerce_order('order', 30)
+        query_strings = self.dispatcher.query_strings
+        self.assertEqual(0, self.coalescer.pending())
+        self.assertEqual(2, len(query_strings))
+        self.assertTrue('revenue=30' in query_strings[0])
+        self.assertFalse('ec_id' in query_strings[0])
+        self.assertTrue('ec_id=order' in query_strings[1])
+
+    @unittest.skipIf(not hasattr(atexit, 'unregister'),
+                     "atexit.unregister() is new in Python 3")
+    def test_closed_coalescer_is_released(self):
+        coalescer = CartCoalescer(self.dispatcher)
+        coalescer.close()
+        ref = weakref.ref(coalescer)
+        del coalescer
+        deadline = time.time() + 2
+        while ref() is not None and time.time() < deadline:
+            time.sleep(0.01)
+            gc.collect()
+        self.assertEqual(None, ref(), "Closed coalescer still referenced")
+
+    def test_window(self):
+        coalescer = CartCoalescer(self.dispatcher, window=0.05,
+                                  flush_at_exit=False)
+        self.pte.set_cart_coalescer(coalescer)
+        try:
+            self.update_cart(1)
+            self.update_cart(2)
+            deadline = time.time() + 2
+            while not self.dispatcher.query_strings and \
+                    time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(1, len(self.dispatcher.query_strings))
+            self.assertEqual(1, coalescer.sent)
+        finally:
+            coalescer.close()
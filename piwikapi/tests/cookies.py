@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+from piwikapi.cookies import VisitorCookieJar
+from piwikapi.exceptions import ConfigurationError
+from piwikapi.template import PiwikTrackerTemplate
+from piwikapi.tracking import PiwikTracker
+from piwikapi.transport import HTTPConnectionPool
+
+from request import FakeRequest
+from server import GIF
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class CookieTestCase(TrackerBaseTestCase):
+    """
+    First party cookie tests
+    """
+    VISITOR_ID = '0123456789abcdef'
+
+    def setUp(self):
+        super(CookieTestCase, self).setUp()
+        self.pt = PiwikTracker(1, self.request)
+
+    def set_cookies(self, cookies):
+        """
+        Set the cookies of a new request, as COOKIES and as Cookie header
+        """
+        header = '; '.join('%s=%s' % (name, quote(value))
+                           for name, value in sorted(cookies.items()))
+        meta = dict(self.request.META, HTTP_COOKIE=header)
+        request = FakeRequest(meta)
+        request.COOKIES = cookies
+        self.pt._set_request(request)
+        header_request = FakeRequest(meta)
+        self.header_pt = PiwikTracker(1, header_request)
+
+    def test_visitor_id(self):
+        self.set_cookies({
+            '_pk_id.2.1fff': 'fedcba9876543210.1360000000.1.',
+            '_pk_id.1.1fff': '%s.1360000000.3.1360000300.1360000100.' %
+                self.VISITOR_ID,
+        })
+        for tracker in (self.pt, self.header_pt):
+            self.assertEqual(self.VISITOR_ID, tracker.get_visitor_id())
+            info = tracker.get_visitor_info()
+            self.assertEqual(3, info['visit_count'])
+            self.assertEqual(1360000000, info['created'])
+            self.assertEqual(1360000300, info['current_visit'])
+            self.assertEqual(1360000100, info['last_visit'])
+            self.assertEqual(None, info['last_ecommerce_order'])
+        self.pt.set_visitor_id('00000000000000aa')
+        self.assertEqual('00000000000000aa', self.pt.get_visitor_id())
+
+    def test_invalid_visitor_id(self):
+        for value in ('abc.1360000000', 'zzzzzzzzzzzzzzzz.1', ''):
+            self.set_cookies({'_pk_id.1.1fff': value})
+            self.assertFalse(self.pt.get_visitor_info())
+            self.assertEqual(self.pt.visitor_id, self.pt.get_visitor_id())
+
+    def test_no_cookies(self):
+        self.assertFalse(self.pt.get_visitor_info())
+        self.assertEqual(self.pt.visitor_id, self.pt.get_visitor_id())
+        self.assertFalse(self.pt.get_attribution_info())
+        self.assertFalse(self.pt.get_custom_variable(1))
+
+    def test_custom_variable(self):
+        self.set_cookies({
+            '_pk_cvar.1.1fff': json.dumps({'1': ['name', 'value ü'],
+                                           '2': ['broken']}),
+        })
+        for tracker in (self.pt, self.header_pt):
+            self.assertEqual(['name', 'value ü'],
+                             tracker.get_custom_variable(1))
+            self.assertFalse(tracker.get_custom_variable(2))
+            self.assertFalse(tracker.get_custom_variable(3))
+        self.pt.set_custom_variable(1, 'set', 'here')
+        self.assertEqual(('set', 'here'), self.pt.get_custom_variable(1))
+
+    def test_invalid_custom_variable(self):
+        self.set_cookies({'_pk_cvar.1.1fff': '{broken'})
+        self.assertFalse(self.pt.get_custom_variable(1))
+        self.set_cookies({'_pk_cvar.1.1fff': '[]'})
+        self.assertFalse(self.pt.get_custom_variable(1))
+
+    def test_attribution_info(self):
+        ref = json.dumps(['campaign', 'keyword', 1360000000,
+                          'http://referer.example.com/'])
+        self.set_cookies({'_pk_ref.1.1fff': ref})
+        self.assertEqual(ref, self.pt.get_attribution_info())
+        self.assertEqual(ref, self.header_pt.get_attribution_info())
+        self.set_cookies({'_pk_ref.1.1fff': 'not json'})
+        self.assertFalse(self.pt.get_attribution_info())
+
+    def test_new_request(self):
+        self.set_cookies({'_pk_id.1.1fff': '%s.1360000000' % self.VISITOR_ID})
+        self.assertEqual(self.VISITOR_ID, self.pt.get_visitor_id())
+        self.set_cookies({})
+        self.assertEqual(self.pt.visitor_id, self.pt.get_visitor_id())
+
+
+class CookieJarTestCase(TrackerBaseTestCase):
+    """
+    Tests for the cookies Piwik sets, against a local server
+    """
+    def setUp(self):
+        super(CookieJarTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.responder = self.respond
+        self.server.start()
+        self.pool = HTTPConnectionPool()
+        self.pt = PiwikTracker(1, self.request)
+        self.pt.set_api_url(self.server.url())
+        self.pt.set_transport(self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def respond(self, request):
+        cookie = '_pk_uid=%d' % len(self.server.requests)
+        return 200, [('Set-Cookie', 'XDEBUG_SESSION=1; path=/'),
+                     ('Set-Cookie', cookie + '; expires=Thu, 01 Jan 2099 '
+                      '00:00:00 GMT; path=/'),
+                     ('Content-Type', 'image/gif')], GIF
+
+    def get_cookies(self):
+        return [request.get_header('Cookie')
+                for request in self.server.requests]
+
+    def test_replay(self):
+        self.pt.do_track_page_view('first')
+        self.pt.do_track_page_view('second')
+        self.pt.do_track_page_view('third')
+        self.assertEqual([None, '_pk_uid=1', '_pk_uid=2'],
+                         self.get_cookies())
+
+    def test_per_visitor(self):
+        self.pt.set_visitor_id('00000000000000aa')
+        self.pt.do_track_page_view('first')
+        self.pt.set_visitor_id('00000000000000bb')
+        self.pt.do_track_page_view('second')
+        self.pt.set_visitor_id('00000000000000aa')
+        self.pt.do_track_page_view('third')
+        self.assertEqual([None, None, '_pk_uid=1'], self.get_cookies())
+
+    def test_disable_cookie_support(self):
+        self.pt.do_track_page_view('first')
+        self.pt.disable_cookie_support()
+        self.pt.do_track_page_view('second')
+        self.pt.do_track_page_view('third')
+        self.assertEqual([None, None, None], self.get_cookies())
+        self.assertEqual(None, self.pt.cookie_jar)
+
+    def test_shared_jar(self):
+        jar = VisitorCookieJar()
+        template = PiwikTrackerTemplate(1, self.server.url(),
+                                        transport=self.pool, cookie_jar=jar)
+        for title in ('first', 'second'):
+            pt = template.get_tracker(self.request)
+            pt.set_visitor_id('00000000000000aa')
+            pt.do_track_page_view(title)
+        self.assertEqual([None, '_pk_uid=1'], self.get_cookies())
+        self.assertEqual(1, len(jar))
+
+    def test_shared_jar_visitor_cookie(self):
+        """
+        Every request gets a new tracker, the cookie is replayed for the
+        visitor ID of the _pk_id cookie
+        """
+        jar = VisitorCookieJar()
+        template = PiwikTrackerTemplate(1, self.server.url(),
+                                        transport=self.pool, cookie_jar=jar)
+        meta = dict(self.request.META,
+                    HTTP_COOKIE='_pk_id.1.1fff=0123456789abcdef.1360000000')
+        for title in ('first', 'second'):
+            pt = template.get_tracker(FakeRequest(dict(meta)))
+            pt.do_track_page_view(title)
+        self.assertEqual([None, '_pk_uid=1'], self.get_cookies())
+        self.assertEqual(1, len(jar))
+
+    def test_lru(self):
+        jar = VisitorCookieJar(max_visitors=2)
+        jar.set('a', 'c=1')
+        jar.set('b', 'c=2')
+        self.assertEqual('c=1', jar.get('a'))
+        jar.set('c', 'c=3')
+        self.assertEqual(None, jar.get('b'))
+        self.assertEqual('c=1', jar.get('a'))
+        self.assertEqual(2, len(jar))
+        jar.clear()
+        self.assertEqual(0, len(jar))
+        self.assertRaises(ConfigurationError, VisitorCookieJar, 0)
+
+    def test_get_cookie(self):
+        self.assertEqual(None, VisitorCookieJar.get_cookie([]))
+        self.assertEqual('a=b', VisitorCookieJar.get_cookie(
+            ['x=y; path=/', ' a=b ; HttpOnly']))
@@ -0,0 +1,98 @@
+import time
+
+from piwikapi.dedup import HitDeduplicator
+from piwikapi.dedup import RotatingBloomFilter
+from piwikapi.exceptions import ConfigurationError
+from piwikapi.tracking import PiwikTrackerEcommerce
+from piwikapi.tracking import TrackingEvent
+
+from request import FakeRequest
+from sampling import CollectingDispatcher
+from tracking import TrackerBaseTestCase
+
+
+class DeduplicatorTestCase(TrackerBaseTestCase):
+    """
+    HitDeduplicator and RotatingBloomFilter tests
+    """
+    def setUp(self):
+        super(DeduplicatorTestCase, self).setUp()
+        self.dispatcher = CollectingDispatcher()
+        self.deduplicator = HitDeduplicator(max_orders=2)
+        self.pte = PiwikTrackerEcommerce(1, self.request)
+        self.pte.set_dispatcher(self.dispatcher)
+        self.pte.set_deduplicator(self.deduplicator)
+
+    def test_page_views(self):
+        self.assertTrue(self.pte.do_track_page_view('first'))
+        self.assertFalse(self.pte.do_track_page_view('reload'))
+        self.pte.set_url('http://example.com/other/')
+        self.assertTrue(self.pte.do_track_page_view('other page'))
+        self.pte.visitor_id = '0123456789abcdef'
+        self.assertTrue(self.pte.do_track_page_view('other visitor'))
+        self.assertEqual(3, len(self.dispatcher.query_strings))
+
+    def test_reload_with_visitor_cookie(self):
+        """
+        A reload comes in a new request and gets a new tracker, the
+        deduplicator must go by the visitor ID of the _pk_id cookie
+        """
+        meta = dict(self.request.META,
+                    HTTP_COOKIE='_pk_id.1.1fff=0123456789abcdef.1360000000')
+        results = []
+        for i in range(2):
+            pte = PiwikTrackerEcommerce(1, FakeRequest(dict(meta)))
+            pte.set_dispatcher(self.dispatcher)
+            pte.set_deduplicator(self.deduplicator)
+            results.append(pte.do_track_page_view('page'))
+        self.assertEqual([True, False], results)
+        self.assertEqual(1, len(self.dispatcher.query_strings))
+
+    def test_actions(self):
+        url = 'http://example.com/file.zip'
+        self.assertTrue(self.pte.do_track_action(url, 'download'))
+        self.assertTrue(self.pte.do_track_action(url, 'link'))
+        self.assertFalse(self.pte.do_track_action(url, 'download'))
+        self.assertEqual(None, self.pte.capture_action(url, 'link'))
+
+    def test_orders(self):
+        self.assertTrue(self.pte.do_track_ecommerce_order('1', 10))
+        self.assertFalse(self.pte.do_track_ecommerce_order('1', 10))
+        self.assertTrue(self.pte.do_track_ecommerce_order('2', 10))
+        self.assertTrue(self.pte.do_track_ecommerce_order('3', 10))
+        # Only the last two order IDs are remembered
+        self.assertTrue(self.pte.do_track_ecommerce_order('1', 10))
+        self.assertTrue(self.pte.do_track_goal(1))
+        self.assertTrue(self.pte.do_track_goal(1))
+        self.assertEqual({'checked': 5, TrackingEvent.PAGE_VIEW: 0,
+                          TrackingEvent.ACTION: 0, TrackingEvent.ORDER: 1},
+                         self.deduplicator.stats())
+
+    def test_error_rate(self):
+        bloom = RotatingBloomFilter(capacity=10000, error_rate=0.01)
+        for i in range(10000):
+            bloom.add(('added %d' % i).encode('ascii'))
+        false_positives = sum(bloom.add(('new %d' % i).encode('ascii'))
+                              for i in range(2000))
+        # The full filter became the previous one
+        self.assertTrue(false_positives < 60,
+                        "%d false positives" % false_positives)
+        self.assertEqual(95856, bloom.size)
+        self.assertEqual(7, bloom.hashes)
+
+    def test_window(self):
+        bloom = RotatingBloomFilter(capacity=100, window=0.05)
+        self.assertFalse(bloom.add(b'key'))
+        time.sleep(0.06)
+        self.assertTrue(bloom.add(b'key'), "Forgot key too early")
+        time.sleep(0.11)
+        self.assertFalse(bloom.add(b'key'), "Key not forgotten")
+
+    def test_capacity(self):
+        bloom = RotatingBloomFilter(capacity=10)
+        for i in range(30):
+            bloom.add(('%d' % i).encode('ascii'))
+        self.assertFalse(bloom.add(b'0'), "Old keys kept")
+        self.assertTrue(bloom.add(b'29'))
+        self.assertRaises(ConfigurationError, RotatingBloomFilter,
+                          error_rate=1)
@@ -0,0 +1,146 @@
+import atexit
+import gc
+import threading
+import time
+import unittest
+import weakref
+try:
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from urlparse import parse_qs, urlparse
+
+from piwikapi.dispatch import PiwikDispatcher
+from piwikapi.exceptions import ConfigurationError
+
+from server import GIF
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class DispatcherTestCase(TrackerBaseTestCase):
+    """
+    PiwikDispatcher tests, against a local server
+    """
+    def setUp(self):
+        super(DispatcherTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.server.stop()
+
+    def get_dispatcher(self, **kwargs):
+        dispatcher = PiwikDispatcher(self.server.url(), shutdown_timeout=None,
+                                     **kwargs)
+        self.pt.set_dispatcher(dispatcher)
+        return dispatcher
+
+    def block_server(self):
+        """
+        Make the server hang until self.release is set
+        """
+        def responder(request):
+            self.release.wait(5)
+            return 200, [], GIF
+        self.server.responder = responder
+
+    def wait_for_requests(self, count):
+        deadline = time.time() + 5
+        while len(self.server.requests) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def get_titles(self):
+        return [parse_qs(urlparse(request.path).query)['action_name'][0]
+                for request in self.server.requests]
+
+    def test_unknown_overflow_policy(self):
+        self.assertRaises(ConfigurationError, PiwikDispatcher,
+                          self.server.url(), overflow='unknown')
+
+    def test_hits_are_sent_in_background(self):
+        dispatcher = self.get_dispatcher()
+        before = int(time.time())
+        self.assertTrue(self.pt.do_track_page_view('background'))
+        self.assertTrue(dispatcher.flush(5), "Hit was not sent")
+        self.assertEqual(1, dispatcher.sent)
+        params = parse_qs(urlparse(self.server.requests[0].path).query)
+        self.assertTrue(before <= int(params['cdt'][0]) <= time.time(),
+                        "Unexpected cdt %s" % params['cdt'])
+        self.assertEqual([self.request.META['HTTP_USER_AGENT']], params['ua'])
+        dispatcher.close()
+
+    def test_drop_newest(self):
+        self.block_server()
+        dispatcher = self.get_dispatcher(workers=1, max_queue=1,
+                                         overflow='drop_newest')
+        self.assertTrue(self.pt.do_track_page_view('first'))
+        self.wait_for_requests(1)
+        self.assertTrue(self.pt.do_track_page_view('second'))
+        self.assertFalse(self.pt.do_track_page_view('third'))
+        self.assertEqual(1, dispatcher.dropped)
+        self.release.set()
+        dispatcher.flush(5)
+        self.assertEqual(['first', 'second'], self.get_titles())
+        dispatcher.close()
+
+    def test_drop_oldest(self):
+        self.block_server()
+        dispatcher = self.get_dispatcher(workers=1, max_queue=1,
+                                         overflow='drop_oldest')
+        self.pt.do_track_page_view('first')
+        self.wait_for_requests(1)
+        self.pt.do_track_page_view('second')
+        self.assertTrue(self.pt.do_track_page_view('third'))
+        self.assertEqual(1, dispatcher.dropped)
+        self.release.set()
+        dispatcher.flush(5)
+        self.assertEqual(['first', 'third'], self.get_titles())
+        dispatcher.close()
+
+    def test_block_timeout(self):
+        self.block_server()
+        dispatcher = self.get_dispatcher(workers=1, max_queue=1,
+                                         overflow='block', block_timeout=0.05)
+        self.pt.do_track_page_view('first')
+        self.wait_for_requests(1)
+        self.pt.do_track_page_view('second')
+        self.assertFalse(self.pt.do_track_page_view('third'))
+        self.assertEqual(1, dispatcher.dropped)
+        dispatcher.close(0)
+
+    def test_close_deadline(self):
+        self.block_server()
+        dispatcher = self.get_dispatcher(workers=1)
+        for i in range(3):
+            self.pt.do_track_page_view('page %d' % i)
+        self.wait_for_requests(1)
+        started = time.time()
+        dispatcher.close(0.1)
+        self.assertTrue(time.time() - started < 1, "close() didn't return")
+        self.assertEqual(2, dispatcher.dropped)
+        self.assertFalse(self.pt.do_track_page_view('closed'))
+
+    @unittest.skipIf(not hasattr(atexit, 'unregister'),
+                     "atexit.unregister() is new in Python 3")
+    def test_closed_dispatcher_is_released(self):
+        dispatcher = PiwikDispatcher(self.server.url(), shutdown_timeout=1)
+        dispatcher.close()
+        ref = weakref.ref(dispatcher)
+        del dispatcher
+        deadline = time.time() + 2
+        while ref() is not None and time.time() < deadline:
+            # The workers hold the dispatcher until they noticed the close
+            time.sleep(0.01)
+            gc.collect()
+        self.assertEqual(None, ref(), "Closed dispatcher still referenced")
+
+    def test_failed_requests_are_counted(self):
+        self.server.responder = lambda request: (500, [], b'')
+        dispatcher = self.get_dispatcher()
+        self.pt.do_track_page_view('failing')
+        dispatcher.flush(5)
+        self.assertEqual(1, dispatcher.failed)
+        self.assertEqual(0, dispatcher.sent)
+        dispatcher.close()
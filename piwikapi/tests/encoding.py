@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import datetime
+import random
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from urllib.parse import urlencode, quote
+except ImportError:
+    from urllib import urlencode, quote
+
+from piwikapi.tracking import PiwikTrackerEcommerce
+
+from tracking import TrackerBaseTestCase
+
+
+def get_request_reference(tracker, id_site):
+    """
+    PiwikTracker._get_request() as it was before the static parameters were
+    cached, everything is encoded at once
+    """
+    query_vars = {
+        'idsite': id_site,
+        'rec': 1,
+        'apiv': tracker.VERSION,
+        'rand': random.randint(0, 99999),
+        'url': tracker.page_url,
+        'urlref': tracker.referer,
+        'id': tracker.visitor_id,
+    }
+    if tracker.ip:
+        query_vars['cip'] = tracker.ip
+    if tracker.token_auth:
+        query_vars['token_auth'] = tracker.token_auth
+    if tracker.has_cookies:
+        query_vars['cookie'] = 1
+    if tracker.width and tracker.height:
+        query_vars['res'] = '%dx%d' % (tracker.width, tracker.height)
+    if tracker.forced_visitor_id:
+        query_vars['cid'] = tracker.forced_visitor_id
+    if tracker.page_custom_var:
+        query_vars['cvar'] = json.dumps(tracker.page_custom_var)
+    if tracker.visitor_custom_var:
+        query_vars['_cvar'] = json.dumps(tracker.visitor_custom_var)
+    for plugin, version in tracker.plugins.items():
+        query_vars[plugin] = version
+    if len(tracker.attribution_info):
+        for i, var in {0: '_rcn', 1: '_rck', 2: '_refts', 3: '_ref'}.items():
+            query_vars[var] = quote(tracker.attribution_info[i])
+    url = urlencode(query_vars)
+    if tracker.debug_append_url:
+        url += tracker.debug_append_url
+    return url
+
+
+class QueryEncodingTestCase(TrackerBaseTestCase):
+    """
+    The cached query string encoding must not change the query strings
+    """
+    def assertSameQuery(self, tracker, id_site=1):
+        random.seed(1)
+        expected = get_request_reference(tracker, id_site)
+        random.seed(1)
+        self.assertEqual(expected, tracker._get_request(id_site))
+
+    def test_default(self):
+        self.pt.visitor_custom_var = {}
+        self.assertSameQuery(self.pt)
+
+    def test_all_parameters(self):
+        self.pt.set_ip('192.0.2.1')
+        self.pt.set_token_auth('token')
+        self.pt.set_browser_has_cookies()
+        self.pt.set_resolution(1024, 768)
+        self.pt.set_visitor_id('0123456789abcdef')
+        self.pt.set_custom_variable(2, 'page', 'ü & =', 'page')
+        self.pt.set_plugins(flash=1, java=0)
+        self.pt.attribution_info = ['campaign', 'key word', '1', 'http://x/']
+        self.pt.set_debug_string_append('&debug=1')
+        self.pt.set_url('http://example.com/päth?a=1&b=2')
+        self.pt.set_url_referer('')
+        self.assertSameQuery(self.pt, 7)
+
+    def test_cache_invalidation(self):
+        self.assertSameQuery(self.pt)
+        self.pt.set_token_auth('token')
+        self.assertSameQuery(self.pt)
+        self.pt.set_resolution(800, 600)
+        self.assertSameQuery(self.pt)
+        self.pt.ip = '192.0.2.2'
+        self.assertSameQuery(self.pt)
+        self.pt.set_plugins(pdf=1)
+        self.assertSameQuery(self.pt)
+        self.assertSameQuery(self.pt, 2)
+
+    def test_ecommerce(self):
+        pte = PiwikTrackerEcommerce(1, self.request)
+        pte.set_ecommerce_view('sku', 'name', ['a', 'b'], 9.99)
+        self.assertSameQuery(pte)
+
+    def test_custom_variable_cache(self):
+        self.assertSameQuery(self.pt)
+        version = self.pt.custom_var_version
+        self.pt.set_custom_variable(2, 'page', 'one', 'page')
+        self.assertEqual(version + 1, self.pt.custom_var_version)
+        self.assertSameQuery(self.pt)
+        self.pt.set_custom_variable(2, 'page', 'one', 'page')
+        self.assertEqual(version + 1, self.pt.custom_var_version,
+                         "Version bumped without a change")
+        self.pt.set_custom_variable(3, 'visit', 'two')
+        self.assertSameQuery(self.pt)
+        self.pt.page_custom_var = {}
+        self.pt.custom_var_version += 1
+        self.assertSameQuery(self.pt)
+
+    def test_ecommerce_view_cache(self):
+        pte = PiwikTrackerEcommerce(1, self.request)
+        pte.set_ecommerce_view('sku', 'name', ['a', 'b'], 9.99)
+        version = pte.custom_var_version
+        pte.set_ecommerce_view('sku', 'name', ['a', 'b'], 9.99)
+        self.assertEqual(version, pte.custom_var_version)
+        self.assertSameQuery(pte)
+        pte.set_ecommerce_view('sku', 'name', ['a', 'c'], 9.99)
+        self.assertEqual(version + 1, pte.custom_var_version)
+        self.assertEqual(('_pkc', '["a", "c"]'), pte.page_custom_var[5])
+        self.assertSameQuery(pte)
+
+    def test_forced_datetime(self):
+        self.pt.set_force_visit_date_time(datetime.datetime(2013, 2, 20, 12))
+        url = self.pt._get_request(1)
+        self.assertTrue(url.endswith('&cdt=1361361600'), url)
+        url = self.pt._get_dispatch_query_string(url)
+        self.assertEqual(1, url.count('cdt='), url)
+        event = self.pt.capture_page_view('past')
+        self.assertEqual(1361361600, event.timestamp)
@@ -0,0 +1,113 @@
+import random
+import time
+
+from piwikapi.bulk import PiwikBulkTracker
+from piwikapi.events import TrackingEventSerializer
+from piwikapi.exceptions import InvalidParameter
+from piwikapi.tracking import PiwikTracker
+from piwikapi.tracking import PiwikTrackerEcommerce
+from piwikapi.tracking import TrackingEvent
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class TrackingEventTestCase(TrackerBaseTestCase):
+    """
+    TrackingEvent and TrackingEventSerializer tests
+    """
+    def setUp(self):
+        super(TrackingEventTestCase, self).setUp()
+        self.pte = PiwikTrackerEcommerce(1, self.request)
+        self.pte.set_token_auth('token')
+        self.pte.set_custom_variable(1, 'plan', 'premium')
+        self.serializer = TrackingEventSerializer()
+
+    def assertSameQuery(self, event, url):
+        random.seed(1)
+        query_string = self.serializer.serialize(event)
+        random.seed(1)
+        expected = self.pte._get_bulk_query_string(url())
+        expected += '&cdt=%d' % event.timestamp
+        self.assertEqual(expected, query_string)
+
+    def test_page_view(self):
+        event = self.pte.capture_page_view('title')
+        self.assertEqual(TrackingEvent.PAGE_VIEW, event.kind)
+        self.assertTrue(event.timestamp <= time.time())
+        self.assertSameQuery(event, lambda: self.pte._get_event_url(
+            event.kind, event.arguments))
+
+    def test_action(self):
+        event = self.pte.capture_action('http://example.com/', 'link')
+        self.assertSameQuery(event, lambda: self.pte._get_event_url(
+            event.kind, event.arguments))
+        self.assertRaises(InvalidParameter, self.pte.capture_action,
+                          'http://example.com/', 'foo')
+
+    def test_goal(self):
+        event = self.pte.capture_goal(1, 10)
+        self.assertSameQuery(event, lambda: self.pte._get_event_url(
+            event.kind, event.arguments))
+
+    def test_order(self):
+        self.pte.add_ecommerce_item('sku1', 'one', price=10, quantity=2)
+        self.pte.add_ecommerce_item('sku2', 'two', price=5)
+        event = self.pte.capture_ecommerce_order('order1', 25, 20, 5)
+        self.assertEqual({}, self.pte.ecommerce_items, "Items not taken")
+        self.assertEqual(2, len(event.ecommerce_items))
+        query_string = self.serializer.serialize(event)
+        self.assertTrue('ec_id=order1' in query_string)
+        self.assertTrue('sku1' in query_string and 'sku2' in query_string)
+        self.assertEqual(query_string.count('sku'),
+                         self.serializer.serialize(event).count('sku'))
+
+    def test_cart_update(self):
+        self.pte.add_ecommerce_item('sku1', 'one', price=10)
+        event = self.pte.capture_ecommerce_cart_update(10)
+        self.assertTrue('sku1' in self.serializer.serialize(event))
+
+    def test_state_is_captured(self):
+        event = self.pte.capture_page_view('before')
+        self.pte.set_custom_variable(1, 'plan', 'free')
+        self.pte.set_url('http://example.com/after/')
+        query_string = self.serializer.serialize(event)
+        self.assertTrue('premium' in query_string)
+        self.assertFalse('after' in query_string)
+
+    def test_custom_variables_change(self):
+        first = self.pte.capture_page_view('first')
+        self.pte.set_custom_variable(1, 'plan', 'free')
+        second = self.pte.capture_page_view('second')
+        self.assertTrue('premium' in self.serializer.serialize(first))
+        query_string = self.serializer.serialize(second)
+        self.assertTrue('free' in query_string)
+        self.assertFalse('premium' in query_string)
+
+    def test_immutable(self):
+        event = self.pte.capture_page_view('title')
+        self.assertRaises(AttributeError, setattr, event, 'kind', 'goal')
+        self.assertRaises(AttributeError, setattr, event, 'foo', 1)
+
+    def test_tracker_class(self):
+        pt = PiwikTracker(1, self.request)
+        serializer = TrackingEventSerializer(PiwikTracker)
+        self.assertRaises(InvalidParameter, serializer.serialize,
+                          self.pte.capture_goal(1))
+        self.assertTrue('action_name=title' in
+                        serializer.serialize(pt.capture_page_view('title')))
+
+    def test_send(self):
+        server = RecordingServer()
+        server.start()
+        try:
+            bulk = PiwikBulkTracker(server.url(), max_age=None)
+            events = [self.pte.capture_page_view('page %d' % i)
+                      for i in range(3)]
+            results = self.serializer.send(events, bulk)
+            bulk.flush()
+            for result in results:
+                self.assertTrue(result.get(1))
+            self.assertEqual(3, len(server.requests[0].json()['requests']))
+        finally:
+            server.stop()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from piwikapi.bulk import PiwikBulkTracker
+from piwikapi.exceptions import ConfigurationError
+from piwikapi.exceptions import InvalidParameter
+from piwikapi.fanout import SiteFanOut
+from piwikapi.tracking import PiwikTrackerEcommerce
+
+from sampling import CollectingDispatcher
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class SiteFanOutTestCase(TrackerBaseTestCase):
+    """
+    SiteFanOut tests, against a local server
+    """
+    def setUp(self):
+        super(SiteFanOutTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.bulk = PiwikBulkTracker(self.server.url(), 'bulktoken',
+                                     max_age=None)
+        self.pte = PiwikTrackerEcommerce(1, self.request)
+        self.pte.set_token_auth('sitetoken')
+        self.pte.set_custom_variable(1, 'Server', 'web1')
+        self.pte.set_custom_variable(2, 'Section', 'news', 'page')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_hits(self, query_strings):
+        return [dict((name, values[0]) for name, values in
+                     parse_qs(query_string.lstrip('?')).items())
+                for query_string in query_strings]
+
+    def test_one_bulk_request(self):
+        fan_out = SiteFanOut([3, 1], self.bulk)
+        results = fan_out.send(self.pte.capture_page_view('title'))
+        self.assertEqual(2, len(results))
+        self.assertTrue(all(result.get(1) for result in results))
+        self.assertEqual(1, len(self.server.requests))
+        data = self.server.requests[0].json()
+        first, second = self.get_hits(data['requests'])
+        self.assertEqual('3', first.pop('idsite'))
+        self.assertEqual('1', second.pop('idsite'))
+        first.pop('rand')
+        second.pop('rand')
+        self.assertEqual(first, second)
+        self.assertEqual('title', first['action_name'])
+
+    def test_queued_hits_are_sent(self):
+        self.pt.set_bulk_tracker(self.bulk)
+        self.pt.do_track_page_view('queued')
+        fan_out = SiteFanOut([3, 1], self.bulk)
+        fan_out.send(self.pte.capture_page_view('title'))
+        self.assertEqual(0, self.bulk.pending())
+        self.assertEqual(1, len(self.server.requests))
+        self.assertEqual(3, len(self.server.requests[0].json()['requests']))
+
+    def test_overrides(self):
+        dispatcher = CollectingDispatcher()
+        fan_out = SiteFanOut([3, 1], dispatcher)
+        fan_out.set_token_auth(3, 'brandtoken')
+        fan_out.set_custom_variable(3, 1, 'Brand', 'shoes')
+        fan_out.set_custom_variable(3, 3, 'Shop', 'b ü', 'page')
+        fan_out.send(self.pte.capture_page_view('title'))
+        brand, rollup = self.get_hits(dispatcher.query_strings)
+        self.assertEqual('brandtoken', brand['token_auth'])
+        self.assertEqual('sitetoken', rollup['token_auth'])
+        self.assertEqual({'1': ['Brand', 'shoes']},
+                         json.loads(brand['_cvar']))
+        self.assertEqual({'1': ['Server', 'web1']},
+                         json.loads(rollup['_cvar']))
+        self.assertEqual({'2': ['Section', 'news'], '3': ['Shop', 'b ü']},
+                         json.loads(brand['cvar']))
+        self.assertEqual({'2': ['Section', 'news']},
+                         json.loads(rollup['cvar']))
+
+    def test_missing_parameters_are_added(self):
+        pte = PiwikTrackerEcommerce(1, self.request)
+        dispatcher = CollectingDispatcher()
+        fan_out = SiteFanOut([2], dispatcher)
+        fan_out.set_token_auth(2, 'brandtoken')
+        fan_out.set_custom_variable(2, 1, 'Brand', 'shoes')
+        fan_out.send(pte.capture_page_view('title'))
+        hit, = self.get_hits(dispatcher.query_strings)
+        self.assertEqual('brandtoken', hit['token_auth'])
+        self.assertEqual({'1': ['Brand', 'shoes']}, json.loads(hit['_cvar']))
+
+    def test_order(self):
+        dispatcher = CollectingDispatcher()
+        fan_out = SiteFanOut([3, 1], dispatcher)
+        self.pte.add_ecommerce_item('sku1', 'Item', 'Category', 10, 2)
+        fan_out.send(self.pte.capture_ecommerce_order('order1', 20))
+        for hit in self.get_hits(dispatcher.query_strings):
+            self.assertEqual('order1', hit['ec_id'])
+            self.assertEqual('sku1', json.loads(hit['ec_items'])[0][0])
+
+    def test_dropped_and_invalid(self):
+        fan_out = SiteFanOut([3, 1], self.bulk)
+        self.assertEqual([], fan_out.send(None))
+        self.assertEqual([], self.server.requests)
+        self.assertRaises(ConfigurationError, SiteFanOut, [], self.bulk)
+        self.assertRaises(InvalidParameter, fan_out.set_custom_variable,
+                          3, 1, 'Brand', 'shoes', 'hit')
+        self.assertRaises(InvalidParameter, fan_out.set_custom_variable,
+                          3, '1', 'Brand', 'shoes')
@@ -0,0 +1,128 @@
+import datetime
+import io
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from piwikapi.exceptions import ConfigurationError
+from piwikapi.importlog import LogImporter
+from piwikapi.importlog import LogParser
+from piwikapi.importlog import parse_date
+from piwikapi.importlog import read_chunks
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+LINE = '%s - - [20/Feb/2013:12:00:%02d +0100] "GET %s HTTP/1.1" %d 100 ' \
+    '"%s" "%s"\n'
+
+LOG = ''.join([
+    LINE % ('192.0.2.1', 0, '/a/', 200, '-', 'Agent 1'),
+    LINE % ('192.0.2.2', 1, '/b/?q=1', 200, 'http://example.com/', 'Agent 2'),
+    LINE % ('192.0.2.1', 2, '/missing/', 404, '-', 'Agent 1'),
+    'not a log line\n',
+    LINE % ('192.0.2.1', 3, '/c/', 200, '-', 'Agent 1'),
+    LINE % ('192.0.2.1', 4, '/static/app.js', 200, '-', 'Agent 1'),
+    LINE % ('192.0.2.1', 5, '/d/', 200, '-', 'Agent 1'),
+]).encode('ascii')
+
+
+class LogImportTestCase(TrackerBaseTestCase):
+    """
+    Access log importer tests, against a local server
+    """
+    def setUp(self):
+        super(LogImportTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.reports = []
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_importer(self, **kwargs):
+        options = {
+            'processes': 0,
+            'shards': 2,
+            'max_hits': 2,
+            'chunk_lines': 2,
+            'exclude_path': '/static/',
+            'report': self.reports.append,
+        }
+        options.update(kwargs)
+        return LogImporter(self.server.url(), 1, 'token', 'www.example.com',
+                           **options)
+
+    def get_hits(self):
+        hits = []
+        for request in self.server.requests:
+            data = request.json()
+            self.assertEqual('token', data['token_auth'])
+            hits.extend(parse_qs(hit[1:]) for hit in data['requests'])
+        return hits
+
+    def assertImported(self, stats):
+        self.assertEqual(7, stats['lines'])
+        self.assertEqual(4, stats['hits'])
+        self.assertEqual(1, stats['invalid'])
+        self.assertEqual(2, stats['skipped'])
+        self.assertEqual(0, stats['failed'])
+        self.assertEqual(len(LOG), stats['offset'])
+        hits = self.get_hits()
+        self.assertEqual(4, len(hits))
+        visitor = [hit for hit in hits if hit['ua'] == ['Agent 1']]
+        self.assertEqual(['http://www.example.com/a/',
+                          'http://www.example.com/c/',
+                          'http://www.example.com/d/'],
+                         [hit['url'][0] for hit in visitor])
+        self.assertEqual(['1361358000', '1361358003', '1361358005'],
+                         [hit['cdt'][0] for hit in visitor])
+        self.assertEqual(1, len(set(hit['id'][0] for hit in visitor)))
+        self.assertEqual(['192.0.2.1'], visitor[0]['cip'])
+
+    def test_import(self):
+        stats = self.get_importer().run(io.BytesIO(LOG))
+        self.assertImported(stats)
+        self.assertEqual([stats], self.reports)
+
+    def test_process_pool(self):
+        stats = self.get_importer(processes=2).run(io.BytesIO(LOG))
+        self.assertImported(stats)
+
+    def test_resume(self):
+        offset = LOG.index(b'not a log line')
+        stream = io.BytesIO(LOG)
+        stream.seek(offset)
+        stats = self.get_importer().run(stream, offset)
+        self.assertEqual(4, stats['lines'])
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(len(LOG), stats['offset'])
+
+    def test_progress_reports(self):
+        importer = self.get_importer(report_interval=0)
+        importer.run(io.BytesIO(LOG))
+        self.assertTrue(len(self.reports) > 1)
+        self.assertEqual(sorted(report['offset'] for report in self.reports),
+                         [report['offset'] for report in self.reports])
+
+    def test_incomplete_line(self):
+        chunks = list(read_chunks(io.BytesIO(b'one\ntwo\nthr'), 1))
+        self.assertEqual([(4, [b'one\n']), (8, [b'two\n'])], chunks)
+
+    def test_parse_date(self):
+        self.assertEqual(datetime.datetime(2000, 10, 10, 20, 55, 36),
+                         parse_date('10/Oct/2000:13:55:36 -0700'))
+        self.assertRaises(ValueError, parse_date, '10/Foo/2000:13:55:36')
+
+    def test_common_format(self):
+        parser = LogParser(1, 'example.com', 'common', https=True)
+        shard, query_string = parser.parse_line(
+            '192.0.2.1 - - [20/Feb/2013:12:00:00 +0000] "GET / HTTP/1.0" '
+            '200 1')
+        self.assertEqual(0, shard)
+        self.assertEqual(['https://example.com/'],
+                         parse_qs(query_string)['url'])
+        self.assertRaises(ConfigurationError, LogParser, 1, 'example.com',
+                          'foo')
@@ -0,0 +1,152 @@
+import socket
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError
+
+from piwikapi.analytics import PiwikAnalytics
+from piwikapi.bulk import PiwikBulkTracker
+from piwikapi.dispatch import PiwikDispatcher
+from piwikapi.metrics import InMemoryMetrics
+from piwikapi.metrics import StatsdMetrics
+from piwikapi.sampling import VisitorSampler
+from piwikapi.tracking import PiwikTrackerEcommerce
+from piwikapi.transport import HTTPConnectionPool
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class MetricsTestCase(TrackerBaseTestCase):
+    """
+    Metrics tests, against a local server
+    """
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.pool = HTTPConnectionPool()
+        self.metrics = InMemoryMetrics()
+        self.pte = PiwikTrackerEcommerce(1, self.request)
+        self.pte.set_api_url(self.server.url())
+        self.pte.set_transport(self.pool)
+        self.pte.set_metrics(self.metrics)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_direct_requests(self):
+        self.pte.do_track_page_view('page')
+        self.pte.do_track_goal(1, 10)
+        self.assertEqual(1, self.metrics.get_counter(
+            'tracking.hits.page_view'))
+        self.assertEqual(1, self.metrics.get_counter('tracking.hits.goal'))
+        histogram = self.metrics.get_histogram('tracking.latency')
+        self.assertEqual(2, histogram['count'])
+        self.assertEqual(2, sum(count for bound, count
+                                in histogram['buckets']))
+        sent = sum(len(request.path) for request in self.server.requests)
+        self.assertTrue(self.metrics.get_counter('tracking.bytes_sent') >=
+                        sent - 2 * len('/piwik.php?'))
+        self.assertTrue(self.metrics.get_counter('tracking.bytes_encoded'))
+
+    def test_errors(self):
+        self.server.responder = lambda request: (500, [], b'Error')
+        self.assertRaises(HTTPError, self.pte.do_track_page_view, 'page')
+        self.assertEqual(1, self.metrics.get_counter(
+            'tracking.errors.HTTPError'))
+        self.assertEqual(None, self.metrics.get_histogram('tracking.latency'))
+
+    def test_dropped(self):
+        self.pte.set_sampler(VisitorSampler(0))
+        self.assertFalse(self.pte.do_track_page_view('page'))
+        self.assertTrue(self.pte.do_track_ecommerce_order('order1', 10))
+        self.assertEqual(1, self.metrics.get_counter(
+            'tracking.dropped.page_view'))
+        self.assertEqual(0, self.metrics.get_counter('tracking.dropped.order'))
+        self.assertEqual(1, self.metrics.get_counter('tracking.hits.order'))
+
+    def test_dispatcher(self):
+        dispatcher = PiwikDispatcher(self.server.url(), workers=1,
+                                     max_queue=1, overflow='drop_newest',
+                                     shutdown_timeout=None,
+                                     transport=self.pool,
+                                     metrics=self.metrics)
+        self.pte.set_dispatcher(dispatcher)
+        for i in range(10):
+            self.pte.do_track_page_view('page %d' % i)
+        dispatcher.flush()
+        dispatcher.close()
+        self.assertEqual(dispatcher.sent,
+                         self.metrics.get_counter('dispatch.sent'))
+        self.assertEqual(dispatcher.dropped,
+                         self.metrics.get_counter('dispatch.dropped'))
+        self.assertEqual(0, self.metrics.get_gauge('dispatch.queue_depth'))
+        self.assertEqual(dispatcher.sent,
+                         self.metrics.get_histogram('dispatch.latency')[
+                             'count'])
+
+    def test_bulk(self):
+        bulk = PiwikBulkTracker(self.server.url(), max_hits=2, max_age=None,
+                                transport=self.pool, metrics=self.metrics)
+        self.pte.set_bulk_tracker(bulk)
+        self.pte.do_track_page_view('first')
+        self.assertEqual(1, self.metrics.get_gauge('bulk.pending'))
+        self.pte.do_track_page_view('second')
+        self.assertEqual(0, self.metrics.get_gauge('bulk.pending'))
+        self.assertEqual(1, self.metrics.get_counter('bulk.requests'))
+        self.assertEqual(2, self.metrics.get_counter('bulk.hits'))
+        self.assertEqual(len(self.server.requests[0].body),
+                         self.metrics.get_counter('bulk.bytes_sent'))
+        self.assertEqual(1, self.metrics.get_histogram('bulk.latency')[
+            'count'])
+
+    def test_analytics(self):
+        self.server.responder = lambda request: (
+            200, [('Content-Type', 'application/json')], b'{"value": 1}')
+        a = PiwikAnalytics()
+        a.set_api_url(self.server.url('/index.php'))
+        a.set_method('API.getPiwikVersion')
+        a.set_transport(self.pool)
+        a.set_metrics(self.metrics)
+        a.send_request()
+        self.assertEqual(1, self.metrics.get_counter('analytics.requests'))
+        self.assertEqual(12, self.metrics.get_counter(
+            'analytics.bytes_received'))
+        self.server.responder = lambda request: (404, [], b'')
+        self.assertRaises(HTTPError, a.send_request)
+        self.assertEqual(1, self.metrics.get_counter(
+            'analytics.errors.HTTPError'))
+
+    def test_histogram_buckets(self):
+        metrics = InMemoryMetrics(buckets=(0.1, 1))
+        for seconds in (0.05, 0.1, 0.5, 2, 3):
+            metrics.timing('latency', seconds)
+        histogram = metrics.get_histogram('latency')
+        self.assertEqual([(0.1, 2), (1, 1), (None, 2)], histogram['buckets'])
+        self.assertEqual(5, histogram['count'])
+        self.assertAlmostEqual(5.65, histogram['sum'])
+        metrics.increment('hits', 2)
+        metrics.gauge('depth', 3)
+        snapshot = metrics.snapshot()
+        self.assertEqual({'hits': 2}, snapshot['counters'])
+        self.assertEqual({'depth': 3}, snapshot['gauges'])
+        self.assertEqual(histogram, snapshot['histograms']['latency'])
+        metrics.reset()
+        self.assertEqual(0, metrics.get_counter('hits'))
+
+    def test_statsd(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        metrics = StatsdMetrics(receiver.getsockname(), prefix='test.')
+        metrics.increment('tracking.hits.page_view')
+        metrics.gauge('dispatch.queue_depth', 4)
+        metrics.timing('tracking.latency', 0.0125)
+        lines = [receiver.recv(1024) for i in range(3)]
+        metrics.close()
+        receiver.close()
+        self.assertEqual([b'test.tracking.hits.page_view:1|c',
+                          b'test.dispatch.queue_depth:4|g',
+                          b'test.tracking.latency:12.500|ms'], lines)
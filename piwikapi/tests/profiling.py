@@ -0,0 +1,117 @@
+import sys
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from piwikapi.profiling import PhaseProfiler
+from piwikapi.sampling import VisitorSampler
+from piwikapi.template import PiwikTrackerTemplate
+from piwikapi.tracking import PiwikTrackerEcommerce
+from piwikapi.transport import HTTPConnectionPool
+
+from sampling import CollectingDispatcher
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class ProfilingTestCase(TrackerBaseTestCase):
+    """
+    PhaseProfiler tests, against a local server
+    """
+    def setUp(self):
+        super(ProfilingTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.profiler = PhaseProfiler(size=4)
+        self.pool = HTTPConnectionPool(profiler=self.profiler)
+        self.pte = PiwikTrackerEcommerce(1, self.request)
+        self.pte.set_api_url(self.server.url())
+        self.pte.set_transport(self.pool)
+        self.pte.set_profiler(self.profiler)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_direct_request(self):
+        self.pte.set_custom_variable(1, 'name', 'value')
+        self.pte.do_track_page_view('first')
+        self.pte.do_track_page_view('second')
+        self.assertEqual(['connect', 'encode', 'filter', 'json', 'read',
+                          'request', 'send', 'total'],
+                         self.profiler.get_phases())
+        self.assertEqual(1, len(self.profiler.get_samples('connect')),
+                         "The connection was not reused")
+        self.assertEqual(1, len(self.profiler.get_samples('json')),
+                         "The custom variables were encoded again")
+        self.assertEqual(2, len(self.profiler.get_samples('total')))
+        total = self.profiler.get_samples('total')[0]
+        self.assertTrue(total >= self.profiler.get_samples('request')[0])
+
+    def test_order(self):
+        self.pte.set_dispatcher(CollectingDispatcher())
+        self.pte.add_ecommerce_item('sku1', 'Item', 'Category', 10, 2)
+        self.pte.do_track_ecommerce_order('order1', 20)
+        self.assertEqual(['encode', 'enqueue', 'filter', 'json', 'total'],
+                         self.profiler.get_phases())
+
+    def test_failed_call(self):
+        """
+        A call that fails while building the query string records nothing
+        and stops its cProfile run
+        """
+        profiler = PhaseProfiler(profile_every=1)
+        self.pte.set_profiler(profiler)
+        self.pte.set_dispatcher(CollectingDispatcher())
+        self.pte.set_custom_variable(1, 'name', object())
+        self.assertRaises(TypeError, self.pte.do_track_page_view, 'fails')
+        self.assertEqual(None, self.pte._phase_timer)
+        self.assertEqual(None, sys.getprofile(), "cProfile still enabled")
+        self.assertEqual([], profiler.get_phases())
+        self.pte.set_custom_variable(1, 'name', 'value')
+        self.pte.do_track_page_view('works')
+        self.assertEqual(1, len(profiler.get_samples('total')))
+
+    def test_dropped_and_captured(self):
+        self.pte.set_sampler(VisitorSampler(0))
+        self.pte.do_track_page_view('dropped')
+        self.assertEqual(['filter', 'total'], self.profiler.get_phases())
+        self.pte.set_sampler(None)
+        self.pte.capture_page_view('captured')
+        self.assertEqual(['capture', 'filter', 'total'],
+                         self.profiler.get_phases())
+        self.assertEqual(2, len(self.profiler.get_samples('total')))
+        self.assertEqual(None, self.pte._phase_timer)
+
+    def test_template(self):
+        template = PiwikTrackerTemplate(1, self.server.url(),
+                                        profiler=self.profiler)
+        template.get_tracker(self.request)
+        self.assertEqual(1, len(self.profiler.get_samples('tracker')))
+
+    def test_ring_buffer(self):
+        for duration in range(1, 11):
+            self.profiler.record('phase', duration * 1000)
+        self.assertEqual([9000, 10000, 7000, 8000],
+                         self.profiler.get_samples('phase'))
+        self.assertEqual({50: 9000, 90: 10000, 99: 10000},
+                         self.profiler.get_percentiles('phase'))
+        report = self.profiler.report()
+        self.assertTrue('phase' in report.splitlines()[1])
+        self.assertTrue('9.0' in report.splitlines()[1])
+        self.profiler.reset()
+        self.assertEqual({}, self.profiler.get_percentiles('phase'))
+
+    def test_cprofile(self):
+        stream = StringIO()
+        profiler = PhaseProfiler(profile_every=2, stream=stream)
+        self.pte.set_profiler(profiler)
+        for i in range(4):
+            self.pte.do_track_page_view('page %d' % i)
+        profiler.dump()
+        report = stream.getvalue()
+        self.assertTrue('total' in report)
+        if 'function calls' not in report:
+            self.skipTest("Another profiler is running")
+        self.assertTrue('_send_request' in report)
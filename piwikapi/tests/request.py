@@ -12,7 +12,7 @@ class FakeRequest:
     #: http://php.net/manual/en/reserved.variables.server.php
     META = {}
 
-    #: Cookies... work in progress
+    #: Cookies, a dict of {name: value} like Django's request.COOKIES
     COOKIES = False
 
     def __init__(self, headers):
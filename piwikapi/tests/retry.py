@@ -0,0 +1,140 @@
+import socket
+import time
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError
+
+from piwikapi.exceptions import CircuitOpenError
+from piwikapi.retry import CircuitBreaker
+from piwikapi.retry import CircuitBreakerRegistry
+from piwikapi.retry import ResilientTransport
+from piwikapi.retry import RetryBudget
+from piwikapi.retry import RetryPolicy
+from piwikapi.transport import HTTPConnectionPool
+
+from server import GIF
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class RetryTestCase(TrackerBaseTestCase):
+    """
+    RetryPolicy, CircuitBreaker and ResilientTransport tests, against a
+    local server
+    """
+    def setUp(self):
+        super(RetryTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.pool = HTTPConnectionPool()
+        self.breakers = CircuitBreakerRegistry(failure_threshold=3,
+                                               recovery_timeout=0.2)
+        self.transport = ResilientTransport(
+            self.pool, RetryPolicy(max_retries=2, backoff_factor=0),
+            self.breakers)
+        self.pt.set_api_url(self.server.url())
+        self.pt.set_transport(self.transport)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def fail_times(self, count, status=503):
+        """
+        Make the server answer the next count requests with status
+        """
+        failures = [count]
+
+        def responder(request):
+            if failures[0]:
+                failures[0] -= 1
+                return status, [], b'down'
+            return 200, [('Content-Type', 'image/gif')], GIF
+        self.server.responder = responder
+
+    def test_retry_until_success(self):
+        self.fail_times(2)
+        self.pt.do_track_page_view('retried')
+        self.assertEqual(3, len(self.server.requests))
+        breaker = self.breakers.get(self.server.url())
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.get_state())
+
+    def test_give_up_after_max_retries(self):
+        self.fail_times(10)
+        self.assertRaises(HTTPError, self.pt.do_track_page_view, 'failed')
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_client_errors_are_not_retried(self):
+        self.fail_times(10, 400)
+        self.assertRaises(HTTPError, self.pt.do_track_page_view, 'failed')
+        self.assertEqual(1, len(self.server.requests))
+        breaker = self.breakers.get(self.server.url())
+        self.assertEqual(0, breaker.failures)
+
+    def test_post_is_not_retried(self):
+        self.fail_times(10, 504)
+        self.assertRaises(HTTPError, self.transport.request, 'POST',
+                          self.server.url(), b'{}')
+        self.assertEqual(1, len(self.server.requests))
+        self.fail_times(2, 504)
+        transport = ResilientTransport(
+            self.pool, RetryPolicy(max_retries=2, backoff_factor=0,
+                                   retry_methods=('GET', 'post')),
+            CircuitBreakerRegistry())
+        transport.request('POST', self.server.url(), b'{}')
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_circuit_opens_and_recovers(self):
+        self.fail_times(3)
+        self.transport.retry_policy.max_retries = 0
+        for i in range(3):
+            self.assertRaises(HTTPError, self.pt.do_track_page_view, 'fail')
+        breaker = self.breakers.get(self.server.url())
+        self.assertEqual(CircuitBreaker.OPEN, breaker.get_state())
+        self.assertRaises(CircuitOpenError, self.pt.do_track_page_view,
+                          'rejected')
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual(1, breaker.stats()['rejected'])
+        time.sleep(0.25)
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.get_state())
+        self.pt.do_track_page_view('probe')
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.get_state())
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker('test', failure_threshold=1,
+                                 recovery_timeout=0)
+        breaker.record_failure()
+        breaker.before_request()
+        self.assertRaises(CircuitOpenError, breaker.before_request)
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+    def test_breaker_per_endpoint(self):
+        self.assertTrue(self.breakers.get('http://a.example.com/piwik.php') is
+                        self.breakers.get('http://a.example.com:80/'))
+        self.assertFalse(self.breakers.get('http://a.example.com/') is
+                         self.breakers.get('https://a.example.com/'))
+        self.assertTrue('http://a.example.com:80' in self.breakers.stats())
+
+    def test_connection_errors_are_retried(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable(socket.timeout()))
+        self.assertTrue(policy.is_failure(socket.error()))
+        self.assertFalse(policy.is_retryable(ValueError()))
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff_factor=1, max_backoff=5, jitter=False)
+        self.assertEqual([1, 2, 4, 5],
+                         [policy.get_backoff(i) for i in range(4)])
+        policy.jitter = True
+        for i in range(20):
+            self.assertTrue(0 <= policy.get_backoff(3) <= 5)
+
+    def test_budget(self):
+        budget = RetryBudget(ratio=0.5, min_per_second=0)
+        for i in range(4):
+            budget.record_request()
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw(), "Budget not exhausted")
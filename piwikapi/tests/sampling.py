@@ -0,0 +1,109 @@
+from piwikapi.events import TrackingEventSerializer
+from piwikapi.exceptions import ConfigurationError
+from piwikapi.sampling import VisitorSampler
+from piwikapi.tracking import PiwikTrackerEcommerce
+from piwikapi.tracking import TrackingEvent
+from piwikapi.visitor import get_visitor_id
+
+from request import FakeRequest
+from tracking import TrackerBaseTestCase
+
+
+class CollectingDispatcher(object):
+    """
+    Keeps the query strings instead of sending them
+    """
+    def __init__(self):
+        self.query_strings = []
+
+    def add(self, query_string):
+        self.query_strings.append(query_string)
+        return True
+
+
+class SamplingTestCase(TrackerBaseTestCase):
+    """
+    VisitorSampler tests
+    """
+    def setUp(self):
+        super(SamplingTestCase, self).setUp()
+        self.dispatcher = CollectingDispatcher()
+        self.pte = PiwikTrackerEcommerce(1, self.request)
+        self.pte.set_dispatcher(self.dispatcher)
+
+    def test_rate(self):
+        sampler = VisitorSampler(0.25)
+        kept = [sampler.keep(1, get_visitor_id()) for i in range(10000)]
+        self.assertTrue(2200 < kept.count(True) < 2800,
+                        "Kept %d of 10000" % kept.count(True))
+        stats = sampler.stats()[1]
+        self.assertEqual(kept.count(False), stats['sampled_out'])
+        self.assertAlmostEqual(10000.0 / stats['kept'], sampler.get_scale(1))
+        self.assertEqual(1.0, sampler.get_scale(2))
+
+    def test_deterministic(self):
+        sampler = VisitorSampler(0.5)
+        self.assertTrue(sampler.keep(1, '7fffffff00000000'))
+        self.assertFalse(sampler.keep(1, '8000000000000000'))
+        self.assertEqual(sampler.keep(1, 'not-hex'),
+                         VisitorSampler(0.5).keep(1, 'not-hex'))
+
+    def test_site_rates(self):
+        sampler = VisitorSampler(0, site_rates={2: 1})
+        self.assertFalse(sampler.keep(1, 'ffffffff00000000'))
+        self.assertTrue(sampler.keep(2, 'ffffffff00000000'))
+        self.assertEqual(1, sampler.get_rate(2))
+        self.assertRaises(ConfigurationError, VisitorSampler, 1.5)
+        self.assertRaises(ConfigurationError, VisitorSampler, 1,
+                          site_rates={1: -1})
+
+    def test_tracker(self):
+        sampler = VisitorSampler(0)
+        self.pte.set_sampler(sampler)
+        self.assertFalse(self.pte.do_track_page_view('dropped'))
+        self.pte.add_ecommerce_item('sku', 'name', price=10)
+        self.assertFalse(self.pte.do_track_ecommerce_cart_update(10))
+        self.assertEqual({}, self.pte.ecommerce_items)
+        self.assertEqual(0, len(self.dispatcher.query_strings))
+        self.assertTrue(self.pte.do_track_goal(1, 10))
+        self.assertTrue(self.pte.do_track_ecommerce_order('order', 10))
+        self.assertEqual(2, len(self.dispatcher.query_strings))
+        self.assertEqual({1: {'kept': 2, 'sampled_out': 2}}, sampler.stats())
+
+    def test_whole_visits(self):
+        self.pte.set_sampler(VisitorSampler(0.5))
+        self.pte.set_visitor_id('0123456789abcdef')
+        for i in range(3):
+            self.assertTrue(self.pte.do_track_page_view('kept'))
+        self.pte.set_visitor_id('fedcba9876543210')
+        for i in range(3):
+            self.assertFalse(self.pte.do_track_page_view('dropped'))
+        self.assertEqual(3, len(self.dispatcher.query_strings))
+
+    def test_visitor_cookie(self):
+        """
+        Every request of a visitor gets a new tracker, the sampler must go
+        by the visitor ID of the _pk_id cookie
+        """
+        sampler = VisitorSampler(0.5)
+        for visitor_id, kept in (('0123456789abcdef', True),
+                                 ('fedcba9876543210', False)):
+            cookie = '_pk_id.1.1fff=%s.1360000000' % visitor_id
+            for i in range(5):
+                request = FakeRequest(dict(self.request.META,
+                                           HTTP_COOKIE=cookie))
+                pte = PiwikTrackerEcommerce(1, request)
+                pte.set_dispatcher(self.dispatcher)
+                pte.set_sampler(sampler)
+                self.assertEqual(visitor_id, pte.get_visitor_id())
+                self.assertEqual(kept, pte.do_track_page_view('page'))
+        self.assertEqual(5, len(self.dispatcher.query_strings))
+
+    def test_capture(self):
+        self.pte.set_sampler(VisitorSampler(0))
+        events = [self.pte.capture_page_view('dropped'),
+                  self.pte.capture_goal(1)]
+        self.assertEqual(None, events[0])
+        self.assertEqual(TrackingEvent.GOAL, events[1].kind)
+        self.assertEqual(1, len(TrackingEventSerializer().serialize_many(
+            events)))
@@ -0,0 +1,33 @@
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from piwikapi.stubserver import GIF
+from piwikapi.stubserver import PiwikStubServer
+from piwikapi.stubserver import RecordedRequest
+
+
+class RecordingServer(PiwikStubServer):
+    """
+    A local HTTP server for tests that don't need a real Piwik install
+
+    Tracking requests get a GIF, or an empty 204 response with send_image=0,
+    bulk tracking requests a JSON status, whatever the path. Set
+    the ``responder`` attribute to a callable taking a RecordedRequest and
+    returning a (status, headers, body) tuple to change that.
+    """
+    def respond(self, request):
+        if self.responder is not None:
+            return self.responder(request)
+        if request.method == 'POST':
+            tracked = len(request.json().get('requests', ()))
+            body = json.dumps({'status': 'success', 'tracked': tracked})
+            return 200, [('Content-Type', 'application/json')], \
+                body.encode('utf-8')
+        if 'send_image=0' in request.path:
+            if 'debug=1' in request.path:
+                return 200, [('Content-Type', 'text/plain')], \
+                    b'Debug enabled - Input parameters'
+            return 204, [], b''
+        return 200, [('Content-Type', 'image/gif')], GIF
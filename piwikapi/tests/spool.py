@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import time
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from piwikapi.spool import PiwikSpool
+from piwikapi.spool import PiwikSpoolReplayer
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class SpoolTestCase(TrackerBaseTestCase):
+    """
+    PiwikSpool and PiwikSpoolReplayer tests
+    """
+    def setUp(self):
+        super(SpoolTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.spool = PiwikSpool(self.directory, segment_size=100,
+                                max_size=1000)
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.directory)
+
+    def reopen(self):
+        self.spool.close()
+        self.spool = PiwikSpool(self.directory, segment_size=100,
+                                max_size=1000)
+
+    def test_read_and_ack(self):
+        for i in range(3):
+            self.assertTrue(self.spool.add('hit=%d' % i))
+        hits = self.spool.read(2)
+        self.assertEqual(['hit=0', 'hit=1'], [hit for hit, pos in hits])
+        self.spool.ack(hits[-1][1])
+        self.assertEqual(['hit=2'], [hit for hit, pos in self.spool.read(10)])
+
+    def test_ack_survives_restart(self):
+        for i in range(3):
+            self.spool.add('hit=%d' % i)
+        self.spool.ack(self.spool.read(2)[-1][1])
+        self.reopen()
+        self.assertEqual(['hit=2'], [hit for hit, pos in self.spool.read(10)])
+        self.spool.add('hit=3')
+        self.assertEqual(['hit=2', 'hit=3'],
+                         [hit for hit, pos in self.spool.read(10)])
+
+    def test_segments_are_rotated_and_compacted(self):
+        for i in range(10):
+            self.spool.add('hit=%d&padding=%s' % (i, 'x' * 20))
+        segments = self.spool._get_segments()
+        self.assertTrue(len(segments) > 1, "No new segment was started")
+        hits = self.spool.read(100)
+        self.assertEqual(10, len(hits))
+        self.spool.ack(hits[-1][1])
+        self.assertEqual([segments[-1]], self.spool._get_segments(),
+                         "Sent segments were not deleted")
+        self.assertFalse(self.spool.pending())
+
+    def test_size_cap(self):
+        added = 0
+        while self.spool.add('hit=%d&padding=%s' % (added, 'x' * 40)):
+            added += 1
+        self.assertEqual(1, self.spool.dropped)
+        self.assertTrue(self.spool.size <= 1000)
+        self.spool.ack(self.spool.read(100)[-1][1])
+        self.assertTrue(self.spool.add('hit=after'),
+                        "Compaction didn't free space")
+
+    def test_interrupted_write(self):
+        self.spool.add('hit=0')
+        self.spool.close()
+        path = self.spool._get_path(self.spool._get_segments()[-1])
+        with open(path, 'ab') as f:
+            f.write(b'hit=bro')
+        self.reopen()
+        self.spool.add('hit=1')
+        self.assertEqual(['hit=0', 'hit=1'],
+                         [hit for hit, pos in self.spool.read(10)])
+
+    def test_replay(self):
+        server = RecordingServer()
+        server.start()
+        try:
+            self.pt.set_dispatcher(self.spool)
+            before = int(time.time())
+            self.pt.do_track_page_view('spooled')
+            self.pt.do_track_page_view('spooled again')
+            replayer = PiwikSpoolReplayer(self.spool, server.url(), 'token')
+            self.assertEqual(2, replayer.replay())
+            self.assertEqual(2, replayer.sent)
+            self.assertFalse(self.spool.pending())
+            data = server.requests[0].json()
+            self.assertEqual('token', data['token_auth'])
+            params = parse_qs(data['requests'][0][1:])
+            self.assertEqual(['spooled'], params['action_name'])
+            self.assertTrue(int(params['cdt'][0]) >= before)
+            self.assertEqual(0, replayer.replay())
+            self.assertEqual(1, len(server.requests))
+        finally:
+            server.stop()
+
+    def test_replay_keeps_hits_when_piwik_is_down(self):
+        server = RecordingServer()
+        server.responder = lambda request: (503, [], b'<html>down</html>')
+        server.start()
+        try:
+            self.spool.add('idsite=1&rec=1')
+            replayer = PiwikSpoolReplayer(self.spool, server.url())
+            self.assertRaises(Exception, replayer.replay_once)
+            self.assertTrue(self.spool.pending(), "Hit was acked")
+            server.responder = None
+            self.assertEqual(1, replayer.replay_once())
+            self.assertFalse(self.spool.pending())
+        finally:
+            server.stop()
@@ -0,0 +1,191 @@
+import sys
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from urllib.error import HTTPError
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib2 import HTTPError
+    from urllib import urlencode
+
+from piwikapi.analytics import PiwikAnalytics
+from piwikapi.bulk import PiwikBulkTracker
+from piwikapi.stubserver import PiwikStubServer
+from piwikapi.stubserver import get_browser
+from piwikapi.stubserver import main
+from piwikapi.tracking import PiwikTracker
+from piwikapi.tracking import PiwikTrackerEcommerce
+
+from tracking import TrackerBaseTestCase
+
+
+class StubServerTestCase(TrackerBaseTestCase):
+    """
+    PiwikStubServer tests
+    """
+    def setUp(self):
+        super(StubServerTestCase, self).setUp()
+        self.server = PiwikStubServer(token_auth='stubtoken')
+        self.server.start()
+        self.pt = self.get_tracker()
+        self.a = PiwikAnalytics()
+        self.a.set_api_url(self.server.url('/index.php'))
+        self.a.set_id_site(1)
+        self.a.set_format('json')
+        self.a.set_parameter('token_auth', 'stubtoken')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_tracker(self, tracker_class=PiwikTracker):
+        tracker = tracker_class(1, self.request)
+        tracker.set_api_url(self.server.url())
+        tracker.set_token_auth('stubtoken')
+        return tracker
+
+    def call(self, method, **params):
+        self.a.set_method(method)
+        for key, value in params.items():
+            self.a.set_parameter(key, value)
+        return json.loads(self.a.send_request().decode('utf-8'))
+
+    def test_page_view_is_recorded(self):
+        self.pt.set_resolution(1024, 768)
+        self.pt.set_plugins(flash=True, pdf=True)
+        self.pt.set_ip('192.0.2.1')
+        self.pt.do_track_page_view('Stub title')
+        hits = self.server.get_hits(1)
+        self.assertEqual(1, len(hits))
+        self.assertEqual('Stub title', hits[0]['action_name'])
+        visits = self.call('Live.getLastVisitsDetails')
+        self.assertEqual(1, len(visits))
+        self.assertEqual('1024x768', visits[0]['resolution'])
+        self.assertEqual('flash, pdf', visits[0]['plugins'])
+        self.assertEqual('192.0.2.1', visits[0]['visitIp'])
+        action = visits[0]['actionDetails'][0]
+        self.assertEqual('action', action['type'])
+        self.assertEqual('Stub title', action['pageTitle'])
+
+    def test_hits_of_a_visitor_are_one_visit(self):
+        pte = self.get_tracker(PiwikTrackerEcommerce)
+        pte.do_track_page_view('First')
+        pte.do_track_action('http://example.com/file.zip', 'download')
+        pte.do_track_goal(1, 5)
+        visit, = self.call('Live.getLastVisitsDetails')
+        self.assertEqual(['action', 'download', 'goal'],
+                         [action['type'] for action in visit['actionDetails']])
+        self.assertEqual(1, visit['goalConversions'])
+        self.assertEqual(5, visit['revenue'])
+
+    def test_ecommerce(self):
+        pte = self.get_tracker(PiwikTrackerEcommerce)
+        pte.add_ecommerce_item('sku1', 'Book', price=10, quantity=2)
+        pte.do_track_ecommerce_cart_update(20)
+        visit, = self.call('Live.getLastVisitsDetails')
+        self.assertEqual('abandonedCart', visit['visitEcommerceStatus'])
+        pte.add_ecommerce_item('sku1', 'Book', price=10, quantity=2)
+        pte.do_track_ecommerce_order('order1', 20)
+        visit, = self.call('Live.getLastVisitsDetails')
+        self.assertEqual('ordered', visit['visitEcommerceStatus'])
+        action, = visit['actionDetails']
+        self.assertEqual('ecommerceOrder', action['type'])
+        self.assertEqual(20, action['revenue'])
+        self.assertEqual('2', action['items'])
+        self.assertEqual('Book', action['itemDetails'][0]['itemName'])
+
+    def test_segment(self):
+        self.pt.set_custom_variable(5, 'segment', 'one')
+        self.pt.do_track_page_view('One')
+        pt = self.get_tracker()
+        pt.set_visitor_id(pt.get_random_visitor_id())
+        pt.set_custom_variable(5, 'segment', 'two')
+        pt.do_track_page_view('Two')
+        visits = self.call('Live.getLastVisitsDetails',
+                           segment='customVariableValue5==two')
+        self.assertEqual(['Two'], [visit['actionDetails'][0]['pageTitle']
+                                   for visit in visits])
+        visits = self.call('Live.getLastVisitsDetails',
+                           segment='customVariableValue5!=three;'
+                                   'pageTitle=@On,pageTitle==Two')
+        self.assertEqual(2, len(visits))
+        self.assertEqual('error', self.call(
+            'Live.getLastVisitsDetails', segment='invalid')['result'])
+
+    def test_debug_output(self):
+        self.server.debug = True
+        r = self.pt.do_track_page_view('Debug title')
+        self.assertTrue('token_auth is authenticated' in r)
+        self.assertTrue('New Visit (IP = 127.0.0.1)' in r)
+        r = self.pt.do_track_page_view('Debug title')
+        self.assertTrue('Visit is known (IP = 127.0.0.1)' in r)
+
+    def test_send_image(self):
+        self.pt.set_send_image(False)
+        self.assertEqual(204, self.pt.do_track_page_view('No image').status)
+
+    def test_bulk_request(self):
+        bulk = PiwikBulkTracker(self.server.url(), 'stubtoken', max_age=None)
+        self.pt.set_bulk_tracker(bulk)
+        self.pt.do_track_page_view('First')
+        self.pt.do_track_page_view('Second')
+        bulk.flush()
+        self.assertEqual(1, len(self.server.requests))
+        self.assertEqual(2, len(self.server.get_hits()))
+        visit, = self.call('Live.getLastVisitsDetails')
+        self.assertEqual(2, visit['actions'])
+
+    def test_api(self):
+        self.pt.do_track_page_view('Summary')
+        self.assertEqual(1, self.call('VisitsSummary.get')['nb_visits'])
+        goal = self.call('Goals.addGoal', name='Goal', matchAttribute='url',
+                         pattern='x', patternType='contains')
+        self.assertEqual(['1'], list(self.call('Goals.getGoals').keys()))
+        self.assertEqual('success', self.call(
+            'Goals.deleteGoal', idGoal=goal['value'])['result'])
+        self.assertEqual('error', self.call('Unknown.method')['result'])
+        self.server.set_response('Referers.getWebsites', [{'label': 'x'}])
+        self.assertEqual([{'label': 'x'}],
+                         self.call('Referers.getWebsites'))
+        self.a.set_parameter('token_auth', 'invalid')
+        self.assertEqual('error', self.call('VisitsSummary.get')['result'])
+
+    def test_bulk_api_request(self):
+        data = self.call('API.getBulkRequest', **{
+            'urls[0]': urlencode({'method': 'API.getPiwikVersion'}),
+            'urls[1]': urlencode({'method': 'Live.getCounters',
+                                  'lastMinutes': 30}),
+        })
+        self.assertEqual(PiwikStubServer.PIWIK_VERSION, data[0]['value'])
+        self.assertEqual(0, data[1][0]['visits'])
+
+    def test_error_injection(self):
+        self.server.fail_next(1, 503)
+        try:
+            self.pt.do_track_page_view('Fails')
+            self.fail("No error raised")
+        except HTTPError as e:
+            self.assertEqual(503, e.code)
+        self.pt.do_track_page_view('Works')
+        self.assertEqual(1, len(self.server.get_hits()))
+        self.server.error_rate = 1
+        self.assertRaises(HTTPError, self.pt.do_track_page_view, 'Fails')
+
+    def test_latency(self):
+        self.server.latency = 0.1
+        started = time.time()
+        self.pt.do_track_page_view('Slow')
+        self.assertTrue(time.time() - started >= 0.1)
+
+    def test_get_browser(self):
+        self.assertEqual(('Firefox 3.6', 'gecko'), get_browser(
+            'Mozilla/5.0 (Windows; U; Windows NT 6.1; zh-CN; rv:1.9.2.24)'
+            'Gecko/20111103 Firefox/3.6.24'))
+        self.assertEqual(('Unknown', 'unknown'), get_browser('curl/7.0'))
+
+    def test_main_runs_command(self):
+        code = 'import os, sys; sys.exit(os.environ["PIWIK_SITE_ID"] != "3")'
+        self.assertEqual(0, main(['--id-site', '3', '--',
+                                  sys.executable, '-c', code]))
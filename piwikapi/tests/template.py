@@ -0,0 +1,112 @@
+import datetime
+import random
+
+from piwikapi.exceptions import ConfigurationError
+from piwikapi.template import PiwikTrackerTemplate
+from piwikapi.tracking import PiwikTracker
+from piwikapi.tracking import PiwikTrackerEcommerce
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class TemplateTestCase(TrackerBaseTestCase):
+    """
+    PiwikTrackerTemplate tests
+    """
+    def get_template(self, **kwargs):
+        return PiwikTrackerTemplate(
+            1, 'http://example.com/piwik.php', token_auth='token',
+            plugins={'flash': 1}, custom_variables=[(1, 'plan', 'premium')],
+            **kwargs)
+
+    def test_same_query_as_tracker(self):
+        pt = PiwikTracker(1, self.request)
+        pt.set_api_url('http://example.com/piwik.php')
+        pt.set_token_auth('token')
+        pt.set_plugins(flash=1)
+        pt.set_custom_variable(1, 'plan', 'premium')
+        tracker = self.get_template().get_tracker(self.request)
+        tracker.visitor_id = pt.visitor_id
+        random.seed(1)
+        expected = pt._get_request(1)
+        random.seed(1)
+        self.assertEqual(expected, tracker._get_request(1),
+                         "Query strings differ")
+        self.assertEqual(sorted(pt.__dict__), sorted(tracker.__dict__))
+
+    def test_lazy_visitor_id(self):
+        tracker = self.get_template().get_tracker(self.request)
+        self.assertEqual(None, tracker._visitor_id)
+        visitor_id = tracker.visitor_id
+        self.assertEqual(PiwikTracker.LENGTH_VISITOR_ID, len(visitor_id))
+        self.assertEqual(visitor_id, tracker.visitor_id)
+        other = self.get_template().get_tracker(self.request)
+        self.assertNotEqual(visitor_id, other.visitor_id)
+
+    def test_trackers_are_independent(self):
+        template = self.get_template()
+        first = template.get_tracker(self.request)
+        first.set_custom_variable(2, 'page', 'one', 'page')
+        first.set_custom_variable(1, 'plan', 'free')
+        second = template.get_tracker(self.request)
+        self.assertEqual({}, second.page_custom_var)
+        self.assertEqual(('plan', 'premium'), second.visitor_custom_var[1])
+
+    def test_shared_custom_variable_query(self):
+        template = self.get_template()
+        first = template.get_tracker(self.request)
+        second = template.get_tracker(self.request)
+        query = first._get_custom_var_query()
+        self.assertTrue('premium' in query)
+        self.assertTrue(query is second._get_custom_var_query(),
+                        "Custom variables encoded again")
+        first.set_custom_variable(1, 'plan', 'free')
+        self.assertTrue('free' in first._get_custom_var_query())
+        self.assertTrue(query is second._get_custom_var_query())
+
+    def test_local_time(self):
+        tracker = self.get_template().get_tracker(self.request)
+        tracker.set_local_time(datetime.datetime(2013, 2, 20, 12, 30, 15))
+        tracker.local_hour = 10
+        tracker.local_minute = 5
+        tracker.local_second = 0
+        self.assertEqual(datetime.datetime(2013, 2, 20, 10, 5),
+                         tracker.local_time)
+        self.assertEqual((10, 5, 0), (tracker.local_hour,
+                                      tracker.local_minute,
+                                      tracker.local_second))
+
+    def test_request_attributes(self):
+        tracker = self.get_template().get_tracker(self.request)
+        self.assertEqual(self.request.META['HTTP_USER_AGENT'],
+                         tracker.user_agent)
+        self.assertTrue(tracker.page_url.startswith(
+            'http://%s' % self.request.META['SERVER_NAME']))
+
+    def test_immutable(self):
+        template = self.get_template()
+        self.assertEqual(1, template.id_site)
+        self.assertRaises(AttributeError, setattr, template, 'api_url', '')
+        self.assertRaises(AttributeError, setattr, template, 'foo', 1)
+
+    def test_unknown_plugin(self):
+        self.assertRaises(ConfigurationError, PiwikTrackerTemplate, 1,
+                          'http://example.com/', plugins={'foo': 1})
+
+    def test_ecommerce_tracker(self):
+        server = RecordingServer()
+        server.start()
+        try:
+            template = PiwikTrackerTemplate(
+                1, server.url(), tracker_class=PiwikTrackerEcommerce,
+                send_image=False)
+            pte = template.get_tracker(self.request)
+            pte.add_ecommerce_item('sku', 'name', price=10, quantity=2)
+            self.assertEqual(204,
+                             pte.do_track_ecommerce_order('order1', 20).status)
+            self.assertEqual({}, template.get_tracker(self.request)
+                             .ecommerce_items)
+            self.assertTrue('ec_id=order1' in server.requests[0].path)
+        finally:
+            server.stop()
@@ -0,0 +1,173 @@
+import errno
+import socket
+try:
+    from http.client import BadStatusLine
+    from urllib.error import HTTPError
+except ImportError:
+    from httplib import BadStatusLine
+    from urllib2 import HTTPError
+
+from piwikapi.analytics import PiwikAnalytics
+from piwikapi.exceptions import ConfigurationError
+from piwikapi.transport import HTTPConnectionPool
+from piwikapi.transport import UrllibTransport
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class TransportTestCase(TrackerBaseTestCase):
+    """
+    HTTPConnectionPool tests, against a local server
+    """
+    def setUp(self):
+        super(TransportTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.pool = HTTPConnectionPool(max_size=2, idle_timeout=30)
+        self.pt.set_api_url(self.server.url())
+        self.pt.set_transport(self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_connection_is_reused(self):
+        self.pt.do_track_page_view('first')
+        self.pt.do_track_page_view('second')
+        first, second = self.server.requests
+        self.assertEqual(first.client_address, second.client_address,
+                         "The second request used a new connection")
+        self.assertEqual(1, self.pool.idle_connections())
+
+    def test_idle_connections_are_evicted(self):
+        pool = HTTPConnectionPool(idle_timeout=-1)
+        self.pt.set_transport(pool)
+        self.pt.do_track_page_view('first')
+        self.pt.do_track_page_view('second')
+        first, second = self.server.requests
+        self.assertNotEqual(first.client_address, second.client_address,
+                            "An expired connection was reused")
+        pool.close()
+
+    def test_pool_size(self):
+        key = self.pool._get_key(self.server.url())
+        connections = [self.pool._new_connection(key) for i in range(3)]
+        for connection in connections:
+            self.pool._put_connection(key, connection)
+        self.assertEqual(2, self.pool.idle_connections())
+        self.pool.close()
+        self.assertEqual(0, self.pool.idle_connections())
+
+    def test_resend_on_new_connection(self):
+        """
+        A POST that fails on a reused connection is only sent again if the
+        server can't have read it
+        """
+        url = self.server.url()
+        key = self.pool._get_key(url)
+        exchange = self.pool._exchange
+        calls = []
+
+        def reset_once(error):
+            def _exchange(connection, *args):
+                calls.append(connection)
+                if len(calls) == 1:
+                    raise error
+                return exchange(connection, *args)
+            del calls[:]
+            self.pool._put_connection(key, self.pool._new_connection(key))
+            self.pool._exchange = _exchange
+
+        reset_once(socket.error(errno.ECONNRESET, 'Connection reset'))
+        self.assertRaises(socket.error, self.pool.request, 'POST', url,
+                          b'{}')
+        self.assertEqual(1, len(calls))
+        reset_once(socket.error(errno.EPIPE, 'Broken pipe'))
+        self.pool.request('POST', url, b'{}')
+        self.assertEqual(2, len(calls))
+        reset_once(BadStatusLine("''"))
+        self.pool.request('POST', url, b'{}')
+        self.assertEqual(2, len(calls))
+        reset_once(socket.error(errno.ECONNRESET, 'Connection reset'))
+        self.pool.request('GET', url)
+        self.assertEqual(2, len(calls))
+        reset_once(socket.timeout())
+        self.assertRaises(socket.timeout, self.pool.request, 'GET', url)
+        self.assertEqual(1, len(calls))
+
+    def test_pool_keys(self):
+        self.assertEqual(('http', 'example.com', 80),
+                         self.pool._get_key('http://example.com/piwik.php'))
+        self.assertEqual(('https', 'example.com', 8443),
+                         self.pool._get_key('https://example.com:8443/'))
+        self.assertRaises(ConfigurationError, self.pool._get_key,
+                          'ftp://example.com/')
+
+    def test_tracking_headers(self):
+        self.pt.do_track_page_view('headers')
+        headers = dict((key.lower(), value) for key, value in
+                       self.server.requests[0].headers.items())
+        self.assertEqual(self.request.META['HTTP_USER_AGENT'],
+                         headers['user-agent'])
+        self.assertEqual(self.request.META['HTTP_ACCEPT_LANGUAGE'],
+                         headers['accept-language'])
+
+    def test_send_image_disabled(self):
+        self.pt.set_send_image(False)
+        response = self.pt.do_track_page_view('no image')
+        self.assertTrue('send_image=0' in self.server.requests[0].path)
+        self.assertEqual(204, response.status)
+        self.assertTrue(response.latency >= 0)
+        self.assertTrue(response.bytes_sent >
+                        len(self.server.requests[0].path))
+        self.assertEqual(None, response.debug_output)
+        self.assertEqual(1, self.pool.idle_connections())
+
+    def test_send_image_disabled_debug(self):
+        self.pt.set_send_image(False)
+        self.pt.set_debug_string_append('&debug=1')
+        response = self.pt.do_track_page_view('debug')
+        self.assertEqual(200, response.status)
+        self.assertTrue('Debug enabled' in response.debug_output)
+
+    def test_http_error(self):
+        self.server.responder = lambda request: (500, [], b'broken')
+        try:
+            self.pt.do_track_page_view('error')
+            raised = False
+        except HTTPError as e:
+            raised = True
+            self.assertEqual(500, e.code)
+            self.assertEqual(b'broken', e.read())
+        self.assertTrue(raised, "No HTTPError for a 500 response")
+        self.assertEqual(1, self.pool.idle_connections(),
+                         "A keep-alive connection was dropped")
+
+    def test_redirect(self):
+        def responder(request):
+            if request.path.startswith('/old.php'):
+                return 301, [('Location', '/piwik.php')], b''
+            return 200, [], b'GIF89a'
+        self.server.responder = responder
+        self.pt.set_api_url(self.server.url('/old.php'))
+        self.pt.do_track_page_view('redirect')
+        self.assertEqual(2, len(self.server.requests))
+        self.assertTrue(self.server.requests[1].path.startswith('/piwik.php'))
+
+    def test_analytics(self):
+        self.server.responder = lambda request: (200, [], b'[]')
+        a = PiwikAnalytics()
+        a.set_api_url(self.server.url('/'))
+        a.set_transport(self.pool)
+        a.set_method('API.getPiwikVersion')
+        self.assertEqual(b'[]', a.send_request())
+        self.assertEqual(b'[]', a.send_request())
+        first, second = self.server.requests
+        self.assertEqual(first.client_address, second.client_address,
+                         "The second request used a new connection")
+
+    def test_urllib_transport(self):
+        self.pt.set_transport(UrllibTransport())
+        body = self.pt.do_track_page_view('urllib')
+        self.assertTrue('GIF89a' in body, "Unexpected body %s" % body)
@@ -0,0 +1,72 @@
+import os
+import re
+import threading
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from piwikapi.exceptions import ConfigurationError
+from piwikapi.tracking import PiwikTracker
+from piwikapi.visitor import VisitorIdGenerator
+from piwikapi.visitor import get_visitor_id
+
+
+class VisitorIdTestCase(unittest.TestCase):
+    """
+    VisitorIdGenerator tests
+    """
+    def test_format(self):
+        visitor_id = get_visitor_id()
+        self.assertEqual(PiwikTracker.LENGTH_VISITOR_ID, len(visitor_id))
+        self.assertTrue(re.match('^[0-9a-f]{16}$', visitor_id),
+                        "Invalid visitor ID %s" % visitor_id)
+
+    def test_refill(self):
+        generator = VisitorIdGenerator(buffer_size=2)
+        ids = [generator.get() for i in range(7)]
+        self.assertEqual(7, len(set(ids)), "Duplicate visitor IDs")
+        for visitor_id in ids:
+            self.assertEqual(16, len(visitor_id))
+
+    def test_buffer_size(self):
+        self.assertRaises(ConfigurationError, VisitorIdGenerator, 0)
+
+    def test_threads(self):
+        generator = VisitorIdGenerator(buffer_size=10)
+        ids = []
+
+        def generate():
+            ids.extend([generator.get() for i in range(500)])
+        threads = [threading.Thread(target=generate) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2000, len(set(ids)), "Duplicate visitor IDs")
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Requires os.fork()")
+    def test_fork(self):
+        generator = VisitorIdGenerator(buffer_size=100)
+        generator.get()
+        read, write = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(read)
+            os.write(write, ''.join(generator.get()
+                                    for i in range(10)).encode('ascii'))
+            os._exit(0)
+        os.close(write)
+        data = b''
+        while True:
+            chunk = os.read(read, 4096)
+            if not chunk:
+                break
+            data += chunk
+        os.close(read)
+        os.waitpid(pid, 0)
+        child = set(re.findall('.{16}', data.decode('ascii')))
+        parent = set(generator.get() for i in range(10))
+        self.assertEqual(10, len(child))
+        self.assertEqual(set(), child & parent,
+                         "Child and parent share visitor IDs")
@@ -0,0 +1,126 @@
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+from wsgiref.util import setup_testing_defaults
+
+from piwikapi.template import PiwikTrackerTemplate
+from piwikapi.wsgi import EnvironRequest
+from piwikapi.wsgi import PiwikWSGIMiddleware
+
+from server import RecordingServer
+from tracking import TrackerBaseTestCase
+
+
+class ClosingIterable(object):
+    """
+    A response iterable with a close() method
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class WSGIMiddlewareTestCase(TrackerBaseTestCase):
+    """
+    PiwikWSGIMiddleware tests, against a local server
+    """
+    def setUp(self):
+        super(WSGIMiddlewareTestCase, self).setUp()
+        self.server = RecordingServer()
+        self.server.start()
+        self.status = '200 OK'
+        self.body = ClosingIterable([b'Hello'])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def app(self, environ, start_response):
+        start_response(self.status, [('Content-Type', 'text/plain')])
+        return self.body
+
+    def get_middleware(self, **kwargs):
+        template = PiwikTrackerTemplate(1, self.server.url(),
+                                        token_auth='token')
+        return PiwikWSGIMiddleware(self.app, template, **kwargs)
+
+    def get_environ(self, path='/page/', query_string=''):
+        environ = {
+            'PATH_INFO': path,
+            'QUERY_STRING': query_string,
+            'HTTP_USER_AGENT': 'Test agent',
+            'REMOTE_ADDR': '192.0.2.7',
+        }
+        setup_testing_defaults(environ)
+        return environ
+
+    def get_response(self, middleware, environ):
+        headers = []
+
+        def start_response(status, response_headers, exc_info=None):
+            headers.append(status)
+        response = middleware(environ, start_response)
+        body = b''.join(response)
+        return response, headers[0], body
+
+    def get_query(self, index=0):
+        path = self.server.requests[index].path
+        return parse_qs(path.split('?', 1)[1])
+
+    def test_track_on_close(self):
+        middleware = self.get_middleware()
+        response, status, body = self.get_response(
+            middleware, self.get_environ(query_string='a=1'))
+        self.assertEqual('200 OK', status)
+        self.assertEqual(b'Hello', body)
+        self.assertEqual(0, len(self.server.requests), "Tracked too early")
+        response.close()
+        self.assertTrue(self.body.closed, "Response not closed")
+        self.assertEqual(1, len(self.server.requests))
+        query = self.get_query()
+        self.assertEqual(['http://127.0.0.1/page/?a=1'], query['url'])
+        self.assertEqual('Test agent',
+                         self.server.requests[0].get_header('User-Agent'))
+        self.assertEqual(['192.0.2.7'], query['cip'])
+
+    def test_exclude(self):
+        middleware = self.get_middleware(exclude=('/static/', '/media/'),
+                                         exclude_regex=r'.*\.ico$')
+        for path in ('/static/app.js', '/media/1.png', '/favicon.ico'):
+            response, status, body = self.get_response(
+                middleware, self.get_environ(path))
+            self.assertTrue(response is self.body, "Response was wrapped")
+            response.close()
+        self.assertEqual(0, len(self.server.requests))
+
+    def test_title(self):
+        def get_title(environ, status, headers):
+            return 'Title of %s' % environ['PATH_INFO']
+        middleware = self.get_middleware(get_title=get_title)
+        self.get_response(middleware, self.get_environ())[0].close()
+        self.assertEqual(['Title of /page/'], self.get_query()['action_name'])
+
+    def test_errors_not_tracked(self):
+        self.status = '404 Not Found'
+        middleware = self.get_middleware()
+        self.get_response(middleware, self.get_environ())[0].close()
+        self.assertEqual(0, len(self.server.requests))
+
+    def test_tracking_errors_are_logged(self):
+        def get_title(environ, status, headers):
+            raise ValueError('broken')
+        middleware = self.get_middleware(get_title=get_title)
+        self.get_response(middleware, self.get_environ())[0].close()
+        self.assertEqual(0, len(self.server.requests))
+
+    def test_environ_request(self):
+        environ = self.get_environ()
+        self.assertFalse(EnvironRequest(environ).is_secure())
+        environ['wsgi.url_scheme'] = 'https'
+        self.assertTrue(EnvironRequest(environ).is_secure())
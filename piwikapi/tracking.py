@@ -8,25 +8,226 @@ Source and development at https://github.com/piwik/piwik-python-api
 """
 
 import sys
+import calendar
 import datetime
-from hashlib import md5
+import functools
 import logging
-import os
 import random
+import time
 try:
     import json
 except ImportError:
     import simplejson as json
 try:
-    from urllib.request import Request, urlopen
-    from urllib.parse import urlencode, urlparse, quote
+    from urllib.parse import urlencode, urlparse, quote, quote_plus, unquote
 except ImportError:
-    from urllib2 import Request, urlopen
-    from urllib import urlencode, quote
+    from urllib import urlencode, quote, quote_plus, unquote
     from urlparse import urlparse
 
+from .cookies import VisitorCookieJar
 from .exceptions import ConfigurationError
 from .exceptions import InvalidParameter
+from .transport import get_default_pool
+from .visitor import get_visitor_id
+
+
+def _quote(value):
+    """
+    Encodes a query string value exactly like urlencode() does
+
+    :param value: Value
+    :type value: str, bytes or number
+    :rtype: str
+    """
+    if not isinstance(value, (str, bytes)):
+        value = str(value)
+    return quote_plus(value)
+
+
+_quote_cache = {}
+
+
+def _quote_cached(value):
+    """
+    Like _quote(), remembers the last 1024 encoded strings. Page and
+    referrer URLs are often the same for many hits.
+
+    :param value: Value
+    :type value: str, bytes or number
+    :rtype: str
+    """
+    if type(value) is not str:
+        return _quote(value)
+    try:
+        return _quote_cache[value]
+    except KeyError:
+        if len(_quote_cache) >= 1024:
+            _quote_cache.clear()
+        encoded = _quote_cache[value] = _quote(value)
+        return encoded
+
+
+def _index_cookies(cookies, prefix):
+    """
+    Index the Piwik cookies by kind and site ID, e.g. the value of the
+    ``_pk_id.1.1fff`` cookie by ``('id', '1')``
+
+    :param cookies: Cookie names and values
+    :type cookies: iterable of (name, value) tuples
+    :param prefix: Cookie name prefix
+    :type prefix: str
+    :rtype: dict of {(kind, id_site): str}
+    """
+    index = {}
+    for name, value in cookies:
+        if name.startswith(prefix):
+            parts = name[len(prefix):].split('.', 2)
+            if len(parts) > 1:
+                index[(parts[0], parts[1])] = unquote(value)
+    return index
+
+
+def _parse_cookie_header(header):
+    """
+    Returns the names and values of a Cookie header
+
+    :param header: Cookie header
+    :type header: str
+    :rtype: list of (name, value) tuples
+    """
+    cookies = []
+    for cookie in header.split(';'):
+        name, separator, value = cookie.partition('=')
+        if separator:
+            cookies.append((name.strip(), value.strip().strip('"')))
+    return cookies
+
+
+def _decode_id_cookie(value):
+    """
+    Decode the value of the _pk_id cookie
+
+    :param value: Cookie value
+    :type value: str
+    :raises: ValueError if the value is invalid
+    :rtype: dict
+    """
+    parts = value.split('.')
+    visitor_id = parts[0]
+    if len(visitor_id) != PiwikTracker.LENGTH_VISITOR_ID:
+        raise ValueError('Invalid visitor ID %s' % visitor_id)
+    int(visitor_id, 16)
+    counters = [int(part) for part in parts[1:6] if part]
+    counters += [None] * (5 - len(counters))
+    return {
+        'visitor_id': visitor_id,
+        'created': counters[0],
+        'visit_count': counters[1],
+        'current_visit': counters[2],
+        'last_visit': counters[3],
+        'last_ecommerce_order': counters[4],
+    }
+
+
+def _profiled(method):
+    """
+    Cancels the phase timer of a do_track_*() or capture_*() call if the
+    call fails before the timer was finished
+
+    :param method: The method
+    :type method: function
+    :rtype: function
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return method(self, *args, **kwargs)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            timer = self._phase_timer
+            if timer is not None:
+                self._phase_timer = None
+                timer.cancel()
+    return wrapper
+
+
+class TrackingResponse(object):
+    """
+    The result of a tracking request sent without the image response, see
+    PiwikTracker.set_send_image()
+    """
+    def __init__(self, status, latency, bytes_sent, debug_output=None):
+        """
+        :param status: HTTP status code, 204 unless debugging is enabled
+        :type status: int
+        :param latency: Seconds until the response was received
+        :type latency: float
+        :param bytes_sent: Length of the request URL
+        :type bytes_sent: int
+        :param debug_output: Piwik's debug output if a debug string was
+            appended, see PiwikTracker.set_debug_string_append()
+        :type debug_output: str or None
+        :rtype: None
+        """
+        self.status = status
+        self.latency = latency
+        self.bytes_sent = bytes_sent
+        self.debug_output = debug_output
+
+    def __repr__(self):
+        return '<TrackingResponse %d %.3fs>' % (self.status, self.latency)
+
+
+class TrackingEvent(object):
+    """
+    A captured hit that wasn't turned into a query string yet
+
+    The capture_*() methods of the trackers return events, a
+    piwikapi.events.TrackingEventSerializer encodes them later, e.g. in a
+    worker thread. Events can't be changed.
+    """
+    __slots__ = ('kind', 'arguments', 'state', 'ecommerce_items',
+                 'timestamp', 'visitor_id')
+
+    PAGE_VIEW = 'page_view'
+    ACTION = 'action'
+    GOAL = 'goal'
+    CART_UPDATE = 'cart_update'
+    ORDER = 'order'
+
+    def __init__(self, kind, arguments, state, ecommerce_items=None,
+                 timestamp=None, visitor_id=None):
+        """
+        :param kind: One of PAGE_VIEW, ACTION, GOAL, CART_UPDATE or ORDER
+        :type kind: str
+        :param arguments: Arguments of the matching do_track_*() method
+        :type arguments: tuple
+        :param state: Tracker attributes, see PiwikTracker.EVENT_STATE
+        :type state: tuple
+        :param ecommerce_items: Items of a cart update or order
+        :type ecommerce_items: tuple of item tuples or None
+        :param timestamp: Capture time, defaults to now
+        :type timestamp: float or None
+        :param visitor_id: Visitor ID, see PiwikTracker.get_visitor_id()
+        :type visitor_id: str or None
+        :rtype: None
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        set_attribute = object.__setattr__
+        set_attribute(self, 'kind', kind)
+        set_attribute(self, 'arguments', arguments)
+        set_attribute(self, 'state', state)
+        set_attribute(self, 'ecommerce_items', ecommerce_items)
+        set_attribute(self, 'timestamp', timestamp)
+        set_attribute(self, 'visitor_id', visitor_id)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TrackingEvent can't be changed")
+
+    def __repr__(self):
+        return '<TrackingEvent %s %r>' % (self.kind, self.arguments)
 
 
 class PiwikTracker(object):
@@ -52,9 +253,19 @@ class PiwikTracker(object):
         'silverlight': 'ag',
     }
 
+    #: Prefix of the cookie names of the Piwik JavaScript tracker
+    COOKIE_NAME_PREFIX = '_pk_'
+
     UNSUPPORTED_WARNING = "%s: The code that's just running is untested and " \
         "probably doesn't work as expected anyway."
 
+    #: The attributes a TrackingEvent captures, in the order of its state
+    EVENT_STATE = ('id_site', 'page_url', 'referer', '_visitor_id', 'ip',
+                   'token_auth', 'has_cookies', 'width', 'height',
+                   'forced_visitor_id', 'page_custom_var',
+                   'visitor_custom_var', 'plugins', 'attribution_info',
+                   'debug_append_url', 'user_agent', 'accept_language')
+
     def __init__(self, id_site, request):
         """
         :param id_site: Site ID
@@ -63,31 +274,76 @@ class PiwikTracker(object):
         :type request: A Django-like request object
         :rtype: None
         """
-        random.seed()
-        self.request = request
-        self.host = self.request.META.get('SERVER_NAME', '')
-        self.script = self.request.META.get('PATH_INFO', '')
-        self.query_string = self.request.META.get('QUERY_STRING', '')
         self.id_site = id_site
         self.api_url = ''
         self.request_cookie = ''
         self.ip = False
         self.token_auth = False
-        self.__set_request_parameters()
         self.forced_datetime = False
-        self.set_local_time(self._get_timestamp())
-        self.page_url = self.__get_current_url()
+        self.local_time = None
         self.cookie_support = True
+        # Created when Piwik first sets a cookie, see set_cookie_jar()
+        self.cookie_jar = None
         self.has_cookies = False
         self.width = False
         self.height = False
-        self.visitor_id = self.get_random_visitor_id()
+        # Generated when the first hit is built, see the visitor_id property
+        self._visitor_id = None
         self.forced_visitor_id = False
         self.debug_append_url = False
         self.page_custom_var = {}
         self.visitor_custom_var = {}
         self.plugins = {}
         self.attribution_info = {}
+        self.bulk_tracker = None
+        self.dispatcher = None
+        self.transport = None
+        self.send_image = True
+        self.sampler = None
+        self.deduplicator = None
+        self.metrics = None
+        self.profiler = None
+        # Times the phases of the current call, see set_profiler()
+        self._phase_timer = None
+        # Encoded static parameters, see _get_static_query()
+        self._static_query = None
+        #: Bumped when a custom variable changes
+        self.custom_var_version = 0
+        self._custom_var_query = None
+        self._set_request(request)
+
+    def _set_request(self, request):
+        """
+        Set the request being tracked, reads the headers and the page URL
+
+        :param request: Request
+        :type request: A Django-like request object
+        :rtype: None
+        """
+        meta = request.META
+        self.request = request
+        self._cookies = None
+        self._decoded_cookies = None
+        self.host = meta.get('SERVER_NAME', '')
+        self.script = meta.get('PATH_INFO', '')
+        self.query_string = meta.get('QUERY_STRING', '')
+        self.__set_request_parameters()
+        self.page_url = self.__get_current_url()
+
+    @property
+    def visitor_id(self):
+        """
+        The random visitor ID, generated on first use
+
+        :rtype: str
+        """
+        if self._visitor_id is None:
+            self._visitor_id = self.get_random_visitor_id()
+        return self._visitor_id
+
+    @visitor_id.setter
+    def visitor_id(self, visitor_id):
+        self._visitor_id = visitor_id
 
     def __set_request_parameters(self):
         """
@@ -103,15 +359,45 @@ class PiwikTracker(object):
 
     def set_local_time(self, datetime):
         """
-        Set the time
+        Set the time, defaults to the time of the request
 
         :param datetime: Time
         :type datetime: datetime.datetime object
         :rtype: None
         """
-        self.local_hour = datetime.hour
-        self.local_minute = datetime.minute
-        self.local_second = datetime.second
+        self.local_time = datetime
+
+    def _get_local_time(self):
+        """
+        :rtype: datetime.datetime object
+        """
+        if self.local_time is None:
+            return self._get_timestamp()
+        return self.local_time
+
+    @property
+    def local_hour(self):
+        return self._get_local_time().hour
+
+    @local_hour.setter
+    def local_hour(self, hour):
+        self.local_time = self._get_local_time().replace(hour=hour)
+
+    @property
+    def local_minute(self):
+        return self._get_local_time().minute
+
+    @local_minute.setter
+    def local_minute(self, minute):
+        self.local_time = self._get_local_time().replace(minute=minute)
+
+    @property
+    def local_second(self):
+        return self._get_local_time().second
+
+    @local_second.setter
+    def local_second(self, second):
+        self.local_time = self._get_local_time().replace(second=second)
 
     def set_token_auth(self, token_auth):
         """
@@ -209,6 +495,18 @@ class PiwikTracker(object):
         """
         self.debug_append_url = string
 
+    def set_send_image(self, send_image):
+        """
+        By default Piwik answers tracking requests with a 1x1 GIF, which the
+        do_track_*() methods return. Without the image Piwik answers with an
+        empty 204 response and a TrackingResponse is returned instead.
+
+        :param send_image: Whether Piwik should send the image
+        :type send_image: bool
+        :rtype: None
+        """
+        self.send_image = send_image
+
     def set_url_referer(self, referer):
         """
         Set the referer URL
@@ -273,6 +571,112 @@ class PiwikTracker(object):
         """
         self.forced_datetime = datetime
 
+    def set_bulk_tracker(self, bulk_tracker):
+        """
+        Queue the tracking requests in a bulk tracker instead of sending them
+        one by one. The do_track_*() methods will then return a
+        BulkTrackingResult instead of the response body.
+
+        The user agent and browser language are sent as request parameters
+        as the bulk request only has one set of headers. The token_auth is
+        left out of the queued hits if the bulk tracker has one.
+
+        :param bulk_tracker: Bulk tracker, None to send requests directly
+        :type bulk_tracker: piwikapi.bulk.PiwikBulkTracker or None
+        :rtype: None
+        """
+        self.bulk_tracker = bulk_tracker
+
+    def set_dispatcher(self, dispatcher):
+        """
+        Send the tracking requests from background threads. The do_track_*()
+        methods will queue the request and return right away, they return
+        False if the dispatcher dropped the request.
+
+        The time the request was queued is sent as the tracking time, so
+        the delay doesn't show up in Piwik.
+
+        :param dispatcher: Dispatcher, None to send requests directly
+        :type dispatcher: piwikapi.dispatch.PiwikDispatcher,
+            piwikapi.spool.PiwikSpool or None
+        :rtype: None
+        """
+        self.dispatcher = dispatcher
+
+    def set_cookie_jar(self, cookie_jar):
+        """
+        Store the cookies Piwik sets in a jar, e.g. one shared with other
+        trackers. By default every tracker creates its own jar.
+
+        :param cookie_jar: Cookie jar
+        :type cookie_jar: piwikapi.cookies.VisitorCookieJar
+        :rtype: None
+        """
+        self.cookie_jar = cookie_jar
+
+    def set_sampler(self, sampler):
+        """
+        Only track the visitors a sampler keeps. The do_track_*() methods
+        return False for the hits that are sampled out, the capture_*()
+        methods return None.
+
+        :param sampler: Sampler, None to track every hit
+        :type sampler: piwikapi.sampling.VisitorSampler or None
+        :rtype: None
+        """
+        self.sampler = sampler
+
+    def set_deduplicator(self, deduplicator):
+        """
+        Don't track hits a deduplicator has seen before. The do_track_*()
+        methods return False for them, the capture_*() methods return None.
+
+        :param deduplicator: Deduplicator, None to track every hit
+        :type deduplicator: piwikapi.dedup.HitDeduplicator or None
+        :rtype: None
+        """
+        self.deduplicator = deduplicator
+
+    def set_metrics(self, metrics):
+        """
+        Report hits, request latencies and errors to a metrics sink
+
+        :param metrics: Metrics sink, None to report nothing
+        :type metrics: piwikapi.metrics.Metrics or None
+        :rtype: None
+        """
+        self.metrics = metrics
+
+    def set_profiler(self, profiler):
+        """
+        Record how long the phases of the do_track_*() and capture_*() calls
+        take
+
+        :param profiler: Profiler, None to not profile
+        :type profiler: piwikapi.profiling.PhaseProfiler or None
+        :rtype: None
+        """
+        self.profiler = profiler
+
+    def set_transport(self, transport):
+        """
+        Set the transport used to send the tracking requests. By default the
+        connection pool shared by all trackers is used.
+
+        :param transport: Transport, None for the shared connection pool
+        :type transport: piwikapi.transport.HTTPConnectionPool or None
+        :rtype: None
+        """
+        self.transport = transport
+
+    def _get_transport(self):
+        """
+        :rtype: piwikapi.transport.HTTPConnectionPool
+        """
+        if self.transport is None:
+            return get_default_pool()
+        return self.transport
+
     def __set_request_cookie(self, cookie):
         """
         Set the request cookie, for testing purposes
@@ -376,6 +780,15 @@ class PiwikTracker(object):
             r = datetime.datetime.now()
         return r
 
+    def _get_forced_timestamp(self):
+        """
+        Returns the datetime set through set_force_visit_date_time() as a
+        Unix timestamp, naive datetimes are in UTC
+
+        :rtype: int
+        """
+        return calendar.timegm(self.forced_datetime.utctimetuple())
+
     def _get_request(self, id_site):
         """
         This oddly named method returns the query var string.
@@ -384,32 +797,81 @@ class PiwikTracker(object):
         :type id_site: int
         :rtype: str
         """
-        query_vars = {
-            'idsite': id_site,
-            'rec': 1,
-            'apiv': self.VERSION,
-            'rand': random.randint(0, 99999),
-            'url': self.page_url,
-            'urlref': self.referer,
-            'id': self.visitor_id,
-        }
+        head, middle, tail = self._get_static_query(id_site)
         if self.ip:
-            query_vars['cip'] = self.ip
-        if self.token_auth:
-            query_vars['token_auth'] = self.token_auth
+            middle = '&cip=' + _quote(self.ip) + middle
+        url = '%s&rand=%d&url=%s&urlref=%s&id=%s%s' % (
+            head, random.randint(0, 99999), _quote_cached(self.page_url),
+            _quote_cached(self.referer), _quote(self.visitor_id), middle)
+        url += self._get_custom_var_query() + tail
+        if self.forced_datetime:
+            url += '&cdt=%d' % self._get_forced_timestamp()
+        if self.debug_append_url:
+            url += self.debug_append_url
+        return url
+
+    def _get_custom_var_query(self):
+        """
+        Returns the encoded custom variables
+
+        The result is reused until custom_var_version changes, the trackers
+        of a PiwikTrackerTemplate share it. Bump custom_var_version if you
+        change or replace the dicts without set_custom_variable().
+
+        :rtype: str
+        """
+        cached = self._custom_var_query
+        if cached is not None and cached[0] == self.custom_var_version:
+            return cached[1]
+        timer = self._phase_timer
+        if timer is not None:
+            timer.mark('encode')
+        query = ''
+        if self.page_custom_var:
+            query += '&cvar=' + _quote(json.dumps(self.page_custom_var))
+        if self.visitor_custom_var:
+            query += '&_cvar=' + _quote(json.dumps(self.visitor_custom_var))
+        if timer is not None:
+            timer.mark('json')
+        self._custom_var_query = (self.custom_var_version, query)
+        return query
+
+    def _get_static_query(self, id_site):
+        """
+        Returns the encoded parameters that don't change between hits
+
+        The parameters are encoded again when one of them changed. The
+        parameters come in the same order as when the whole query string
+        was encoded at once, the visitor IP goes in front of the middle
+        segment.
+
+        :param id_site: Site ID
+        :type id_site: int
+        :rtype: tuple of (head, middle, tail) query string segments
+        """
+        # A bulk request sends the token once for all of its hits
+        token_auth = self.token_auth
+        if self.dispatcher is None and self.bulk_tracker is not None and \
+                self.bulk_tracker.token_auth:
+            token_auth = None
+        key = (id_site, self.VERSION, token_auth,
+               self.has_cookies, self.width, self.height,
+               self.forced_visitor_id, tuple(self.plugins.items()),
+               tuple(self.attribution_info))
+        if self._static_query is not None and self._static_query[0] == key:
+            return self._static_query[1]
+        head = urlencode([('idsite', id_site), ('rec', 1),
+                          ('apiv', self.VERSION)])
+        middle = []
+        if token_auth:
+            middle.append(('token_auth', token_auth))
         if self.has_cookies:
-            query_vars['cookie'] = 1
+            middle.append(('cookie', 1))
         if self.width and self.height:
-            query_vars['res'] = '%dx%d' % (self.width, self.height)
+            middle.append(('res', '%dx%d' % (self.width, self.height)))
         if self.forced_visitor_id:
-            query_vars['cid'] = self.forced_visitor_id
-        if self.page_custom_var:
-            query_vars['cvar'] = json.dumps(self.page_custom_var)
-        if self.visitor_custom_var:
-            query_vars['_cvar'] = json.dumps(self.visitor_custom_var)
-        if len(self.plugins):
-            for plugin, version in self.plugins.items():
-                query_vars[plugin] = version
+            middle.append(('cid', self.forced_visitor_id))
+        tail = list(self.plugins.items())
         if len(self.attribution_info):
             for i, var in {
                 0: '_rcn',
@@ -417,11 +879,41 @@ class PiwikTracker(object):
                 2: '_refts',
                 3: '_ref',
             }.items():
-                query_vars[var] = quote(self.attribution_info[i])
+                tail.append((var, quote(self.attribution_info[i])))
+        segments = (head,
+                    middle and '&' + urlencode(middle) or '',
+                    tail and '&' + urlencode(tail) or '')
+        self._static_query = (key, segments)
+        return segments
 
-        url = urlencode(query_vars)
-        if self.debug_append_url:
-            url += self.debug_append_url
+    def _get_bulk_query_string(self, url):
+        """
+        Returns the query string for a bulk tracking request, the headers we
+        would send are added as parameters.
+
+        :param url: Query string as built by _get_request()
+        :type url: str
+        :rtype: str
+        """
+        if self.user_agent:
+            url += '&ua=' + _quote_cached(self.user_agent)
+        if self.accept_language:
+            url += '&lang=' + _quote_cached(self.accept_language)
+        return url
+
+    def _get_dispatch_query_string(self, url):
+        """
+        Returns the query string for a request that is sent later. Like
+        _get_bulk_query_string(), with the current time added unless a time
+        was forced.
+
+        :param url: Query string as built by _get_request()
+        :type url: str
+        :rtype: str
+        """
+        url = self._get_bulk_query_string(url)
+        if not self.forced_datetime:
+            url += '&cdt=%d' % time.time()
         return url
 
     def __get_url_track_page_view(self, document_title=''):
@@ -435,7 +927,7 @@ class PiwikTracker(object):
         """
         url = self._get_request(self.id_site)
         if document_title:
-            url += '&%s' % urlencode({'action_name': document_title})
+            url += '&action_name=' + _quote(document_title)
         return url
 
     def __get_url_track_action(self, action_url, action_type):
@@ -451,28 +943,68 @@ class PiwikTracker(object):
 
     def __get_cookie_matching_name(self, name):
         """
-        **NOT SUPPORTED**
+        Get the value of the Piwik cookie whose name starts with the prefix
+        and name, e.g. ``_pk_id.1.`` for name ``id.1.``
 
-        Get a cookie's value by name
+        The Piwik cookies of the request are indexed on first use, from
+        request.COOKIES or the Cookie header.
 
-        :param name: Cookie name
+        :param name: Cookie name without the prefix
         :type name: str
-        :rtype: str
+        :rtype: str or False
         """
-        logging.warn(self.UNSUPPORTED_WARNING % '__get_cookie_matching_name()')
-        cookie_value = False
-        if self.request.COOKIES:
-            for name in self.request.COOKIES:
-                #print 'cookie name', name
-                #print 'cookie is', cookie_value
-                cookie_value = self.request.COOKIES[name]
-        #print self.request.COOKIES
-        return cookie_value
+        cookies = self._cookies
+        if cookies is None:
+            cookies = getattr(self.request, 'COOKIES', None)
+            if cookies:
+                cookies = cookies.items()
+            else:
+                cookies = _parse_cookie_header(
+                    self.request.META.get('HTTP_COOKIE', ''))
+            cookies = self._cookies = _index_cookies(cookies,
+                                                     self.COOKIE_NAME_PREFIX)
+        return cookies.get(tuple(name.split('.', 2)[:2]), False)
 
-    def get_visitor_id(self):
+    def __get_decoded_cookie(self, name, decode):
         """
-        **PARTIAL, no cookie support**
+        Returns a decoded Piwik cookie, the result is cached for the request
+
+        :param name: Cookie name without the prefix
+        :type name: str
+        :param decode: Decodes the cookie value, raises ValueError
+        :type decode: callable
+        :rtype: The decoded value or False
+        """
+        decoded = self._decoded_cookies
+        if decoded is None:
+            decoded = self._decoded_cookies = {}
+        try:
+            return decoded[name]
+        except KeyError:
+            pass
+        value = self.__get_cookie_matching_name(name)
+        if value:
+            try:
+                value = decode(value)
+            except ValueError:
+                value = False
+        decoded[name] = value
+        return value
+
+    def get_visitor_info(self):
+        """
+        Returns the visitor ID and visit counters of the visitor's Piwik
+        cookie. The counters are Unix timestamps, except ``visit_count``.
+
+        :rtype: dict with the keys visitor_id, created, visit_count,
+            current_visit, last_visit and last_ecommerce_order, or False if
+            there is no valid cookie
+        """
+        return self.__get_decoded_cookie('id.%s.' % self.id_site,
+                                         _decode_id_cookie)
 
+    def get_visitor_id(self):
+        """
         If the user initiating the request has the Piwik first party cookie,
         this function will try and return the ID parsed from this first party
         cookie.
@@ -488,50 +1020,27 @@ class PiwikTracker(object):
         :rtype: str
         """
         if self.forced_visitor_id:
-            visitor_id = self.forced_visitor_id
-        else:
-            logging.warn(self.UNSUPPORTED_WARNING % 'get_visitor_id()')
-            id_cookie_name = 'id.%s.' % self.id_site
-            id_cookie = self.__get_cookie_matching_name(id_cookie_name)
-            visitor_id = self.visitor_id
-            if id_cookie:
-                #print 'id_cookie is', id_cookie
-                visitor_id = id_cookie
-                #$visitorId = substr($idCookie, 0, strpos($idCookie, '.'));
-                #if(strlen($visitorId) == self::LENGTH_VISITOR_ID)
-                #{
-                #    return $visitorId;
-        return visitor_id
+            return self.forced_visitor_id
+        visitor_info = self.get_visitor_info()
+        if visitor_info:
+            return visitor_info['visitor_id']
+        return self.visitor_id
 
     def get_attribution_info(self):
         """
-        **NOT SUPPORTED**
-
-        To support this we'd need to parse the cookies in the request obejct.
-        Not sure if this makes sense...
-
         Return the currently assigned attribution info stored in a first party
         cookie.
 
         This method only works if the user is initiating the current request
-        and his cookies can be read by this API.
+        and his cookies can be read by this API. Pass the result to
+        set_attribution_info() to attribute a goal conversion.
 
         :rtype: string, JSON encoded string containing the referer info for
-            goal conversion attribution
-        """
-        logging.warn(self.UNSUPPORTED_WARNING % 'get_attribution_info()')
-        attribution_cookie_name = 'ref.%d.' % self.id_site
-        return self.__get_cookie_matching_name(attribution_cookie_name)
-
-    def __get_random_string(self, length=500):
+            goal conversion attribution, or False
         """
-        Return a random string
-
-        :param length: Length
-        :type length: inte
-        :rtype: str
-        """
-        return md5(os.urandom(length)).hexdigest()
+        if self.__get_decoded_cookie('ref.%s.' % self.id_site, json.loads):
+            return self.__get_cookie_matching_name('ref.%s.' % self.id_site)
+        return False
 
     def get_random_visitor_id(self):
         """
@@ -539,21 +1048,20 @@ class PiwikTracker(object):
 
         :rtype: str
         """
-        visitor_id = self.__get_random_string()
-        return visitor_id[:self.LENGTH_VISITOR_ID]
+        return get_visitor_id()
 
     def disable_cookie_support(self):
         """
-        **NOT TESTED**
-
         By default, PiwikTracker will read third party cookies from the
-        response and sets them in the next request.
+        response and sets them in the next request of the same visitor, see
+        piwikapi.cookies.VisitorCookieJar. This turns that off.
 
         :rtype: None
         """
-        logging.warn(self.UNSUPPORTED_WARNING % 'disable_cookie_support()')
         self.cookie_support = False
+        self.cookie_jar = None
 
+    @_profiled
     def do_track_page_view(self, document_title):
         """
         Track a page view, return the request body
@@ -562,9 +1070,13 @@ class PiwikTracker(object):
         :type document_title: str
         :rtype: str
         """
+        if self._is_dropped(TrackingEvent.PAGE_VIEW,
+                            (document_title,)):
+            return self._get_local_response()
         url = self.__get_url_track_page_view(document_title)
         return self._send_request(url)
 
+    @_profiled
     def do_track_action(self, action_url, action_type):
         """
         Track a download or outlink
@@ -578,43 +1090,278 @@ class PiwikTracker(object):
         """
         if action_type not in ('download', 'link'):
             raise InvalidParameter("Illegal action parameter %s" % action_type)
+        if self._is_dropped(TrackingEvent.ACTION,
+                            (action_url, action_type)):
+            return self._get_local_response()
         url = self.__get_url_track_action(action_url, action_type)
         return self._send_request(url)
 
+    def _is_dropped(self, kind, arguments):
+        """
+        Returns True if the sampler drops the hit or the deduplicator
+        suppresses it
+
+        :param kind: Event kind
+        :type kind: str
+        :param arguments: Arguments of the do_track_*() method
+        :type arguments: tuple
+        :rtype: bool
+        """
+        if self.profiler is None:
+            return self.__is_dropped(kind, arguments)
+        timer = self._phase_timer = self.profiler.start()
+        dropped = self.__is_dropped(kind, arguments)
+        timer.mark('filter')
+        if dropped:
+            self._phase_timer = None
+            timer.finish()
+        return dropped
+
+    def __is_dropped(self, kind, arguments):
+        """
+        See _is_dropped()
+
+        :rtype: bool
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.increment('tracking.hits.' + kind)
+        if self.sampler is None and self.deduplicator is None:
+            return False
+        visitor_id = self.get_visitor_id()
+        if self.sampler is not None and \
+                not self.sampler.keep(self.id_site, visitor_id, kind):
+            dropped = True
+        else:
+            dropped = self.deduplicator is not None and \
+                self.deduplicator.is_duplicate(self.id_site, visitor_id,
+                                               self.page_url, kind, arguments)
+        if dropped and metrics is not None:
+            metrics.increment('tracking.dropped.' + kind)
+        return dropped
+
+    def _get_local_response(self, result=False):
+        """
+        Returns what the do_track_*() methods return for a hit the tracker
+        doesn't send itself
+
+        :param result: Result, False for a dropped hit
+        :type result: bool
+        :rtype: bool
+        """
+        return result
+
+    def _capture(self, kind, arguments, ecommerce_items=None):
+        """
+        Returns a TrackingEvent with the current state of the tracker
+
+        :param kind: Event kind
+        :type kind: str
+        :param arguments: Arguments of the do_track_*() method
+        :type arguments: tuple
+        :param ecommerce_items: Items of a cart update or order
+        :type ecommerce_items: tuple or None
+        :rtype: TrackingEvent or None if the hit was dropped
+        """
+        if self._is_dropped(kind, arguments):
+            return None
+        # The setters change the dicts in place, the event needs copies
+        state = (self.id_site, self.page_url, self.referer, self.visitor_id,
+                 self.ip, self.token_auth, self.has_cookies, self.width,
+                 self.height, self.forced_visitor_id,
+                 dict(self.page_custom_var), dict(self.visitor_custom_var),
+                 dict(self.plugins), self.attribution_info,
+                 self.debug_append_url, self.user_agent, self.accept_language)
+        timestamp = None
+        if self.forced_datetime:
+            timestamp = self._get_forced_timestamp()
+        event = TrackingEvent(kind, arguments, state, ecommerce_items,
+                              timestamp, self.get_visitor_id())
+        timer = self._phase_timer
+        if timer is not None:
+            self._phase_timer = None
+            timer.mark('capture')
+            timer.finish()
+        return event
+
+    @_profiled
+    def capture_page_view(self, document_title):
+        """
+        Like do_track_page_view(), but returns a TrackingEvent instead of
+        sending the request
+
+        :param document_title: The title of the page the user is on
+        :type document_title: str
+        :rtype: TrackingEvent
+        """
+        return self._capture(TrackingEvent.PAGE_VIEW, (document_title,))
+
+    @_profiled
+    def capture_action(self, action_url, action_type):
+        """
+        Like do_track_action(), but returns a TrackingEvent instead of
+        sending the request
+
+        :param action_url: URL of the download or outlink
+        :type action_url: str
+        :param action_type: Type of the action, either 'download' or 'link'
+        :type action_type: str
+        :raises: InvalidParameter if action type is unknown
+        :rtype: TrackingEvent
+        """
+        if action_type not in ('download', 'link'):
+            raise InvalidParameter("Illegal action parameter %s" % action_type)
+        return self._capture(TrackingEvent.ACTION, (action_url, action_type))
+
+    def _get_event_url(self, kind, arguments):
+        """
+        Returns the query string for a captured event, the tracker must hold
+        the event's state
+
+        :param kind: Event kind
+        :type kind: str
+        :param arguments: Arguments of the do_track_*() method
+        :type arguments: tuple
+        :raises: InvalidParameter if the tracker can't track the event
+        :rtype: str
+        """
+        if kind == TrackingEvent.PAGE_VIEW:
+            return self.__get_url_track_page_view(*arguments)
+        if kind == TrackingEvent.ACTION:
+            return self.__get_url_track_action(*arguments)
+        raise InvalidParameter("%s can't track %s events" %
+                               (self.__class__.__name__, kind))
+
     def _send_request(self, url):
         """
         Make the tracking API request, return the request body
 
+        If a dispatcher was set the request is queued there and True is
+        returned, False if the dispatcher dropped it. If a bulk tracker was
+        set the request is queued there and its BulkTrackingResult is
+        returned. If the image response was disabled a TrackingResponse is
+        returned.
+
         :param url: TODO
         :type url: str
         :raises: ConfigurationError if the API URL was not set
+        :rtype: str, bool, BulkTrackingResult or TrackingResponse
+        """
+        timer = self._phase_timer
+        if timer is None:
+            return self.__send_request(url)
+        self._phase_timer = None
+        timer.mark('encode')
+        try:
+            return self.__send_request(url)
+        finally:
+            if self.dispatcher is not None or self.bulk_tracker is not None:
+                timer.mark('enqueue')
+            else:
+                timer.mark('request')
+            timer.finish()
+
+    def __send_request(self, url):
+        """
+        See _send_request()
+
+        :rtype: str, bool, BulkTrackingResult or TrackingResponse
+        """
+        if self.metrics is not None:
+            self.metrics.increment('tracking.bytes_encoded', len(url))
+        if self.dispatcher is not None:
+            return self.dispatcher.add(self._get_dispatch_query_string(url))
+        if self.bulk_tracker is not None:
+            return self.bulk_tracker.add(self._get_bulk_query_string(url))
+        url = self._get_tracking_url(url)
+        started = time.time()
+        try:
+            response = self._get_transport().request(
+                'GET', url, headers=self._get_request_headers())
+        except Exception as e:
+            self._record_error(e)
+            raise
+        return self._get_response(response, url, started)
+
+    def _record_error(self, error):
+        """
+        Count a failed tracking request
+
+        :param error: The exception
+        :type error: Exception
+        :rtype: None
+        """
+        if self.metrics is not None:
+            self.metrics.increment('tracking.errors.' +
+                                   error.__class__.__name__)
+
+    def _get_tracking_url(self, url):
+        """
+        Returns the URL of the tracking API request
+
+        :param url: Query string
+        :type url: str
+        :raises: ConfigurationError if the API URL was not set
         :rtype: str
         """
         if not self.api_url:
             raise ConfigurationError('API URL not set')
         parsed = urlparse(self.api_url)
         url = "%s://%s%s?%s" % (parsed.scheme, parsed.netloc, parsed.path, url)
-        request = Request(url)
-        request.add_header('User-Agent', self.user_agent)
-        request.add_header('Accept-Language', self.accept_language)
+        if not self.send_image:
+            url += '&send_image=0'
+        return url
+
+    def _get_request_headers(self):
+        """
+        Returns the headers of the tracking API request
+
+        :rtype: dict
+        """
+        headers = {
+            'User-Agent': self.user_agent,
+            'Accept-Language': self.accept_language,
+        }
         if not self.cookie_support:
             self.request_cookie = ''
         elif self.request_cookie != '':
-            #print 'Adding cookie', self.request_cookie
-            request.add_header('Cookie', self.request_cookie)
-
-        response = urlopen(request)
-        #print response.info()
-        body = response.read()
-        # The cookie in the response will be set in the next request
-        #for header, value in response.getheaders():
-        #    # TODO handle cookies
-        #    # set cookie to la
-        #	# in case several cookies returned, we keep only the latest one
-        #    # (ie. XDEBUG puts its cookie first in the list)
-        #    #print header, value
-        #    self.request_cookie = ''
+            headers['Cookie'] = self.request_cookie
+        elif self.cookie_jar is not None:
+            cookie = self.cookie_jar.get(self.get_visitor_id())
+            if cookie is not None:
+                headers['Cookie'] = cookie
+        return headers
 
+    def _get_response(self, response, url, started):
+        """
+        Returns what the do_track_*() methods return for a response
+
+        :param response: The tracking API response
+        :type response: piwikapi.transport.Response
+        :param url: The request URL
+        :type url: str
+        :param started: Time the request was started
+        :type started: float
+        :rtype: str or TrackingResponse
+        """
+        body = response.body
+        if self.metrics is not None:
+            self.metrics.increment('tracking.bytes_sent', len(url))
+            self.metrics.timing('tracking.latency', time.time() - started)
+        if self.cookie_support:
+            # The cookie in the response will be set in the next request
+            cookie = VisitorCookieJar.get_cookie(
+                response.getheaders('Set-Cookie'))
+            if cookie is not None:
+                if self.cookie_jar is None:
+                    self.cookie_jar = VisitorCookieJar()
+                self.cookie_jar.set(self.get_visitor_id(), cookie)
+        if not self.send_image:
+            debug_output = None
+            if self.debug_append_url and body:
+                debug_output = body.decode('utf-8', 'replace')
+            return TrackingResponse(response.status, time.time() - started,
+                                    len(url), debug_output)
         # Work around urllib updates, we need a string
         if sys.version_info[0] >= 3 and type(body) == bytes:
             body = str(body)
@@ -641,12 +1388,29 @@ class PiwikTracker(object):
             raise InvalidParameter("Parameter id must be int, not %s" %
                                    type(id))
         if scope == 'page':
-            self.page_custom_var[id] = (name, value)
+            self._set_custom_var(self.page_custom_var, id, (name, value))
         elif scope == 'visit':
-            self.visitor_custom_var[id] = (name, value)
+            self._set_custom_var(self.visitor_custom_var, id, (name, value))
         else:
             raise InvalidParameter("Invalid scope parameter value %s" % scope)
 
+    def _set_custom_var(self, custom_vars, id, value):
+        """
+        Set a custom variable slot, bumps custom_var_version if the value
+        changed
+
+        :param custom_vars: page_custom_var or visitor_custom_var
+        :type custom_vars: dict
+        :param id: Custom variable slot ID
+        :type id: int
+        :param value: Variable name and value
+        :type value: tuple of (name, value)
+        :rtype: None
+        """
+        if custom_vars.get(id) != value:
+            custom_vars[id] = value
+            self.custom_var_version += 1
+
     def set_plugins(self, **kwargs):
         """
         Set supported plugins
@@ -669,9 +1433,8 @@ class PiwikTracker(object):
 
     def get_custom_variable(self, id, scope='visit'):
         """
-        **PARTIAL, no cookie support**
-
-        Returns the current custom variable stored in a first party cookie.
+        Returns a custom variable that was set, visit scope variables are
+        read from the visitor's first party cookie otherwise.
 
         :param id: Custom variable slot ID, 1-5
         :type id: int
@@ -685,29 +1448,21 @@ class PiwikTracker(object):
         if scope == 'page':
             r = self.page_custom_var[id]
         elif scope == 'visit':
-            if self.visitor_custom_var[id]:
+            if self.visitor_custom_var.get(id):
                 r = self.visitor_custom_var[id]
             else:
-                logging.warn(self.UNSUPPORTED_WARNING %
-                             'get_custom_variable()')
-                # TODO test this code...
                 custom_vars_cookie = 'cvar.%d.' % self.id_site
-                cookie = self.__get_cookie_matching_name(custom_vars_cookie)
-                if not cookie:
+                cookie_decoded = self.__get_decoded_cookie(custom_vars_cookie,
+                                                           json.loads)
+                # The JavaScript tracker uses string keys
+                if not isinstance(cookie_decoded, dict):
+                    r = False
+                elif str(id) not in cookie_decoded:
+                    r = False
+                elif len(cookie_decoded[str(id)]) != 2:
                     r = False
                 else:
-                    cookie_decoded = json.loads(cookie)
-                    #$cookieDecoded = json_decode($cookie, $assoc = true);
-                    #print 'decoded cookie json', cookie_decode
-                    #print 'decoded cookie json', repr(cookie_decode)
-                    if type(cookie_decoded) == type(list()):
-                        r = False
-                    elif id not in cookie_decoded:
-                        r = False
-                    elif len(cookie_decoded[id]) != 2:
-                        r = False
-                    else:
-                        r = cookie_decoded[id]
+                    r = cookie_decoded[str(id)]
         else:
             raise InvalidParameter("Invalid scope parameter value %s" % scope)
         return r
@@ -719,8 +1474,30 @@ class PiwikTrackerEcommerce(PiwikTracker):
     """
     def __init__(self, id_site, request):
         self.ecommerce_items = {}
+        self._category_json = None
+        self.cart_coalescer = None
         super(PiwikTrackerEcommerce, self).__init__(id_site, request)
 
+    def set_cart_coalescer(self, cart_coalescer):
+        """
+        Hold cart updates in a coalescer, which only sends the latest cart
+        of a visitor. do_track_ecommerce_cart_update() then returns False
+        if the cart didn't change and True otherwise.
+
+        :param cart_coalescer: Coalescer, None to send every cart update
+        :type cart_coalescer: piwikapi.cart.CartCoalescer or None
+        :rtype: None
+        """
+        self.cart_coalescer = cart_coalescer
+
+    def _flush_cart(self):
+        """
+        Send the held cart update of the visitor before an order
+
+        :rtype: None
+        """
+        self.cart_coalescer.flush_visitor(self.id_site, self.get_visitor_id())
+
     def __get_url_track_ecommerce_order(self, order_id, grand_total,
                                       sub_total=False, tax=False,
                                       shipping=False, discount=False):
@@ -810,7 +1587,12 @@ class PiwikTrackerEcommerce(PiwikTracker):
         if len(self.ecommerce_items):
             # Remove the SKU index in the list before JSON encoding
             items = list(self.ecommerce_items.values())
+            timer = self._phase_timer
+            if timer is not None:
+                timer.mark('encode')
             args['ec_items'] = json.dumps(items)
+            if timer is not None:
+                timer.mark('json')
         self.ecommerce_items.clear()
         url += '&%s' % urlencode(args)
         return url
@@ -860,6 +1642,7 @@ class PiwikTrackerEcommerce(PiwikTracker):
             quantity,
         )
 
+    @_profiled
     def do_track_ecommerce_cart_update(self, grand_total):
         """
         Track a cart update (add/remove/update item)
@@ -874,10 +1657,20 @@ class PiwikTrackerEcommerce(PiwikTracker):
         :type grand_total: float
         :rtype: str
         """
+        if self.cart_coalescer is not None:
+            event = self.capture_ecommerce_cart_update(grand_total)
+            if event is None:
+                return self._get_local_response()
+            return self._get_local_response(self.cart_coalescer.add(event))
+        if self._is_dropped(TrackingEvent.CART_UPDATE,
+                            (grand_total,)):
+            self.ecommerce_items.clear()
+            return self._get_local_response()
         # FIXME
         url = self.__get_url_track_ecommerce_cart_update(grand_total)
         return self._send_request(url)
 
+    @_profiled
     def do_track_ecommerce_order(self, order_id, grand_total, sub_total=False,
                                   tax=False, shipping=False, discount=False):
         """
@@ -905,11 +1698,19 @@ class PiwikTrackerEcommerce(PiwikTracker):
         :type discount: float or None
         :rtype: str
         """
+        if self.cart_coalescer is not None:
+            self._flush_cart()
+        if self._is_dropped(TrackingEvent.ORDER,
+                            (order_id, grand_total, sub_total, tax, shipping,
+                             discount)):
+            self.ecommerce_items.clear()
+            return self._get_local_response()
         url = self.__get_url_track_ecommerce_order(order_id, grand_total,
                                                    sub_total, tax, shipping,
                                                    discount)
         return self._send_request(url)
 
+    @_profiled
     def do_track_goal(self, id_goal, revenue=False):
         """
         Record a goal conversion
@@ -920,9 +1721,78 @@ class PiwikTrackerEcommerce(PiwikTracker):
         :type revenue: int (TODO why int here and not float!?)
         :rtype: str
         """
+        if self._is_dropped(TrackingEvent.GOAL, (id_goal, revenue)):
+            return self._get_local_response()
         url = self.__get_url_track_goal(id_goal, revenue)
         return self._send_request(url)
 
+    def __capture_items(self):
+        """
+        Takes the items from the tracker like sending a cart update or order
+        does
+
+        :rtype: tuple
+        """
+        items = tuple(self.ecommerce_items.values())
+        self.ecommerce_items = {}
+        return items
+
+    @_profiled
+    def capture_goal(self, id_goal, revenue=False):
+        """
+        Like do_track_goal(), but returns a TrackingEvent
+
+        :param id_goal: Goal ID
+        :type id_goal: int
+        :param revenue: Revenue for this conversion
+        :type revenue: int
+        :rtype: TrackingEvent
+        """
+        return self._capture(TrackingEvent.GOAL, (id_goal, revenue))
+
+    @_profiled
+    def capture_ecommerce_cart_update(self, grand_total):
+        """
+        Like do_track_ecommerce_cart_update(), but returns a TrackingEvent
+
+        :param grand_total: Grand total revenue of the transaction,
+            including taxes, shipping, etc.
+        :type grand_total: float
+        :rtype: TrackingEvent
+        """
+        return self._capture(TrackingEvent.CART_UPDATE, (grand_total,),
+                             self.__capture_items())
+
+    @_profiled
+    def capture_ecommerce_order(self, order_id, grand_total, sub_total=False,
+                                tax=False, shipping=False, discount=False):
+        """
+        Like do_track_ecommerce_order(), but returns a TrackingEvent
+
+        :rtype: TrackingEvent
+        """
+        self.ecommerce_last_order_timestamp = self._get_timestamp()
+        return self._capture(TrackingEvent.ORDER,
+                             (order_id, grand_total, sub_total, tax, shipping,
+                              discount),
+                             self.__capture_items())
+
+    def _get_event_url(self, kind, arguments):
+        """
+        Returns the query string for a captured event, see
+        PiwikTracker._get_event_url()
+
+        :rtype: str
+        """
+        if kind == TrackingEvent.GOAL:
+            return self.__get_url_track_goal(*arguments)
+        if kind == TrackingEvent.CART_UPDATE:
+            return self.__get_url_track_ecommerce_cart_update(*arguments)
+        if kind == TrackingEvent.ORDER:
+            return self.__get_url_track_ecommerce_order(*arguments)
+        return super(PiwikTrackerEcommerce, self)._get_event_url(kind,
+                                                                arguments)
+
     def set_ecommerce_view(self, sku=False, name=False, category=False,
                            price=False):
         """
@@ -952,18 +1822,32 @@ class PiwikTrackerEcommerce(PiwikTracker):
         """
         if category:
             if type(category) == type(list()):
-                category = json.dumps(category)
+                category = self.__get_category_json(category)
         else:
             category = ''
-        self.page_custom_var[5] = ('_pkc', category)
+        self._set_custom_var(self.page_custom_var, 5, ('_pkc', category))
         if price:
-            self.page_custom_var[2] = ('_pkp', price)
+            self._set_custom_var(self.page_custom_var, 2, ('_pkp', price))
         # On a category page do not record "Product name not defined"
         if sku and name:
             if sku:
-                self.page_custom_var[3] = ('_pks', sku)
+                self._set_custom_var(self.page_custom_var, 3, ('_pks', sku))
             if name:
-                self.page_custom_var[4] = ('_pkn', name)
+                self._set_custom_var(self.page_custom_var, 4, ('_pkn', name))
+
+    def __get_category_json(self, categories):
+        """
+        Returns the JSON encoded categories, reuses the last result if the
+        categories didn't change
+
+        :param categories: Categories
+        :type categories: list
+        :rtype: str
+        """
+        key = tuple(categories)
+        if self._category_json is None or self._category_json[0] != key:
+            self._category_json = (key, json.dumps(categories))
+        return self._category_json[1]
 
 
 def piwik_get_url_track_page_view(id_site, request, document_title=''):
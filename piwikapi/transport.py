@@ -0,0 +1,430 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import collections
+import errno
+from io import BytesIO
+import socket
+import threading
+import time
+import zlib
+try:
+    from http.client import BadStatusLine, HTTPConnection, HTTPSConnection
+    from http.client import HTTPException
+    from urllib.error import HTTPError
+    from urllib.parse import urljoin, urlparse
+    from urllib.request import Request, urlopen
+except ImportError:
+    from httplib import BadStatusLine, HTTPConnection, HTTPSConnection
+    from httplib import HTTPException
+    from urllib2 import HTTPError, Request, urlopen
+    from urlparse import urljoin, urlparse
+
+from .exceptions import ConfigurationError
+from .profiling import now_ns
+
+
+def gzip_compress(data, level=6):
+    """
+    Returns data in gzip format, for ``Content-Encoding: gzip`` bodies
+
+    :param data: Data
+    :type data: bytes
+    :param level: Compression level from 1 (fastest) to 9 (smallest)
+    :type level: int
+    :rtype: bytes
+    """
+    # gzip.compress() doesn't exist on Python 2, a wbits value of 16 plus
+    # the window size makes zlib write the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def get_endpoint(url):
+    """
+    Returns the scheme, host and port of an URL
+
+    :param url: URL
+    :type url: str
+    :raises: ConfigurationError if the URL isn't a HTTP(S) URL
+    :rtype: tuple of (scheme, host, port)
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'https':
+        port = parsed.port or 443
+    elif parsed.scheme == 'http':
+        port = parsed.port or 80
+    else:
+        raise ConfigurationError("Unsupported URL %s" % url)
+    return parsed.scheme, parsed.hostname, port
+
+
+class Response(object):
+    """
+    A completely read HTTP response
+    """
+    def __init__(self, url, status, reason, headers, body):
+        """
+        :param url: The requested URL
+        :type url: str
+        :param status: HTTP status code
+        :type status: int
+        :param reason: HTTP reason phrase
+        :type reason: str
+        :param headers: Response headers
+        :type headers: list of (str, str) tuples
+        :param body: Response body
+        :type body: bytes
+        :rtype: None
+        """
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getheader(self, name, default=None):
+        """
+        Return the first value of a header
+
+        :param name: Header name, case insensitive
+        :type name: str
+        :param default: Returned if the header is missing
+        :rtype: str
+        """
+        values = self.getheaders(name)
+        if values:
+            return values[0]
+        return default
+
+    def getheaders(self, name):
+        """
+        Return all values of a header, e.g. for Set-Cookie
+
+        :param name: Header name, case insensitive
+        :type name: str
+        :rtype: list of str
+        """
+        name = name.lower()
+        return [value for header, value in self.headers
+                if header.lower() == name]
+
+    def read(self):
+        """
+        Returns the body, like the file-like object urlopen() returns
+
+        :rtype: bytes
+        """
+        return self.body
+
+
+class HTTPConnectionPool(object):
+    """
+    Keeps HTTP connections to the Piwik server open between requests
+
+    Connections are kept per scheme, host and port. At most ``max_size``
+    idle connections are kept for each of them, connections that were idle
+    for longer than ``idle_timeout`` seconds are closed instead of reused.
+    The pool can be shared between threads.
+
+    A request that fails on a reused connection is sent again on a new one
+    if the server closed the connection before it read the request, e.g.
+    because it was idle for too long. GET and HEAD requests are sent again
+    after any connection error other than a timeout.
+    """
+    #: Status codes we follow the Location header for
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+    #: Methods that are sent again on a new connection after any
+    #: connection error
+    IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+    #: Maximum number of redirects to follow
+    MAX_REDIRECTS = 5
+
+    def __init__(self, max_size=10, idle_timeout=30, timeout=10,
+                 profiler=None):
+        """
+        :param max_size: Maximum number of idle connections per host
+        :type max_size: int
+        :param idle_timeout: Seconds after which idle connections are closed
+        :type idle_timeout: float
+        :param timeout: Socket timeout in seconds, None to wait forever
+        :type timeout: float or None
+        :param profiler: Records how long connecting, sending and reading
+            take
+        :type profiler: piwikapi.profiling.PhaseProfiler or None
+        :rtype: None
+        """
+        if max_size < 1:
+            raise ConfigurationError('max_size must be at least 1')
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.profiler = profiler
+        self.__pool = {}
+        self.__lock = threading.Lock()
+
+    def _get_key(self, url):
+        """
+        Returns the pool key for an URL
+
+        :param url: URL
+        :type url: str
+        :raises: ConfigurationError if the URL isn't a HTTP(S) URL
+        :rtype: tuple of (scheme, host, port)
+        """
+        return get_endpoint(url)
+
+    def _new_connection(self, key):
+        """
+        :param key: Pool key
+        :type key: tuple of (scheme, host, port)
+        :rtype: HTTPConnection or HTTPSConnection
+        """
+        scheme, host, port = key
+        if scheme == 'https':
+            connection_class = HTTPSConnection
+        else:
+            connection_class = HTTPConnection
+        return connection_class(host, port, timeout=self.timeout)
+
+    def _get_connection(self, key):
+        """
+        Check out an idle connection, returns None if there is none
+
+        :param key: Pool key
+        :type key: tuple of (scheme, host, port)
+        :rtype: HTTPConnection or None
+        """
+        expired = []
+        connection = None
+        now = time.time()
+        with self.__lock:
+            idle = self.__pool.get(key)
+            while idle:
+                candidate, returned = idle.pop()
+                if now - returned > self.idle_timeout:
+                    expired.append(candidate)
+                    # Everything before this one is even older
+                    expired.extend(conn for conn, returned in idle)
+                    idle.clear()
+                else:
+                    connection = candidate
+        for conn in expired:
+            conn.close()
+        return connection
+
+    def _put_connection(self, key, connection):
+        """
+        Return a connection to the pool
+
+        :param key: Pool key
+        :type key: tuple of (scheme, host, port)
+        :param connection: Connection
+        :type connection: HTTPConnection
+        :rtype: None
+        """
+        with self.__lock:
+            idle = self.__pool.setdefault(key, collections.deque())
+            if len(idle) < self.max_size:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def idle_connections(self):
+        """
+        Returns the number of idle connections in the pool
+
+        :rtype: int
+        """
+        with self.__lock:
+            return sum(len(idle) for idle in self.__pool.values())
+
+    def close(self):
+        """
+        Close all idle connections
+
+        :rtype: None
+        """
+        with self.__lock:
+            pools = list(self.__pool.values())
+            self.__pool = {}
+        for idle in pools:
+            for connection, returned in idle:
+                connection.close()
+
+    def _exchange(self, connection, method, path, body, headers):
+        """
+        Send the request and read the response
+
+        :rtype: tuple of (HTTPResponse, bytes)
+        """
+        profiler = self.profiler
+        if profiler is None:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            return response, response.read()
+        started = now_ns()
+        if connection.sock is None:
+            connection.connect()
+            connected = now_ns()
+            profiler.record('connect', connected - started)
+            started = connected
+        connection.request(method, path, body, headers)
+        sent = now_ns()
+        profiler.record('send', sent - started)
+        response = connection.getresponse()
+        data = response.read()
+        profiler.record('read', now_ns() - sent)
+        return response, data
+
+    def _urlopen(self, method, url, body, headers):
+        """
+        Make one request, without following redirects
+
+        :rtype: Response
+        """
+        key = self._get_key(url)
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        connection = self._get_connection(key)
+        reused = connection is not None
+        if not reused:
+            connection = self._new_connection(key)
+        try:
+            response, data = self._exchange(connection, method, path, body,
+                                            headers)
+        except (HTTPException, socket.error) as e:
+            connection.close()
+            if not reused or not self._can_resend(method, e):
+                raise
+            # The server closed the idle connection, try a new one
+            connection = self._new_connection(key)
+            try:
+                response, data = self._exchange(connection, method, path,
+                                                body, headers)
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._put_connection(key, connection)
+        return Response(url, response.status, response.reason,
+                        response.getheaders(), data)
+
+    def _can_resend(self, method, exception):
+        """
+        Returns True if a request that failed on a reused connection can be
+        sent again. A POST may already have been processed unless the server
+        closed the connection without a response or before the request was
+        written.
+
+        :param method: HTTP method
+        :type method: str
+        :param exception: Error of the failed request
+        :type exception: Exception
+        :rtype: bool
+        """
+        if isinstance(exception, socket.timeout):
+            return False
+        if method.upper() in self.IDEMPOTENT_METHODS:
+            return True
+        # RemoteDisconnected is a BadStatusLine on Python 3
+        return isinstance(exception, BadStatusLine) or \
+            getattr(exception, 'errno', None) == errno.EPIPE
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Make a request, follows redirects like urlopen() does
+
+        :param method: HTTP method
+        :type method: str
+        :param url: URL
+        :type url: str
+        :param body: Request body
+        :type body: bytes or None
+        :param headers: Request headers
+        :type headers: dict or None
+        :raises: HTTPError for 4xx and 5xx responses, like urlopen()
+        :rtype: Response
+        """
+        headers = dict(headers or {})
+        for i in range(self.MAX_REDIRECTS + 1):
+            response = self._urlopen(method, url, body, headers)
+            location = response.getheader('Location')
+            if response.status not in self.REDIRECT_CODES or not location:
+                break
+            url = urljoin(url, location)
+            if response.status == 303 or (response.status in (301, 302) and
+                                           method == 'POST'):
+                method = 'GET'
+                body = None
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason,
+                            dict(response.headers), BytesIO(response.body))
+        return response
+
+
+class UrllibTransport(object):
+    """
+    Sends every request through urlopen() on a new connection, as piwikapi
+    did before the connection pool. Use this if you need urllib's proxy
+    support.
+    """
+    def request(self, method, url, body=None, headers=None):
+        """
+        Make a request, see HTTPConnectionPool.request()
+
+        :rtype: Response
+        """
+        request = Request(url, body)
+        for header, value in (headers or {}).items():
+            request.add_header(header, value)
+        response = urlopen(request)
+        data = response.read()
+        return Response(url, response.getcode(), getattr(response, 'msg', ''),
+                        list(response.info().items()), data)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """
+    Returns the connection pool shared by all trackers and analytics
+    objects that don't have their own transport set
+
+    :rtype: HTTPConnectionPool
+    """
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = HTTPConnectionPool()
+    return _default_pool
+
+
+def set_default_pool(pool):
+    """
+    Replace the shared connection pool
+
+    :param pool: Connection pool or another transport
+    :type pool: HTTPConnectionPool
+    :rtype: None
+    """
+    global _default_pool
+    _default_pool = pool
@@ -0,0 +1,108 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import binascii
+import os
+import threading
+import weakref
+
+from .exceptions import ConfigurationError
+
+
+class VisitorIdGenerator(object):
+    """
+    Generates random visitor IDs from a buffer of OS entropy
+
+    Every visitor ID is 8 random bytes formatted as 16 hex characters, the
+    format Piwik expects. The bytes are read from os.urandom() in chunks of
+    ``buffer_size`` IDs and hex encoded at once, so most IDs are just a
+    slice of a string.
+
+    The generator can be shared between threads. A forked child process
+    discards the buffer it inherited, so parent and child never hand out
+    the same IDs.
+    """
+    #: Random bytes per visitor ID
+    ID_BYTES = 8
+
+    def __init__(self, buffer_size=1024):
+        """
+        :param buffer_size: Number of visitor IDs to fetch at once
+        :type buffer_size: int
+        :rtype: None
+        """
+        if buffer_size < 1:
+            raise ConfigurationError('buffer_size must be at least 1')
+        self.buffer_size = buffer_size
+        self.__lock = threading.Lock()
+        self.__reset()
+        _generators.add(self)
+
+    def __reset(self):
+        self.__buffer = ''
+        self.__offset = 0
+        self.__pid = os.getpid()
+
+    def _after_fork(self):
+        """
+        Drop the buffer inherited from the parent process
+
+        :rtype: None
+        """
+        self.__lock = threading.Lock()
+        self.__reset()
+
+    def get(self):
+        """
+        Returns a new visitor ID
+
+        :rtype: str
+        """
+        length = self.ID_BYTES * 2
+        with self.__lock:
+            # _pid is None when os.register_at_fork() isn't available
+            if self.__pid != _pid and self.__pid != os.getpid():
+                self.__reset()
+            offset = self.__offset
+            if offset >= len(self.__buffer):
+                data = os.urandom(self.ID_BYTES * self.buffer_size)
+                self.__buffer = binascii.hexlify(data).decode('ascii')
+                offset = 0
+            self.__offset = offset + length
+            return self.__buffer[offset:offset + length]
+
+
+_generators = weakref.WeakSet()
+_pid = os.getpid()
+
+
+def _after_fork():
+    global _pid
+    _pid = os.getpid()
+    for generator in list(_generators):
+        generator._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+else:
+    # The generators compare the PID on every call instead
+    _pid = None
+
+
+_default_generator = VisitorIdGenerator()
+
+
+def get_visitor_id():
+    """
+    Returns a new visitor ID from the shared generator
+
+    :rtype: str
+    """
+    return _default_generator.get()
@@ -0,0 +1,192 @@
+"""
+Copyright (c) 2012-2013, Nicolas Kuttler.
+All rights reserved.
+
+License: BSD, see LICENSE for details
+
+Source and development at https://github.com/piwik/piwik-python-api
+"""
+
+import logging
+import re
+
+
+class EnvironRequest(object):
+    """
+    Wraps a WSGI environ so the trackers can read it like a Django request,
+    the environ already has the keys of Django's ``request.META``
+    """
+    __slots__ = ('META',)
+
+    def __init__(self, environ):
+        """
+        :param environ: WSGI environ
+        :type environ: dict
+        :rtype: None
+        """
+        self.META = environ
+
+    def is_secure(self):
+        """
+        :rtype: bool
+        """
+        return self.META.get('wsgi.url_scheme') == 'https'
+
+
+def default_get_title(environ, status, headers):
+    """
+    Track successful responses without a title, Piwik then uses the URL
+
+    :param environ: WSGI environ or ASGI scope
+    :type environ: dict
+    :param status: HTTP status code
+    :type status: int
+    :param headers: Response headers
+    :type headers: list
+    :rtype: str or None
+    """
+    if 200 <= status < 300:
+        return ''
+    return None
+
+
+class TrackingMiddlewareMixin(object):
+    """
+    The configuration shared by the WSGI and ASGI middleware
+    """
+    def __init__(self, app, template, exclude=(), exclude_regex=None,
+                 get_title=default_get_title, track_ip=True):
+        """
+        :param app: The application
+        :type app: callable
+        :param template: Template for the trackers, set a dispatcher or bulk
+            tracker on it to not send the hits from the request thread
+        :type template: piwikapi.template.PiwikTrackerTemplate
+        :param exclude: Path prefixes that aren't tracked
+        :type exclude: tuple of str
+        :param exclude_regex: Regular expression matching paths that aren't
+            tracked
+        :type exclude_regex: str or None
+        :param get_title: Called with the environ or scope, the status code
+            and the response headers after the response was sent. Returns
+            the page title, or None to not track the request.
+        :type get_title: callable
+        :param track_ip: Send the client IP, requires an auth token
+        :type track_ip: bool
+        :rtype: None
+        """
+        self.app = app
+        self.template = template
+        self.exclude = tuple(exclude)
+        if exclude_regex is not None:
+            exclude_regex = re.compile(exclude_regex)
+        self.exclude_regex = exclude_regex
+        self.get_title = get_title
+        self.track_ip = track_ip
+
+    def is_excluded(self, path):
+        """
+        :param path: Request path
+        :type path: str
+        :rtype: bool
+        """
+        if self.exclude and path.startswith(self.exclude):
+            return True
+        return self.exclude_regex is not None and \
+            self.exclude_regex.match(path) is not None
+
+    def get_tracker(self, request, ip):
+        """
+        :param request: Request
+        :type request: A Django-like request object
+        :param ip: Client IP
+        :type ip: str or None
+        :rtype: piwikapi.tracking.PiwikTracker
+        """
+        tracker = self.template.get_tracker(request)
+        if self.track_ip and ip and tracker.token_auth:
+            tracker.set_ip(ip)
+        return tracker
+
+
+class PiwikWSGIMiddleware(TrackingMiddlewareMixin):
+    """
+    Tracks a page view for every request of a WSGI application
+
+    The page view is tracked when the server closes the response, after it
+    was sent to the client::
+
+        from piwikapi.template import PiwikTrackerTemplate
+        from piwikapi.wsgi import PiwikWSGIMiddleware
+
+        template = PiwikTrackerTemplate(
+            1, 'http://yoursite.example.com/piwik.php',
+            token_auth='YOUR_AUTH_TOKEN_STRING', dispatcher=dispatcher)
+        application = PiwikWSGIMiddleware(application, template,
+                                          exclude=('/static/',))
+    """
+    def __call__(self, environ, start_response):
+        if self.is_excluded(environ.get('PATH_INFO', '')):
+            return self.app(environ, start_response)
+        response = TrackedResponse(self, environ, start_response)
+        response.iterable = self.app(environ, response.start_response)
+        return response
+
+    def track(self, environ, status, headers):
+        """
+        Track the page view of a finished request, errors are logged
+
+        :param environ: WSGI environ
+        :type environ: dict
+        :param status: HTTP status line, e.g. '200 OK'
+        :type status: str
+        :param headers: Response headers
+        :type headers: list
+        :rtype: None
+        """
+        try:
+            title = self.get_title(environ, int(status[:3]), headers)
+            if title is None:
+                return
+            tracker = self.get_tracker(EnvironRequest(environ),
+                                       environ.get('REMOTE_ADDR'))
+            tracker.do_track_page_view(title)
+        except Exception:
+            logging.exception("Failed to track %s" %
+                              environ.get('PATH_INFO'))
+
+
+class TrackedResponse(object):
+    """
+    The response iterable of the WSGI middleware, tracks the page view in
+    close()
+    """
+    __slots__ = ('middleware', 'environ', 'iterable', 'status', 'headers',
+                 '_start_response')
+
+    def __init__(self, middleware, environ, start_response):
+        self.middleware = middleware
+        self.environ = environ
+        self.iterable = ()
+        self.status = None
+        self.headers = None
+        self._start_response = start_response
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = headers
+        if exc_info is None:
+            return self._start_response(status, headers)
+        return self._start_response(status, headers, exc_info)
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            if self.status is not None:
+                self.middleware.track(self.environ, self.status,
+                                      self.headers)
@@ -6,6 +6,7 @@ setup(
     version = "0.3",
     packages = (
         'piwikapi',
+        'piwikapi.benchmarks',
         'piwikapi.plugins',
         'piwikapi.tests',
     ),